@@ -62,6 +62,19 @@ class EELSConfig(t.HasTraits):
         Path to the directory containing the Hartree-Slater GOS files as provided
         by Gatan DigitalMicrograph Suite v1.x and v2.x, more recent versions
         are not supported.
+    eels_cross_section_cache : bool
+        If True, the integrated cross sections of the EELS edge components
+        are stored on disk and reused when an edge with the same GOS and
+        microscope parameters is created again.
+    eels_cross_section_cache_size : float
+        Maximum size in MB of the cross section cache. When exceeded, the
+        least recently used cross sections are removed.
+    eels_gos_table_cache : bool
+        If True, the tables parsed from the Hartree-Slater GOS files are
+        stored on disk and reused until the files change.
+    eels_gos_table_cache_size : float
+        Maximum size in MB of the GOS table cache. When exceeded, the least
+        recently used tables are removed.
     """
 
     eels_gos_files_path = t.Directory(
@@ -69,6 +82,30 @@ class EELSConfig(t.HasTraits):
         label="Hartree-Slater GOS directory (GMS v1 and v2)",
         desc="The GOS files are used to create the EELS edge components",
     )
+    eels_cross_section_cache = t.CBool(
+        False,
+        label="Cache the integrated cross sections",
+        desc="If enabled, the integrated cross sections of the EELS edge "
+        "components are stored in the eXSpy configuration folder and reused "
+        "when creating the same edges again.",
+    )
+    eels_cross_section_cache_size = t.CFloat(
+        100.0,
+        label="Cross section cache size (MB)",
+        desc="Maximum size of the cross section cache in MB.",
+    )
+    eels_gos_table_cache = t.CBool(
+        False,
+        label="Cache the parsed GOS tables",
+        desc="If enabled, the tables parsed from the Hartree-Slater GOS files "
+        "are stored in the eXSpy configuration folder and reused until the "
+        "files change.",
+    )
+    eels_gos_table_cache_size = t.CFloat(
+        500.0,
+        label="GOS table cache size (MB)",
+        desc="Maximum size of the GOS table cache in MB.",
+    )
 
 
 class EDSConfig(t.HasTraits):
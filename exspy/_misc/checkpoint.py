@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+"""Checkpointing of the fit of models at all navigation positions."""
+
+import os
+import pickle
+
+import numpy as np
+from hyperspy.external.progressbar import progressbar
+
+from exspy._misc.eels.neighbour_fit import get_pixel_order
+
+
+def save_checkpoint(model, filename, done):
+    """Save the parameter maps of a model and the fitted pixels.
+
+    The file is a pickle of a dictionary with the ``"model"`` and ``"done"``
+    keys, where ``"model"`` is given by
+    :py:meth:`~hyperspy.model.BaseModel.as_dictionary`, where the
+    low-loss signal of EELS models is replaced by None, and ``"done"`` is
+    the array of the
+    fitted pixels. The file is replaced atomically, so that the previous
+    checkpoint is kept if the process is killed while saving.
+
+    """
+    dictionary = model.as_dictionary(fullcopy=False)
+    if "low_loss" in dictionary:
+        # The low-loss signal is not needed to restore the parameter maps
+        dictionary["low_loss"] = None
+    temporary = f"{filename}.tmp"
+    with open(temporary, "wb") as f:
+        pickle.dump(
+            {"model": dictionary, "done": done}, f, protocol=pickle.HIGHEST_PROTOCOL
+        )
+    os.replace(temporary, filename)
+
+
+def load_checkpoint(model, filename):
+    """Load the parameter maps of a checkpoint in a model.
+
+    Only load checkpoints from trusted sources, as they are pickle files.
+
+    Returns
+    -------
+    numpy.ndarray of bool
+        The pixels which are fitted.
+
+    """
+    with open(filename, "rb") as f:
+        checkpoint = pickle.load(f)
+    dictionary, done = checkpoint["model"], checkpoint["done"]
+    names = [c["name"] for c in dictionary["components"]]
+    if names != [c.name for c in model] or (
+        done.shape != model.axes_manager._navigation_shape_in_array
+    ):
+        raise ValueError(
+            f"The checkpoint {filename} does not match the model: it has the "
+            f"components {names} and the navigation shape {done.shape}."
+        )
+    for component, component_dictionary in zip(model, dictionary["components"]):
+        maps = {p["_id_name"]: p["map"] for p in component_dictionary["parameters"]}
+        for parameter in component.parameters:
+            parameter.map[...] = maps[parameter._id_name]
+    model.chisq.data[:] = dictionary["chisq.data"]
+    model.dof.data[:] = dictionary["dof.data"]
+    return done
+
+
+def checkpointed_multifit(
+    model,
+    multifit,
+    filename,
+    checkpoint_every=1000,
+    resume=False,
+    mask=None,
+    iterpath=None,
+    show_progressbar=None,
+    incremental=False,
+):
+    """Fit a model at all navigation positions, saving a checkpoint after
+    fitting every ``checkpoint_every`` pixels.
+
+    Parameters
+    ----------
+    model : hyperspy.model.BaseModel
+        The model.
+    multifit : callable
+        The function fitting the pixels of the list of navigation indices
+        given as its ``iterpath`` argument. See ``incremental``.
+    filename : str or os.PathLike
+        The checkpoint file.
+    checkpoint_every : int
+        The number of pixels fitted between two checkpoints.
+    resume : bool
+        If True and ``filename`` exists, the parameter maps are loaded from
+        it and only the pixels which are not fitted yet are fitted.
+    mask : numpy.ndarray of bool, optional
+        The pixels which are not fitted.
+    iterpath : str or list of tuple, optional
+        The order of the pixels.
+    show_progressbar : bool, optional
+        Whether to show a progress bar.
+    incremental : bool
+        If False, ``multifit`` is called for each block of
+        ``checkpoint_every`` pixels. If True, ``multifit`` is called once for
+        all the pixels with the ``done`` argument, the mask of the fitted
+        pixels, which it must update in place, the ``callback`` argument,
+        which it must call after fitting each pixel, and the
+        ``show_progressbar`` argument. This keeps the state of ``multifit``,
+        e.g. the pixels fitted again later by
+        :func:`~exspy._misc.eels.neighbour_fit.neighbour_multifit`, from
+        depending on ``checkpoint_every``.
+
+    """
+    axes_manager = model.axes_manager
+    if resume and os.path.exists(filename):
+        done = load_checkpoint(model, filename)
+        model.fetch_stored_values()
+    else:
+        done = np.zeros(axes_manager._navigation_shape_in_array, dtype=bool)
+    if iterpath is None:
+        iterpath = axes_manager.iterpath
+    if isinstance(iterpath, str):
+        pixels = get_pixel_order(axes_manager.navigation_shape, iterpath)
+    else:
+        pixels = [tuple(index) for index in iterpath]
+    skip = done if mask is None else done | mask
+    pixels = [index for index in pixels if not skip[index[::-1]]]
+
+    if incremental:
+        fitted = 0
+
+        def callback():
+            nonlocal fitted
+            fitted += 1
+            if fitted % checkpoint_every == 0:
+                save_checkpoint(model, filename, done)
+
+        multifit(
+            iterpath=pixels,
+            done=done,
+            callback=callback,
+            show_progressbar=show_progressbar,
+        )
+        if not pixels or fitted % checkpoint_every:
+            save_checkpoint(model, filename, done)
+        return
+
+    with progressbar(
+        total=len(pixels), disable=not show_progressbar, leave=True
+    ) as pbar:
+        for start in range(0, len(pixels), checkpoint_every):
+            block = pixels[start : start + checkpoint_every]
+            multifit(iterpath=block)
+            done[tuple(np.array(block)[:, ::-1].T)] = True
+            save_checkpoint(model, filename, done)
+            pbar.update(len(block))
+    if not pixels:
+        save_checkpoint(model, filename, done)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from exspy._defaults_parser import config_path, preferences
+
+
+_logger = logging.getLogger(__name__)
+
+# Increase when the format of the cache files or the calculation of the
+# cached cross sections changes to invalidate the existing cache files
+CACHE_VERSION = 1
+
+
+class ArrayCache:
+    """Size-bounded on-disk cache of numpy arrays, e.g. the integrated EELS
+    cross sections or the parsed GOS tables.
+
+    Each entry is stored as a ``.npz`` file whose name is a hash of the
+    key. When the total size of the cache exceeds ``max_size``, the least
+    recently used entries are removed.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The directory where the cache files are stored.
+    max_size : float
+        Maximum size of the cache in bytes.
+
+    """
+
+    def __init__(self, path, max_size):
+        self.path = Path(path)
+        self.max_size = max_size
+
+    @staticmethod
+    def hash_key(key):
+        """Return the file name stem corresponding to ``key``.
+
+        Parameters
+        ----------
+        key : tuple
+            Tuple of str, int and float identifying the cached arrays.
+
+        """
+        return hashlib.sha1(repr((CACHE_VERSION,) + tuple(key)).encode()).hexdigest()
+
+    def _get_filename(self, key):
+        return self.path / f"{self.hash_key(key)}.npz"
+
+    def get(self, key):
+        """Return the cached arrays as a dictionary or None if ``key`` is not
+        in the cache."""
+        filename = self._get_filename(key)
+        try:
+            with np.load(filename) as f:
+                arrays = {name: f[name] for name in f.files}
+        except OSError:
+            # Missing file or unreadable cache directory
+            return None
+        except Exception:
+            # Corrupted or incompatible file
+            _logger.debug(f"Removing invalid cache file {filename}")
+            filename.unlink(missing_ok=True)
+            return None
+        # Keep track of the last access for the eviction
+        try:
+            os.utime(filename)
+        except OSError:  # pragma: no cover
+            pass
+        return arrays
+
+    def set(self, key, **arrays):
+        """Store the given arrays in the cache under ``key``."""
+        filename = self._get_filename(key)
+        tmp = None
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so that other processes sharing
+            # the cache never read a partially written file
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, filename)
+        except OSError as e:
+            # A cache which can't be written, e.g. in a read-only directory,
+            # must not prevent creating the components
+            _logger.warning(f"The arrays could not be cached in {self.path}: {e}")
+            if tmp is not None:
+                Path(tmp).unlink(missing_ok=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache size is
+        below ``max_size``."""
+        entries = []
+        for filename in self.path.glob("*.npz"):
+            try:
+                stat = filename.stat()
+            except FileNotFoundError:  # pragma: no cover
+                # Removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+        size = sum(entry[1] for entry in entries)
+        for _, file_size, filename in sorted(entries):
+            if size <= self.max_size:
+                break
+            filename.unlink(missing_ok=True)
+            size -= file_size
+
+    def clear(self):
+        """Remove all the entries of the cache."""
+        for filename in self.path.glob("*.npz"):
+            filename.unlink(missing_ok=True)
+
+
+def get_cross_section_cache():
+    """Return the cross section cache defined in the preferences or None if
+    the cache is disabled."""
+    if not preferences.EELS.eels_cross_section_cache:
+        return None
+    return ArrayCache(
+        Path(config_path, "cross_sections"),
+        max_size=preferences.EELS.eels_cross_section_cache_size * 1e6,
+    )
+
+
+def get_gos_table_cache():
+    """Return the cache of the GOS tables parsed from text files, e.g. the
+    Hartree-Slater GOS files, defined in the preferences or None if the cache
+    is disabled."""
+    if not preferences.EELS.eels_gos_table_cache:
+        return None
+    return ArrayCache(
+        Path(config_path, "gos_tables"),
+        max_size=preferences.EELS.eels_gos_table_cache_size * 1e6,
+    )
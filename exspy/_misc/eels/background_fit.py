@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+"""Fitting of power law backgrounds to many spectra at once."""
+
+import numpy as np
+
+
+def _solve_2x2(a, b, c, u, v):
+    """Solve the symmetric systems ``[[a, b], [b, c]] @ x = [u, v]``."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        det = a * c - b * b
+        return (c * u - b * v) / det, (a * v - b * u) / det
+
+
+def _power_law(x, r, shift, ratio):
+    """Return the power law with unit amplitude and its derivative with
+    respect to the exponent ``r``, of shape ``(n_pixels, n_channels)``."""
+    f = x**-r
+    dfdr = -f * np.log(x)
+    if shift is not None:
+        x2 = x - shift
+        f2 = ratio * x2**-r
+        f = f + f2
+        dfdr = dfdr - f2 * np.log(x2)
+    return f, dfdr
+
+
+def _amplitude(f, y, w2):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (w2 * f * y).sum(-1, keepdims=True) / (w2 * f * f).sum(-1, keepdims=True)
+
+
+def fit_power_law(
+    x,
+    data,
+    weights=None,
+    scale=1.0,
+    shift=None,
+    ratio=1.0,
+    iterations=5,
+):
+    """Fit a power law to many spectra at once.
+
+    The function fitted is ``A * scale * x**-r``, or
+    ``A * scale * (ratio * (x - shift)**-r + x**-r)`` if ``shift`` is given.
+    The exponent of a single power law is first estimated by weighted least
+    squares in logarithmic scale, which is refined by Gauss-Newton steps
+    minimising the weighted sum of the squared residuals.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The energies relative to the origin of the power law, of shape
+        ``(n_channels,)``. They must be positive.
+    data : numpy.ndarray
+        The spectra, of shape ``(n_pixels, n_channels)``.
+    weights : numpy.ndarray, optional
+        The inverse of the standard deviation of the data, of shape
+        ``(n_channels,)`` or ``(n_pixels, n_channels)``. The channels with a
+        zero weight are not fitted. If None, all the channels have the same
+        weight.
+    scale : float or numpy.ndarray
+        The scale of the binned energy axis, of shape ``(n_channels,)``.
+    shift, ratio : float, optional
+        The shift and the ratio of the second power law, if any.
+    iterations : int
+        The number of Gauss-Newton steps.
+
+    Returns
+    -------
+    A, r, A_std, r_std : numpy.ndarray
+        The parameters and their standard deviation, of shape
+        ``(n_pixels,)``. The standard deviation is scaled by the reduced
+        chi-squared if ``weights`` is None.
+
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(data, dtype=float)
+    w = np.ones_like(y) if weights is None else np.broadcast_to(weights, y.shape)
+    # The non-finite channels are not fitted
+    finite = np.isfinite(y) & np.isfinite(w)
+    w = np.where(finite, w, 0.0)
+    y = np.where(finite, y, 0.0)
+    w2 = w * w
+
+    # Weighted linear fit of log(y) = log(A * scale) - r * log(x), where the
+    # standard deviation of log(y) is the relative standard deviation of y
+    positive = y > 0
+    logy = np.log(np.where(positive, y, 1.0) / scale)
+    wl2 = np.where(positive, w * y, 0.0) ** 2
+    logx = -np.log(x)
+    s0 = wl2.sum(-1)
+    s1 = (wl2 * logx).sum(-1)
+    s2 = (wl2 * logx * logx).sum(-1)
+    _, r = _solve_2x2(s0, s1, s2, (wl2 * logy).sum(-1), (wl2 * logy * logx).sum(-1))
+    r = r[:, np.newaxis]
+
+    # Gauss-Newton steps with the amplitude at its optimum for the exponent
+    for _ in range(iterations):
+        f, dfdr = _power_law(x, r, shift, ratio)
+        f, dfdr = f * scale, dfdr * scale
+        A = _amplitude(f, y, w2)
+        residual = w2 * (y - A * f)
+        g = A * dfdr
+        _, dr = _solve_2x2(
+            (w2 * f * f).sum(-1),
+            (w2 * f * g).sum(-1),
+            (w2 * g * g).sum(-1),
+            (residual * f).sum(-1),
+            (residual * g).sum(-1),
+        )
+        r = r + np.nan_to_num(dr)[:, np.newaxis]
+
+    f, dfdr = _power_law(x, r, shift, ratio)
+    f, dfdr = f * scale, dfdr * scale
+    A = _amplitude(f, y, w2)
+    g = A * dfdr
+    a, b, c = (w2 * f * f).sum(-1), (w2 * f * g).sum(-1), (w2 * g * g).sum(-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        det = a * c - b * b
+        variance_A, variance_r = c / det, a / det
+        if weights is None:
+            dof = np.count_nonzero(w, axis=-1) - 2
+            chisq = (w2 * (y - A * f) ** 2).sum(-1)
+            variance_A = variance_A * chisq / dof
+            variance_r = variance_r * chisq / dof
+    return A[:, 0], r[:, 0], np.sqrt(variance_A), np.sqrt(variance_r)
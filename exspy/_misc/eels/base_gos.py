@@ -17,10 +17,13 @@
 # along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
 
 
+import hashlib
 import math
+import threading
+import weakref
 
 import numpy as np
-from scipy import constants, integrate, interpolate
+from scipy import constants, interpolate
 
 from exspy._misc.elements import elements
 from hyperspy.misc.export_dictionary import (
@@ -34,6 +37,173 @@ R = constants.value("Rydberg constant times hc in eV")
 a0 = constants.value("Bohr radius")
 
 
+def _simpson_rows(y, x, npoints):
+    """Composite Simpson integration of ragged rows in a single pass.
+
+    Equivalent to calling :func:`scipy.integrate.simpson` on
+    ``y[i, :npoints[i]]`` with ``x[i, :npoints[i]]`` for every row ``i``,
+    including the correction applied to the last interval when the
+    number of points is even.
+
+    Parameters
+    ----------
+    y, x : numpy.ndarray
+        2D arrays of shape (nrows, npoints.max()). Each row must be left
+        aligned, the values beyond ``npoints`` are ignored.
+    npoints : numpy.ndarray
+        The number of valid points of each row. All values must be >= 2.
+
+    Returns
+    -------
+    numpy.ndarray
+        The integral of each row.
+
+    """
+    npoints = np.asarray(npoints)
+    rows = np.arange(y.shape[0])
+    h = np.diff(x, axis=-1)
+    h0 = h[:, 0:-1:2]
+    h1 = h[:, 1::2]
+    y0 = y[:, 0:-2:2]
+    y1 = y[:, 1:-1:2]
+    y2 = y[:, 2::2]
+    hsum = h0 + h1
+    hprod = h0 * h1
+    h0divh1 = np.true_divide(h0, h1, out=np.zeros_like(h0), where=h1 != 0)
+    panels = (
+        hsum
+        / 6.0
+        * (
+            y0
+            * (
+                2.0
+                - np.true_divide(
+                    1.0, h0divh1, out=np.zeros_like(h0divh1), where=h0divh1 != 0
+                )
+            )
+            + y1
+            * (
+                hsum
+                * np.true_divide(hsum, hprod, out=np.zeros_like(hsum), where=hprod != 0)
+            )
+            + y2 * (2.0 - h0divh1)
+        )
+    )
+    # Index of the last point used by the Simpson panels of each row: the
+    # last point for odd rows and the one before for even rows, that are
+    # completed with a last interval correction.
+    even = npoints % 2 == 0
+    last = npoints - 1 - even
+    panel_end = 2 * np.arange(panels.shape[1]) + 2
+    result = np.where(panel_end <= last[:, np.newaxis], panels, 0.0).sum(axis=-1)
+
+    # Last interval correction for rows with an even number of points.
+    # See scipy.integrate.simpson for details.
+    n = npoints[even]
+    if n.size:
+        r = rows[even]
+        i1 = n - 1
+        hm2 = x[r, i1 - 1] - x[r, i1 - 2]
+        hm1 = x[r, i1] - x[r, i1 - 1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            alpha = (2 * hm1**2 + 3 * hm2 * hm1) / (6 * (hm1 + hm2))
+            beta = (hm1**2 + 3.0 * hm2 * hm1) / (6 * hm2)
+            eta = hm1**3 / (6 * hm2 * (hm2 + hm1))
+        correction = (
+            np.nan_to_num(alpha) * y[r, i1]
+            + np.nan_to_num(beta) * y[r, i1 - 1]
+            - np.nan_to_num(eta) * y[r, i1 - 2]
+        )
+        # With only two points, it is the trapezoidal rule
+        correction = np.where(n == 2, 0.5 * hm1 * (y[r, i1] + y[r, i1 - 1]), correction)
+        result[even] += correction
+    return result
+
+
+def _hash_arrays(*arrays):
+    h = hashlib.sha1()
+    for array in arrays:
+        h.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    return h.hexdigest()
+
+
+class GOSTable:
+    """Read-only GOS table that can be shared between GOS instances.
+
+    Parameters
+    ----------
+    gos_array, qaxis, rel_energy_axis : numpy.ndarray
+        The tabulated GOS, q axis and energy axis relative to the onset
+        energy. Writeable arrays are copied so that the table cannot be
+        modified through the arrays of the caller.
+
+    """
+
+    def __init__(self, gos_array, qaxis, rel_energy_axis):
+        arrays = []
+        for array in (gos_array, qaxis, rel_energy_axis):
+            array = np.asarray(array)
+            if array.flags.writeable:
+                array = array.copy()
+                array.setflags(write=False)
+            arrays.append(array)
+        self.gos_array, self.qaxis, self.rel_energy_axis = arrays
+        self._hash = None
+
+    @property
+    def hash(self):
+        """Hash of the content of the table."""
+        if self._hash is None:
+            self._hash = _hash_arrays(self.gos_array, self.qaxis, self.rel_energy_axis)
+        return self._hash
+
+
+# The tables are kept in the registry as long as a GOS uses them
+_GOS_TABLES = weakref.WeakValueDictionary()
+_GOS_TABLES_LOCK = threading.Lock()
+
+
+def get_shared_gos_table(key, load):
+    """Return the shared :class:`GOSTable` registered under ``key``.
+
+    Parameters
+    ----------
+    key : tuple
+        Identifier of the table, for example the file and table name.
+    load : callable
+        Function returning the ``(gos_array, qaxis, rel_energy_axis)``
+        arrays, only called when the table is not registered yet.
+
+    """
+    with _GOS_TABLES_LOCK:
+        table = _GOS_TABLES.get(key)
+        if table is None:
+            table = GOSTable(*load())
+            _GOS_TABLES[key] = table
+        return table
+
+
+def _share_gos_table(table):
+    """Return the registered table with the same content as ``table`` or
+    register ``table`` if there is none."""
+    key = ("content", table.hash)
+    with _GOS_TABLES_LOCK:
+        return _GOS_TABLES.setdefault(key, table)
+
+
+def _table_property(name):
+    def fget(self):
+        if self._table is not None:
+            return getattr(self._table, name)
+        return self._private_table.get(name)
+
+    def fset(self, value):
+        self.copy_table()
+        self._private_table[name] = value
+
+    return property(fget, fset)
+
+
 class BaseGOS:
     def read_elements(self):
         element = self.element
@@ -56,10 +226,18 @@ class BaseGOS:
         self.Z = elements[element]["General_properties"]["Z"]
         self.element_dict = elements[element]
 
-    def get_parametrized_qaxis(self, k1, k2, n):
+    def _source_hash(self):
+        """Return a hash identifying the data from which the cross section
+        is calculated."""
+        source = f"{type(self).__name__}_{self.element}_{self.subshell}"
+        return hashlib.sha1(source.encode()).hexdigest()
+
+    @staticmethod
+    def get_parametrized_qaxis(k1, k2, n):
         return k1 * (np.exp(np.arange(n) * k2) - 1) * 1e10
 
-    def get_parametrized_energy_axis(self, k1, k2, n):
+    @staticmethod
+    def get_parametrized_energy_axis(k1, k2, n):
         return k1 * (np.exp(np.arange(n) * k2 / k1) - 1)
 
     def get_qaxis_and_gos(self, ienergy, qmin, qmax):
@@ -93,8 +271,125 @@ class BaseGOS:
             )
         return qaxis, qgosi.clip(0)
 
+    def get_qaxis_and_gos_nd(self, qmin, qmax):
+        """Vectorized version of :meth:`get_qaxis_and_gos` for all the
+        rows of the tabulated GOS at once.
+
+        Parameters
+        ----------
+        qmin, qmax : numpy.ndarray
+            The integration limits for each row of ``gos_array``.
+
+        Returns
+        -------
+        qaxis, gos : numpy.ndarray
+            2D arrays containing the q axis and GOS of each energy row,
+            left aligned and padded with the last value of the row.
+        npoints : numpy.ndarray
+            The number of valid points of each row.
+
+        """
+        q = self.qaxis
+        n = q.size
+        rows = np.arange(self.gos_array.shape[0])
+        # The tabulated points in the (qmin, qmax) range of each row are
+        # q[lo:hi]
+        hi = np.minimum(q.searchsorted(qmax), n)
+        lo = q.searchsorted(qmin)
+        # Linear interpolation (or extrapolation beyond the last
+        # tabulated value) of the GOS at qmax
+        j = np.clip(hi, 1, n - 1)
+        gosqmax = get_linear_interpolation(
+            (q[j - 1], self.gos_array[rows, j - 1]),
+            (q[j], self.gos_array[rows, j]),
+            qmax,
+        )
+        # Linear interpolation of the GOS at qmin, qmax being the upper
+        # point when qmin and qmax fall between the same tabulated values
+        k = np.clip(lo, 1, n - 1)
+        q2 = np.where(k < hi, q[k], qmax)
+        g2 = np.where(k < hi, self.gos_array[rows, k], gosqmax)
+        gosqmin = get_linear_interpolation(
+            (q[k - 1], self.gos_array[rows, k - 1]), (q2, g2), qmin
+        )
+
+        npoints = hi - lo + 2
+        column = np.arange(npoints.max())
+        index = np.clip(lo[:, np.newaxis] + column - 1, 0, n - 1)
+        first = column == 0
+        inner = (column >= 1) & (column <= (npoints - 2)[:, np.newaxis])
+        qaxis = np.where(
+            first,
+            qmin[:, np.newaxis],
+            np.where(inner, q[index], qmax[:, np.newaxis]),
+        )
+        gos = np.where(
+            first,
+            gosqmin[:, np.newaxis],
+            np.where(
+                inner,
+                np.take_along_axis(self.gos_array, index, axis=1),
+                gosqmax[:, np.newaxis],
+            ),
+        )
+        return qaxis, gos.clip(0), npoints
+
+    def _get_qa0sq_limits(self, E, angle, E0):
+        """Return the limits of the q integral in units of a0**-2 for the
+        energies ``E`` (eV), the collection semi-angle ``angle`` (rad) and
+        the beam energy ``E0`` (keV)."""
+        gamma = 1 + E0 / 511.06
+        T = 511060 * (1 - 1 / gamma**2) / 2
+        qa0sqmin = (E**2) / (4 * R * T) + (E**3) / (8 * gamma**3 * R * T**2)
+        p02 = T / (R * (1 - 2 * T / 511060))
+        pp2 = p02 - E / R * (gamma - E / 1022120)
+        qa0sqmax = qa0sqmin + 4 * np.sqrt(p02 * pp2) * (math.sin(angle / 2)) ** 2
+        return qa0sqmin, qa0sqmax
+
+    def _get_qa0sq_limits_derivative(self, E, angle, E0):
+        """Return the derivatives with respect to the energy of the limits
+        given by :meth:`_get_qa0sq_limits`."""
+        gamma = 1 + E0 / 511.06
+        T = 511060 * (1 - 1 / gamma**2) / 2
+        dqa0sqmin = E / (2 * R * T) + 3 * E**2 / (8 * gamma**3 * R * T**2)
+        p02 = T / (R * (1 - 2 * T / 511060))
+        pp2 = p02 - E / R * (gamma - E / 1022120)
+        dpp2 = -(gamma - E / 511060) / R
+        dqa0sqmax = (
+            dqa0sqmin + 2 * p02 * dpp2 / np.sqrt(p02 * pp2) * (math.sin(angle / 2)) ** 2
+        )
+        return dqa0sqmin, dqa0sqmax
+
+    def get_qint_shift_derivative(self, angle, E0):
+        """Return the derivative of ``qint`` with respect to the energy
+        shift, or None if it can't be calculated analytically.
+
+        Parameters
+        ----------
+        angle : float
+            The collection semi-angle in rad.
+        E0 : float
+            The beam energy in keV.
+
+        """
+        return None
+
 
 class TabulatedGOS(BaseGOS):
+    """Base class of the tabulated GOS.
+
+    The ``gos_array``, ``qaxis`` and ``rel_energy_axis`` tables are
+    read-only and shared between all the GOS created from the same data.
+    Setting any of them, or calling :meth:`copy_table`, gives the GOS a
+    private writeable copy of the tables.
+    """
+
+    _table = None
+
+    gos_array = _table_property("gos_array")
+    qaxis = _table_property("qaxis")
+    rel_energy_axis = _table_property("rel_energy_axis")
+
     def __init__(self, element_subshell):
         """
         Parameters
@@ -103,6 +398,7 @@ class TabulatedGOS(BaseGOS):
             For example, 'Ti_L3' for the GOS of the titanium L3 subshell
 
         """
+        self._private_table = {}
         self.subshell_factor = 1.0
         if isinstance(element_subshell, dict):
             self.element = element_subshell["element"]
@@ -116,37 +412,93 @@ class TabulatedGOS(BaseGOS):
 
     def _load_dictionary(self, dictionary):
         load_from_dictionary(self, dictionary)
+        # Share the tables with the GOS loaded from identical dictionaries,
+        # e.g. the same edge of several models
+        if all(
+            self._private_table.get(name) is not None
+            for name in ("gos_array", "qaxis", "rel_energy_axis")
+        ):
+            self._set_table(
+                _share_gos_table(
+                    GOSTable(self.gos_array, self.qaxis, self.rel_energy_axis)
+                )
+            )
         self.energy_axis = self.rel_energy_axis + self.onset_energy
 
+    def _set_table(self, table):
+        self._table = table
+        self._private_table = {}
+
+    def copy_table(self):
+        """Replace the shared read-only GOS tables with writeable copies
+        that can be edited without affecting other GOS."""
+        if self._table is not None:
+            table = self._table
+            self._table = None
+            self._private_table = {
+                name: getattr(table, name).copy()
+                for name in ("gos_array", "qaxis", "rel_energy_axis")
+            }
+
     def as_dictionary(self, fullcopy=True):
         """Export the GOS as a dictionary."""
         dic = {}
         export_to_dictionary(self, self._whitelist, dic, fullcopy)
         return dic
 
+    def _source_hash(self):
+        if self._table is not None:
+            table_hash = self._table.hash
+        else:
+            table_hash = _hash_arrays(self.gos_array, self.qaxis, self.rel_energy_axis)
+        h = hashlib.sha1(super()._source_hash().encode())
+        h.update(table_hash.encode())
+        h.update(repr(float(self.subshell_factor)).encode())
+        return h.hexdigest()
+
     def integrateq(self, onset_energy, angle, E0):
         energy_shift = onset_energy - self.onset_energy
         self.energy_shift = energy_shift
-        qint = np.zeros((self.energy_axis.shape[0]))
-        # Calculate the cross section at each energy position of the
-        # tabulated GOS
         gamma = 1 + E0 / 511.06
         T = 511060 * (1 - 1 / gamma**2) / 2
-        for i in range(0, self.gos_array.shape[0]):
-            E = self.energy_axis[i] + energy_shift
-            # Calculate the limits of the q integral
-            qa0sqmin = (E**2) / (4 * R * T) + (E**3) / (8 * gamma**3 * R * T**2)
-            p02 = T / (R * (1 - 2 * T / 511060))
-            pp2 = p02 - E / R * (gamma - E / 1022120)
-            qa0sqmax = qa0sqmin + 4 * np.sqrt(p02 * pp2) * (math.sin(angle / 2)) ** 2
-            qmin = math.sqrt(qa0sqmin) / a0
-            qmax = math.sqrt(qa0sqmax) / a0
-            # Perform the integration in a log grid
-            qaxis, gos = self.get_qaxis_and_gos(i, qmin, qmax)
-            logsqa0qaxis = np.log((a0 * qaxis) ** 2)
-            qint[i] = integrate.simpson(gos, x=logsqa0qaxis)
         E = self.energy_axis + energy_shift
+        # Calculate the limits of the q integral for all the energies of
+        # the tabulated GOS
+        qa0sqmin, qa0sqmax = self._get_qa0sq_limits(E, angle, E0)
+        qmin = np.sqrt(qa0sqmin) / a0
+        qmax = np.sqrt(qa0sqmax) / a0
+        # Perform the integration in a log grid, all rows at once
+        qaxis, gos, npoints = self.get_qaxis_and_gos_nd(qmin, qmax)
+        logsqa0qaxis = np.log((a0 * qaxis) ** 2)
+        qint = _simpson_rows(gos, logsqa0qaxis, npoints)
         # Energy differential cross section in (barn/eV/atom)
         qint *= (4.0 * np.pi * a0**2.0 * R**2 / E / T * self.subshell_factor) * 1e28
         self.qint = qint
         return interpolate.make_interp_spline(E, qint, k=3)
+
+    def get_qint_shift_derivative(self, angle, E0):
+        # The rows of the table do not depend on the energy shift, therefore
+        # the derivative of the integral over log(q**2) is given by the GOS
+        # at the limits of the integral, which move with the energy
+        gamma = 1 + E0 / 511.06
+        T = 511060 * (1 - 1 / gamma**2) / 2
+        E = self.energy_axis + self.energy_shift
+        qa0sqmin, qa0sqmax = self._get_qa0sq_limits(E, angle, E0)
+        dqa0sqmin, dqa0sqmax = self._get_qa0sq_limits_derivative(E, angle, E0)
+        q = self.qaxis
+        rows = np.arange(self.gos_array.shape[0])
+        gos = []
+        for qa0sq in (qa0sqmin, qa0sqmax):
+            qlimit = np.sqrt(qa0sq) / a0
+            j = np.clip(q.searchsorted(qlimit), 1, q.size - 1)
+            gos.append(
+                get_linear_interpolation(
+                    (q[j - 1], self.gos_array[rows, j - 1]),
+                    (q[j], self.gos_array[rows, j]),
+                    qlimit,
+                ).clip(0)
+            )
+        gosqmin, gosqmax = gos
+        factor = (4.0 * np.pi * a0**2.0 * R**2 / E / T * self.subshell_factor) * 1e28
+        dintegral = gosqmax * dqa0sqmax / qa0sqmax - gosqmin * dqa0sqmin / qa0sqmin
+        return factor * dintegral - self.qint / E
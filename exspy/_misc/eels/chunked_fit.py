@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+"""Fitting of models of lazy signals one chunk of the navigation space at
+a time."""
+
+import contextlib
+import itertools
+import os
+
+import numpy as np
+from hyperspy.external.progressbar import progressbar
+from hyperspy.signal import BaseSignal
+
+from exspy._misc.eels.neighbour_fit import ITERPATHS
+from exspy._misc.eels.parallel_fit import create_worker_pool, parallel_multifit
+
+
+def get_navigation_chunks(signal):
+    """Return the slices, in array order, of the navigation chunks of the
+    data of a lazy signal."""
+    nav_dim = signal.axes_manager.navigation_dimension
+    bounds = [np.cumsum((0,) + chunks) for chunks in signal.data.chunks[:nav_dim]]
+    return [
+        tuple(slice(int(b[i]), int(b[i + 1])) for b, i in zip(bounds, index))
+        for index in itertools.product(*(range(len(b) - 1) for b in bounds))
+    ]
+
+
+@contextlib.contextmanager
+def open_map_store(store):
+    """Open a store of parameter maps.
+
+    Parameters
+    ----------
+    store : str, os.PathLike, h5py.Group or zarr.Group
+        A group, or the path of a zarr store if it ends with ``".zarr"`` and
+        of a HDF5 file otherwise.
+
+    """
+    if not isinstance(store, (str, os.PathLike)):
+        yield store
+    elif str(store).endswith(".zarr"):
+        import zarr
+
+        yield zarr.open_group(str(store), mode="a")
+    else:
+        import h5py
+
+        with h5py.File(store, mode="a") as f:
+            yield f
+
+
+class MapWriter:
+    """Write the parameter maps of a model in a zarr or HDF5 group.
+
+    The maps of each parameter are saved in the ``values``, ``std`` and
+    ``is_set`` datasets of the ``<component>/<parameter>`` group and the
+    ``chisq`` and ``dof`` datasets of the model at the root of the group.
+    The datasets are chunked like the navigation space of the signal.
+
+    Parameters
+    ----------
+    group : h5py.Group or zarr.Group
+        The group the maps are written to.
+    model : hyperspy.model.BaseModel
+        The model.
+    chunks : tuple of int
+        The shape of the chunks of the navigation space, in array order.
+
+    """
+
+    def __init__(self, group, model, chunks):
+        self.datasets = []
+        for component in model:
+            for parameter in component.parameters:
+                for field in ("values", "std", "is_set"):
+                    array = parameter.map[field]
+                    name = f"{component.name}/{parameter.name}/{field}"
+                    self._add_dataset(group, name, array, chunks)
+        for name in ("chisq", "dof"):
+            array = getattr(model, name).data
+            self._add_dataset(group, name, array, chunks)
+
+    def _add_dataset(self, group, name, array, chunks):
+        dataset = group.require_dataset(
+            name,
+            shape=array.shape,
+            dtype=array.dtype,
+            chunks=chunks + array.shape[len(chunks) :],
+        )
+        self.datasets.append((dataset, array))
+
+    def write(self, slices=()):
+        """Write the maps of the given navigation slices, in array order."""
+        for dataset, array in self.datasets:
+            dataset[slices] = array[slices]
+
+
+def _compute(signal):
+    if isinstance(signal, BaseSignal) and signal._lazy:
+        signal.compute(show_progressbar=False)
+
+
+def chunked_multifit(model, mask=None, store=None, show_progressbar=None, **kwargs):
+    """Fit a model of a lazy signal one navigation chunk at a time.
+
+    See :meth:`exspy.models.EELSModel.multifit` for the parameters. When
+    fitting in parallel, the chunks are fitted in turn by the same pool of
+    worker processes.
+
+    """
+    if kwargs.get("iterpath") not in (None,) + ITERPATHS:
+        raise ValueError(
+            f"Only the {ITERPATHS} iterpaths are supported when fitting lazy signals."
+        )
+    signal = model.signal
+    nav_dim = signal.axes_manager.navigation_dimension
+    chunks = get_navigation_chunks(signal)
+    total = signal.axes_manager.navigation_size
+    if mask is not None:
+        total -= int(mask.sum())
+    with contextlib.ExitStack() as stack:
+        writer = None
+        if store is not None:
+            group = stack.enter_context(open_map_store(store))
+            chunk_shape = tuple(c[0] for c in signal.data.chunks[:nav_dim])
+            writer = MapWriter(group, model, chunk_shape)
+            writer.write()
+        num_workers = kwargs.get("num_workers")
+        executor = None
+        if num_workers not in (None, 1):
+            executor = stack.enter_context(create_worker_pool(num_workers))
+        pbar = stack.enter_context(
+            progressbar(total=total, disable=not show_progressbar, leave=True)
+        )
+        for slices in chunks:
+            chunk_mask = None if mask is None else mask[slices]
+            if chunk_mask is not None and chunk_mask.all():
+                continue
+            # Only the data of the chunk is loaded in memory
+            chunk_model = model.inav[slices[::-1]]
+            _compute(chunk_model.signal)
+            _compute(
+                chunk_model.signal.metadata.get_item("Signal.Noise_properties.variance")
+            )
+            _compute(getattr(chunk_model, "low_loss", None))
+            if executor is None:
+                chunk_model.multifit(mask=chunk_mask, show_progressbar=False, **kwargs)
+            else:
+                parallel_multifit(
+                    chunk_model,
+                    mask=chunk_mask,
+                    show_progressbar=False,
+                    executor=executor,
+                    **kwargs,
+                )
+
+            for component, chunk_component in zip(model, chunk_model):
+                for parameter, chunk_parameter in zip(
+                    component.parameters, chunk_component.parameters
+                ):
+                    parameter.map[slices] = chunk_parameter.map
+            model.chisq.data[slices] = chunk_model.chisq.data
+            model.dof.data[slices] = chunk_model.dof.data
+            if writer is not None:
+                writer.write(slices)
+            if chunk_mask is None:
+                pbar.update(chunk_model.axes_manager.navigation_size)
+            else:
+                pbar.update(int((~chunk_mask).sum()))
+    model.fetch_stored_values()
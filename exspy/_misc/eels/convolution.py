@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+"""Convolution of EELS models with the low-loss spectra."""
+
+import collections
+
+import numpy as np
+from scipy import fft
+
+# Maximum size in bytes of the FFTs of the low-loss spectra kept in memory
+LOW_LOSS_FFT_CACHE_SIZE = 256e6
+# Size in bytes of the chunks of pixels whose FFTs are computed at once
+LOW_LOSS_FFT_CHUNK_SIZE = 8e6
+
+
+class LowLossFFT:
+    """The FFTs of the low-loss spectra of a signal.
+
+    The FFTs are computed by chunks of pixels when they are first used and
+    the least recently used chunks are discarded when their size exceeds
+    ``max_size``. All the FFTs are discarded when the data of the signal is
+    replaced or when :meth:`clear` is called.
+
+    Parameters
+    ----------
+    signal : hyperspy.signal.BaseSignal
+        The low-loss spectra.
+    convolution_size : int
+        The size of the arrays that are convolved with the low-loss
+        spectra, i.e. of the convolution axis of the model.
+    max_size : float, optional
+        The maximum size in bytes of the FFTs kept in memory.
+    chunk_size : float, optional
+        The size in bytes of the chunks of pixels.
+
+    """
+
+    def __init__(
+        self,
+        signal,
+        convolution_size,
+        max_size=LOW_LOSS_FFT_CACHE_SIZE,
+        chunk_size=LOW_LOSS_FFT_CHUNK_SIZE,
+    ):
+        self.signal = signal
+        self.navigation_shape = signal.axes_manager._navigation_shape_in_array
+        self._npixels = int(np.prod(self.navigation_shape, dtype=int))
+        kernel_size = signal.axes_manager.signal_shape[0]
+        # The valid part of the linear convolution, which is not affected by
+        # the wrap around of the circular convolution of size nfft
+        self._valid = slice(kernel_size - 1, convolution_size)
+        self.nfft = fft.next_fast_len(convolution_size, real=True)
+        pixel_size = 16 * (self.nfft // 2 + 1)
+        self._chunk_pixels = max(1, int(chunk_size // pixel_size))
+        self._max_chunks = max(1, int(max_size // (pixel_size * self._chunk_pixels)))
+        self._chunks = collections.OrderedDict()
+        self._data = signal.data
+
+    def clear(self):
+        """Discard the FFTs, which are computed again from the data of the
+        low-loss spectra when they are next used."""
+        self._chunks.clear()
+        self._data = self.signal.data
+
+    def get_pixel(self, indices):
+        """Return the index of the pixel at the given navigation indices
+        in the flattened navigation space."""
+        if not self.navigation_shape:
+            return 0
+        return int(np.ravel_multi_index(indices[::-1], self.navigation_shape))
+
+    def _get_chunk(self, chunk):
+        if self.signal.data is not self._data:
+            # The data of the signal has been replaced
+            self.clear()
+        ffts = self._chunks.get(chunk)
+        if ffts is None:
+            start = chunk * self._chunk_pixels
+            stop = min(start + self._chunk_pixels, self._npixels)
+            data = self.signal.data.reshape(self._npixels, -1)[start:stop]
+            ffts = fft.rfft(np.asarray(data, dtype=float), self.nfft, axis=-1)
+            self._chunks[chunk] = ffts
+            while len(self._chunks) > self._max_chunks:
+                self._chunks.popitem(last=False)
+        else:
+            self._chunks.move_to_end(chunk)
+        return ffts
+
+    def get_fft(self, pixels):
+        """Return the FFTs of the low-loss spectra of the given pixels.
+
+        Parameters
+        ----------
+        pixels : int or numpy.ndarray of int
+            The indices of the pixels in the flattened navigation space.
+
+        """
+        if np.ndim(pixels) == 0:
+            chunk, row = divmod(int(pixels), self._chunk_pixels)
+            return self._get_chunk(chunk)[row]
+        pixels = np.asarray(pixels)
+        result = np.empty((len(pixels), self.nfft // 2 + 1), dtype=complex)
+        chunks = pixels // self._chunk_pixels
+        for chunk in np.unique(chunks):
+            selection = chunks == chunk
+            rows = pixels[selection] - chunk * self._chunk_pixels
+            result[selection] = self._get_chunk(chunk)[rows]
+        return result
+
+    def convolve(self, values, pixels):
+        """Convolve arrays with the low-loss spectra.
+
+        The result is the same as ``numpy.convolve(low_loss, values,
+        mode="valid")`` along the last axis.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            The arrays calculated on the convolution axis. If ``pixels`` is
+            an array, the first axis of ``values`` has the length of
+            ``pixels`` or one.
+        pixels : int or numpy.ndarray of int
+            The indices of the pixels in the flattened navigation space.
+
+        """
+        values = np.asarray(values, dtype=float)
+        kernel = self.get_fft(pixels)
+        if np.ndim(pixels):
+            kernel = kernel.reshape(
+                (len(kernel),) + (1,) * (values.ndim - 2) + kernel.shape[-1:]
+            )
+        result = fft.irfft(
+            fft.rfft(values, self.nfft, axis=-1) * kernel, self.nfft, axis=-1
+        )
+        return result[..., self._valid]
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+"""Richardson-Lucy deconvolution of many spectra at once."""
+
+import numpy as np
+from hyperspy.misc.math_tools import optimal_fft_size
+from scipy import fft
+
+# Size in bytes of the chunks of spectra deconvolved at once
+RICHARDSON_LUCY_CHUNK_SIZE = 16e6
+
+
+def _get_shifted_kernel_fft(kernel, shift, size):
+    """Return the FFT of the kernel padded to ``size`` and rolled by
+    ``shift``, so that the circular convolution by the rolled kernel
+    starting at index 0 is the linear convolution by the kernel starting at
+    index ``shift``."""
+    padded = np.zeros(kernel.shape[:-1] + (size,), dtype=kernel.dtype)
+    padded[..., : kernel.shape[-1]] = kernel
+    index = (np.arange(size) + shift) % size
+    return fft.rfft(np.take_along_axis(padded, index, axis=-1), axis=-1)
+
+
+def richardson_lucy(data, kernel, iterations=15):
+    """Richardson-Lucy deconvolution of spectra by kernels of the same size.
+
+    For every spectrum ``y`` and kernel ``k``, where ``n = y.size`` and
+    ``i = k.argmax()``, the iterations are::
+
+        x = y.copy()
+        for _ in range(iterations):
+            first = np.convolve(k, x)[i : i + n]
+            x *= np.convolve(k[::-1], y / first)[n - 1 - i : 2 * n - 1 - i]
+
+    where the convolutions of all the spectra are calculated at once with
+    FFTs of the spectra padded to avoid the circular wrap-around.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        The spectra, with the signal axis last.
+    kernel : numpy.ndarray
+        The kernels, with the signal axis last, which are broadcast against
+        the spectra.
+    iterations : int
+        The number of iterations.
+
+    Returns
+    -------
+    numpy.ndarray
+        The deconvolved spectra, which are single precision if the spectra
+        and the kernels are.
+
+    """
+    dtype = np.result_type(data.dtype, kernel.dtype, np.float32)
+    data = data.astype(dtype, copy=False)
+    kernel = kernel.astype(dtype, copy=False)
+    n = data.shape[-1]
+    size = optimal_fft_size(2 * n - 1, True)
+    shift = kernel.argmax(axis=-1)[..., np.newaxis]
+    kernel_fft = _get_shifted_kernel_fft(kernel, shift, size)
+    reversed_fft = _get_shifted_kernel_fft(kernel[..., ::-1], n - 1 - shift, size)
+    result = data.copy()
+    for _ in range(iterations):
+        first = fft.irfft(kernel_fft * fft.rfft(result, size), size)[..., :n]
+        result *= fft.irfft(reversed_fft * fft.rfft(data / first, size), size)[..., :n]
+    return result
+
+
+def get_chunk_rows(size, itemsize):
+    """Return the number of spectra of ``size`` channels deconvolved at once,
+    accounting for the padded FFTs."""
+    return max(1, int(RICHARDSON_LUCY_CHUNK_SIZE // (4 * size * itemsize)))
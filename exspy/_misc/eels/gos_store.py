@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+"""Compact binary store of GOS tables opened through memory mapping.
+
+A store is a single file made of a magic string, the size of the header,
+a JSON header and the arrays of the tables. The header contains the
+metadata of the database and, for each table, the offset, shape and dtype
+of its arrays. Each array is contiguous and aligned, so that it can be
+used directly from the memory mapped file. The processes that open the
+same store share its pages through the cache of the operating system.
+"""
+
+import json
+import os
+import struct
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"EXSPYGOS"
+# Increase when the layout of the file changes
+STORE_VERSION = 1
+# Name of the store of the Hartree-Slater GOS in the GOS directory
+HARTREE_SLATER_STORE_NAME = "Hartree-Slater.gosstore"
+_ALIGNMENT = 64
+_HEADER_SIZE = struct.Struct("<Q")
+_ARRAY_NAMES = ("gos_array", "qaxis", "rel_energy_axis")
+
+# Opened stores, indexed by file path
+_GOS_STORES = {}
+_GOS_STORES_LOCK = threading.Lock()
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _get_data_start(header_size):
+    # The offsets of the arrays are relative to the start of the data, which
+    # is aligned after the header
+    return _align(len(MAGIC) + _HEADER_SIZE.size + header_size)
+
+
+def is_gos_store(path):
+    """Return True if ``path`` is a GOS store file."""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class GOSStore:
+    """Read-only GOS store.
+
+    The file is memory mapped once and the arrays of the tables are views
+    of the mapping, therefore reading a table does not copy its data.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The path of the store file.
+
+    Attributes
+    ----------
+    source : str
+        The kind of GOS stored, ``"gosh"`` or ``"Hartree-Slater"``.
+    metadata : dict
+        The metadata of the database, e.g. the DOI and the ``edges_info``
+        of a GOSH database.
+
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a GOS store.")
+            (header_size,) = _HEADER_SIZE.unpack(f.read(_HEADER_SIZE.size))
+            header = json.loads(f.read(header_size).decode())
+        self._data_start = _get_data_start(header_size)
+        if header["version"] != STORE_VERSION:
+            raise ValueError(
+                f"The version {header['version']} of the GOS store {self.path} "
+                "is not supported, convert the GOS files again."
+            )
+        self.source = header["source"]
+        self.metadata = header["metadata"]
+        self._index = header["tables"]
+        self._mmap = np.memmap(self.path, dtype=np.uint8, mode="r")
+
+    @property
+    def doi(self):
+        """The DOI of the data, if any."""
+        return self.metadata.get("doi")
+
+    @property
+    def edges_info(self):
+        """For each subshell of a GOSH database, a dictionary with the
+        ``"table"`` name and the ``"occupancy_ratio"``."""
+        return self.metadata.get("edges_info", {})
+
+    @property
+    def tables(self):
+        """The names of the tables in the store, as ``"element/table"``."""
+        return list(self._index)
+
+    def has_table(self, element, table):
+        """Return True if the store contains the table of the given
+        element."""
+        return f"{element}/{table}" in self._index
+
+    def get_table(self, element, table):
+        """Return the GOS table of an element.
+
+        Returns
+        -------
+        gos_array, qaxis, rel_energy_axis : numpy.ndarray
+            Read-only views of the memory mapped file.
+
+        """
+        arrays = []
+        for name in _ARRAY_NAMES:
+            info = self._index[f"{element}/{table}"][name]
+            array = np.ndarray(
+                shape=tuple(info["shape"]),
+                dtype=np.dtype(info["dtype"]),
+                buffer=self._mmap,
+                offset=self._data_start + info["offset"],
+            )
+            arrays.append(array)
+        return tuple(arrays)
+
+
+def get_gos_store(path):
+    """Return the :class:`GOSStore` of the given file, opening it if it is
+    not already open in this process."""
+    key = os.path.realpath(path)
+    with _GOS_STORES_LOCK:
+        store = _GOS_STORES.get(key)
+        if store is None:
+            store = GOSStore(path)
+            _GOS_STORES[key] = store
+        return store
+
+
+def write_gos_store(filename, tables, source, metadata=None, dtype=None):
+    """Write GOS tables to a store file.
+
+    Parameters
+    ----------
+    filename : str or pathlib.Path
+        The path of the store file, which is overwritten if it exists.
+    tables : dict
+        The ``(gos_array, qaxis, rel_energy_axis)`` arrays of each table,
+        indexed by ``"element/table"``.
+    source : str
+        The kind of GOS, ``"gosh"`` or ``"Hartree-Slater"``.
+    metadata : dict, optional
+        JSON serialisable metadata of the database.
+    dtype : numpy.dtype, optional
+        The dtype of the stored arrays, e.g. ``"float32"`` to halve the size
+        of the store. If None, the dtype of the arrays is kept.
+
+    """
+    filename = Path(filename)
+    index = {}
+    arrays = []
+    offset = 0
+    for name, table in tables.items():
+        index[name] = {}
+        for array_name, array in zip(_ARRAY_NAMES, table):
+            array = np.ascontiguousarray(array, dtype=dtype)
+            offset = _align(offset)
+            index[name][array_name] = {
+                "offset": offset,
+                "shape": list(array.shape),
+                "dtype": array.dtype.str,
+            }
+            arrays.append((offset, array))
+            offset += array.nbytes
+    header = {
+        "version": STORE_VERSION,
+        "source": source,
+        "metadata": metadata or {},
+        "tables": index,
+    }
+    header = json.dumps(header).encode()
+    start = _get_data_start(len(header))
+
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first so that the processes using the store
+    # never read a partially written file
+    fd, tmp = tempfile.mkstemp(dir=filename.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(_HEADER_SIZE.pack(len(header)))
+            f.write(header)
+            for offset, array in arrays:
+                f.seek(start + offset)
+                f.write(array.tobytes())
+        os.replace(tmp, filename)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    with _GOS_STORES_LOCK:
+        _GOS_STORES.pop(os.path.realpath(filename), None)
+
+
+def convert_gos_to_store(path, filename=None, dtype=None):
+    """Convert GOS files to a compact store that is memory mapped when used.
+
+    The GOS tables are read from a store through memory mapping instead of
+    being loaded and parsed by every process, which reduces the start-up
+    time and the memory use of the processes that fit EELS models in
+    parallel, as they share the pages of the store.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        The path of a GOSH database file or of a directory containing the
+        Hartree-Slater GOS files.
+    filename : str or pathlib.Path, optional
+        The path of the store. If None, the store of a GOSH file is saved
+        next to it with the ``.gosstore`` extension and the store of the
+        Hartree-Slater GOS files is saved in their directory, where it is
+        used automatically by the Hartree-Slater GOS.
+    dtype : str or numpy.dtype, optional
+        The dtype of the stored tables, e.g. ``"float32"`` to halve the
+        size of the store. If None, the tables are stored as double
+        precision floating point numbers.
+
+    Returns
+    -------
+    pathlib.Path
+        The path of the store.
+
+    Examples
+    --------
+    Use the store instead of the GOSH file:
+
+    >>> store = exspy.utils.eels.convert_gos_to_store("Segger_Guzzinati_Kohl_1.5.0.gosh")  # doctest: +SKIP
+    >>> m = s.create_model(gos_file_path=store)  # doctest: +SKIP
+
+    """
+    path = Path(path)
+    if dtype is None:
+        dtype = np.float64
+    if path.is_dir():
+        if filename is None:
+            filename = path / HARTREE_SLATER_STORE_NAME
+        tables, source, metadata = _read_hartree_slater_tables(path)
+    else:
+        if filename is None:
+            filename = path.with_suffix(".gosstore")
+        tables, source, metadata = _read_gosh_tables(path)
+    write_gos_store(filename, tables, source, metadata=metadata, dtype=dtype)
+    return Path(filename)
+
+
+def _read_gosh_tables(path):
+    from exspy._misc.eels.gosh_gos import GoshDatabase, _process_gosh_table
+
+    database = GoshDatabase(path)
+    try:
+        edges_info = {
+            str(subshell): {
+                "table": str(info["table"]),
+                "occupancy_ratio": float(info["occupancy_ratio"]),
+            }
+            for subshell, info in database.edges_info.items()
+        }
+        table_names = sorted(set(info["table"] for info in edges_info.values()))
+        tables = {}
+        for element in sorted(database.elements):
+            for table in table_names:
+                if database.has_table(element, table):
+                    tables[f"{element}/{table}"] = _process_gosh_table(
+                        *database.get_table(element, table)
+                    )
+        metadata = {"doi": str(database.doi), "edges_info": edges_info}
+    finally:
+        database.close()
+    return tables, "gosh", metadata
+
+
+def _read_hartree_slater_tables(path):
+    from exspy._misc.eels.hartree_slater_gos import conventions, _read_gos_file
+
+    table_names = set(convention["table"] for convention in conventions.values())
+    tables = {}
+    for gos_file in sorted(path.iterdir()):
+        element, _, table = gos_file.name.partition(".")
+        if gos_file.is_file() and table in table_names:
+            tables[f"{element}/{table}"] = _read_gos_file(gos_file)
+    if not tables:
+        raise ValueError(f"No Hartree-Slater GOS files found in {path}.")
+    return tables, "Hartree-Slater", {}
@@ -16,7 +16,10 @@
 # You should have received a copy of the GNU General Public License
 # along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
 
+import collections
 import logging
+import os
+import threading
 
 import h5py
 import numpy as np
@@ -24,7 +27,8 @@ import pooch
 from scipy import constants
 
 from hyperspy.defaults_parser import preferences
-from exspy._misc.eels.base_gos import TabulatedGOS
+from exspy._misc.eels.base_gos import TabulatedGOS, get_shared_gos_table
+from exspy._misc.eels.gos_store import get_gos_store, is_gos_store
 
 
 _logger = logging.getLogger(__name__)
@@ -44,6 +48,149 @@ _DIRAC_GOSH = {
 }
 _GOSH_SOURCES = {"dft": _DFT_GOSH, "dirac": _DIRAC_GOSH}
 
+# Paths of the GOSH files already retrieved in this process, to avoid
+# checking the hash of the file every time that a GOS is created
+_GOSH_FILE_PATHS = {}
+# Opened GOSH databases, indexed by file path
+_GOSH_DATABASES = {}
+_GOSH_LOCK = threading.RLock()
+
+
+class GoshDatabase:
+    """Read-only access to a GOSH file shared by all the GOS of a process.
+
+    The file is opened only once and the ``metadata/edges_info`` group is
+    indexed when the database is created. The tables are read on demand
+    and kept in a least recently used cache.
+
+    Parameters
+    ----------
+    gos_file_path : str
+        The path of the gosh file.
+    max_tables : int
+        The maximum number of tables kept in memory.
+
+    Attributes
+    ----------
+    edges_info : dict
+        For each subshell, a dictionary with the ``"table"`` name and the
+        ``"occupancy_ratio"``.
+    elements : set
+        The elements available in the database.
+    doi : str
+        The DOI of the data.
+
+    """
+
+    def __init__(self, gos_file_path, max_tables=64):
+        self.gos_file_path = gos_file_path
+        self.max_tables = max_tables
+        self._tables = collections.OrderedDict()
+        self._file = None
+        self._pid = None
+        h = self._get_file()
+        self.edges_info = {
+            subshell: {
+                "table": group.attrs["table"],
+                "occupancy_ratio": group.attrs["occupancy_ratio"],
+            }
+            for subshell, group in h["metadata/edges_info"].items()
+        }
+        self.elements = set(h.keys()) - {"metadata"}
+        self.doi = h["/metadata/data_ref"].attrs["data_doi"]
+
+    def _get_file(self):
+        # h5py files must not be shared between a process and its forks
+        if self._file is None or self._pid != os.getpid():
+            self._file = h5py.File(self.gos_file_path, "r")
+            self._pid = os.getpid()
+        return self._file
+
+    def has_table(self, element, table):
+        """Return True if the database contains the table of the given
+        element."""
+        key = (element, table)
+        with _GOSH_LOCK:
+            return key in self._tables or f"/{element}/{table}" in self._get_file()
+
+    def get_table(self, element, table):
+        """Return the GOS table of an element.
+
+        Parameters
+        ----------
+        element : str
+            The element symbol.
+        table : str
+            The name of the table, as given in :attr:`edges_info`.
+
+        Returns
+        -------
+        gos_array, qaxis, free_energies : numpy.ndarray
+            Read-only arrays of the GOS, as stored in the file, the q axis
+            and the free energies.
+
+        """
+        key = (element, table)
+        with _GOSH_LOCK:
+            if key in self._tables:
+                self._tables.move_to_end(key)
+                return self._tables[key]
+            gos_group = self._get_file()[f"/{element}/{table}"]
+            arrays = (
+                gos_group["data"][:],
+                gos_group["q"][:],
+                gos_group["free_energies"][:],
+            )
+            for array in arrays:
+                array.setflags(write=False)
+            self._tables[key] = arrays
+            while len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+            return arrays
+
+    def close(self):
+        """Close the file and clear the cached tables."""
+        with _GOSH_LOCK:
+            if self._file is not None and self._pid == os.getpid():
+                self._file.close()
+            self._file = None
+            self._tables.clear()
+
+
+def get_gosh_database(gos_file_path):
+    """Return the :class:`GoshDatabase` of the given file, opening it if it
+    is not already open in this process."""
+    key = os.path.realpath(gos_file_path)
+    with _GOSH_LOCK:
+        database = _GOSH_DATABASES.get(key)
+        if database is None:
+            database = GoshDatabase(gos_file_path)
+            _GOSH_DATABASES[key] = database
+        return database
+
+
+def _process_gosh_table(gos, q, free_energies):
+    """Return the ``(gos_array, qaxis, rel_energy_axis)`` arrays of a table
+    read from a GOSH file."""
+    return np.squeeze(gos.T), q, free_energies - min(free_energies)
+
+
+def _retrieve_gosh_file(source):
+    """Download the GOSH file of ``source`` if necessary and return its path.
+
+    The hash of the file is only checked the first time in each process.
+    """
+    with _GOSH_LOCK:
+        gos_file_path = _GOSH_FILE_PATHS.get(source)
+        if gos_file_path is None or not os.path.isfile(gos_file_path):
+            gos_file_path = pooch.retrieve(
+                url=_GOSH_SOURCES[source]["URL"],
+                known_hash=_GOSH_SOURCES[source]["KNOWN_HASH"],
+                progressbar=preferences.General.show_progressbar,
+            )
+            _GOSH_FILE_PATHS[source] = gos_file_path
+        return gos_file_path
+
 
 class GoshGOS(TabulatedGOS):
     """Read Generalized Oscillator Strength from a GOSH database.
@@ -94,7 +241,9 @@ class GoshGOS(TabulatedGOS):
         element_subshell : str
             For example, 'Ti_L3' for the GOS of the titanium L3 subshell
         gos_file_path : str
-            The path of the gosh file to use.
+            The path of the gosh file to use or of a GOS store converted
+            from a gosh file, see
+            :func:`~exspy.utils.eels.convert_gos_to_store`.
         source : str
             The source of the GOS data. Options are 'dft' or 'dirac'.
         """
@@ -103,11 +252,9 @@ class GoshGOS(TabulatedGOS):
             source = source.lower()
             assert source in _GOSH_SOURCES.keys(), f"Invalid source: {source}"
             self._name = source
-            gos_file_path = pooch.retrieve(
-                url=_GOSH_SOURCES[source]["URL"],
-                known_hash=_GOSH_SOURCES[source]["KNOWN_HASH"],
-                progressbar=preferences.General.show_progressbar,
-            )
+            # The file is not needed to reconstruct the GOS from a dictionary
+            if not isinstance(element_subshell, dict):
+                gos_file_path = _retrieve_gosh_file(source)
         self.gos_file_path = gos_file_path
         super().__init__(element_subshell=element_subshell)
 
@@ -127,24 +274,31 @@ class GoshGOS(TabulatedGOS):
             f"of {element}. Please select a different database."
         )
 
-        with h5py.File(self.gos_file_path, "r") as h:
-            conventions = h["metadata/edges_info"]
-            if subshell not in conventions:
-                raise ValueError(error_message)
-            table = conventions[subshell].attrs["table"]
-            self.subshell_factor = conventions[subshell].attrs["occupancy_ratio"]
-            stem = f"/{element}/{table}"
-            if stem not in h:
-                raise ValueError(error_message)
-            gos_group = h[stem]
-            gos = gos_group["data"][:]
-            q = gos_group["q"][:]
-            free_energies = gos_group["free_energies"][:]
-            doi = h["/metadata/data_ref"].attrs["data_doi"]
-
-        gos = np.squeeze(gos.T)
-        self.doi = doi
-        self.gos_array = gos
-        self.qaxis = q
-        self.rel_energy_axis = free_energies - min(free_energies)
+        from_store = is_gos_store(self.gos_file_path)
+        if from_store:
+            database = get_gos_store(self.gos_file_path)
+            if database.source != "gosh":
+                raise ValueError(
+                    f"The GOS store {self.gos_file_path} does not contain a "
+                    "GOSH database."
+                )
+        else:
+            database = get_gosh_database(self.gos_file_path)
+        if subshell not in database.edges_info:
+            raise ValueError(error_message)
+        table = database.edges_info[subshell]["table"]
+        self.subshell_factor = database.edges_info[subshell]["occupancy_ratio"]
+        if not database.has_table(element, table):
+            raise ValueError(error_message)
+
+        def load():
+            if from_store:
+                # The store contains the processed tables
+                return database.get_table(element, table)
+            return _process_gosh_table(*database.get_table(element, table))
+
+        # The tables are shared with all the GOS using the same data
+        key = ("gosh", os.path.realpath(self.gos_file_path), element, table)
+        self._set_table(get_shared_gos_table(key, load))
+        self.doi = database.doi
         self.energy_axis = self.rel_energy_axis + self.onset_energy
@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
 
+import hashlib
 import logging
 from pathlib import Path
 
@@ -23,7 +24,12 @@ import numpy as np
 from scipy import constants
 
 from exspy._defaults_parser import preferences
-from exspy._misc.eels.base_gos import TabulatedGOS
+from exspy._misc.eels.base_gos import BaseGOS, TabulatedGOS, get_shared_gos_table
+from exspy._misc.eels.array_cache import get_gos_table_cache
+from exspy._misc.eels.gos_store import (
+    HARTREE_SLATER_STORE_NAME,
+    get_gos_store,
+)
 
 
 _logger = logging.getLogger(__name__)
@@ -31,6 +37,11 @@ _logger = logging.getLogger(__name__)
 R = constants.value("Rydberg constant times hc in eV")
 a0 = constants.value("Bohr radius")
 
+# Increase when the parsing of the GOS files changes to invalidate the tables
+# in the cache
+TABLE_VERSION = 1
+_TABLE_NAMES = ("gos_array", "qaxis", "rel_energy_axis")
+
 # This dictionary accounts for conventions chosen in naming the data files, as well as normalisation.
 # These cross sections contain only odd-number edges such as N3, or M5, and are normalised accordingly.
 # Other edges can be obtained as scaled copies of the provided ones.
@@ -67,6 +78,72 @@ conventions = {
 }
 
 
+def _read_gos_file(gos_file):
+    """Read a Hartree-Slater GOS file and return the ``(gos_array, qaxis,
+    rel_energy_axis)`` arrays."""
+    with open(gos_file) as f:
+        GOS_list = f.read().replace("\r", "").split()
+
+    # Map the parameters
+    info1_1 = float(GOS_list[2])
+    info1_2 = float(GOS_list[3])
+    ncol = int(GOS_list[5])
+    info2_1 = float(GOS_list[6])
+    info2_2 = float(GOS_list[7])
+    nrow = int(GOS_list[8])
+    gos_array = np.array(GOS_list[9:], dtype=float)
+    # The division by R is not in the equations, but it seems that
+    # the the GOS was tabulated this way
+    gos_array = gos_array.reshape(nrow, ncol) / R
+    del GOS_list
+
+    # Calculate the scale of the matrix
+    rel_energy_axis = BaseGOS.get_parametrized_energy_axis(info2_1, info2_2, nrow)
+    qaxis = BaseGOS.get_parametrized_qaxis(info1_1, info1_2, ncol)
+    return gos_array, qaxis, rel_energy_axis
+
+
+def _load_gos_file(gos_file):
+    """Return the arrays of a Hartree-Slater GOS file, reusing the parsed
+    table cached on disk, if the cache is enabled, when a file with the same
+    content has already been parsed."""
+    cache = get_gos_table_cache()
+    if cache is None:
+        return _read_gos_file(gos_file)
+    # Hashing the file is much faster than parsing it and, unlike its
+    # modification time, can't miss a change of the content
+    digest = hashlib.blake2b(gos_file.read_bytes()).hexdigest()
+    key = ("Hartree-Slater", TABLE_VERSION, digest)
+    cached = cache.get(key)
+    if cached is not None:
+        return tuple(cached[name] for name in _TABLE_NAMES)
+    arrays = _read_gos_file(gos_file)
+    cache.set(key, **dict(zip(_TABLE_NAMES, arrays)))
+    return arrays
+
+
+def _use_store(store_file, gos_file, element, table):
+    """Return True if the table must be read from the store of the GOS
+    directory, i.e. if the store contains the table and the GOS file has not
+    been modified after the store was created."""
+    if not store_file.is_file():
+        return False
+    if not get_gos_store(store_file).has_table(element, table):
+        return False
+    try:
+        gos_mtime = gos_file.stat().st_mtime_ns
+    except FileNotFoundError:
+        return True
+    if gos_mtime > store_file.stat().st_mtime_ns:
+        _logger.warning(
+            f"The GOS file {gos_file} is newer than the GOS store {store_file}, "
+            "which is not used for this file. Convert the GOS files again "
+            "with `exspy.utils.eels.convert_gos_to_store` to update the store."
+        )
+        return False
+    return True
+
+
 class HartreeSlaterGOS(TabulatedGOS):
     """Read Hartree-Slater Generalized Oscillator Strength parametrized
     from files.
@@ -114,7 +191,7 @@ class HartreeSlaterGOS(TabulatedGOS):
         super().read_elements()
         self.subshell_factor = conventions[self.subshell]["factor"]
 
-    def read_gos_data(self):  # pragma: no cover
+    def read_gos_data(self):
         _logger.info(
             "Hartree-Slater GOS\n"
             f"\tElement: {self.element} "
@@ -129,8 +206,9 @@ class HartreeSlaterGOS(TabulatedGOS):
         # Gatan are available. Otherwise exit
         gos_root = Path(preferences.EELS.eels_gos_files_path)
         gos_file = gos_root / f"{element}.{table}"
+        store_file = gos_root / HARTREE_SLATER_STORE_NAME
 
-        if not gos_root.is_dir():
+        if not gos_root.is_dir():  # pragma: no cover
             raise FileNotFoundError(
                 "Parametrized Hartree-Slater GOS files not "
                 f"found in {gos_root}. Please define a valid "
@@ -138,23 +216,20 @@ class HartreeSlaterGOS(TabulatedGOS):
                 "`preferences.EELS.eels_gos_files_path`."
             )
 
-        with open(gos_file) as f:
-            GOS_list = f.read().replace("\r", "").split()
-
-        # Map the parameters
-        info1_1 = float(GOS_list[2])
-        info1_2 = float(GOS_list[3])
-        ncol = int(GOS_list[5])
-        info2_1 = float(GOS_list[6])
-        info2_2 = float(GOS_list[7])
-        nrow = int(GOS_list[8])
-        self.gos_array = np.array(GOS_list[9:], dtype=float)
-        # The division by R is not in the equations, but it seems that
-        # the the GOS was tabulated this way
-        self.gos_array = self.gos_array.reshape(nrow, ncol) / R
-        del GOS_list
-
-        # Calculate the scale of the matrix
-        self.rel_energy_axis = self.get_parametrized_energy_axis(info2_1, info2_2, nrow)
-        self.qaxis = self.get_parametrized_qaxis(info1_1, info1_2, ncol)
+        if _use_store(store_file, gos_file, element, table):
+            # Store created by `exspy.utils.eels.convert_gos_to_store`
+            store = get_gos_store(store_file)
+            key = ("Hartree-Slater", str(store_file.resolve()), element, table)
+
+            def load():
+                return store.get_table(element, table)
+
+        else:
+            key = ("Hartree-Slater", str(gos_file.resolve()))
+
+            def load():
+                return _load_gos_file(gos_file)
+
+        # The tables are shared with all the GOS using the same file
+        self._set_table(get_shared_gos_table(key, load))
         self.energy_axis = self.rel_energy_axis + self.onset_energy
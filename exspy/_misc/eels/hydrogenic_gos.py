@@ -16,11 +16,11 @@
 # You should have received a copy of the GNU General Public License
 # along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
 
-import math
+import functools
 import logging
 
 import numpy as np
-from scipy import integrate, interpolate, constants
+from scipy import interpolate, constants
 
 from exspy._misc.eels.base_gos import BaseGOS
 
@@ -63,6 +63,16 @@ XU = [
 R = constants.value("Rydberg constant times hc in eV")
 
 
+@functools.lru_cache
+def _gauss_legendre(order):
+    """Return the read-only nodes and weights of the Gauss-Legendre
+    quadrature of the given order in [-1, 1]."""
+    nodes, weights = np.polynomial.legendre.leggauss(order)
+    nodes.setflags(write=False)
+    weights.setflags(write=False)
+    return nodes, weights
+
+
 class HydrogenicGOS(BaseGOS):
     """Computes the K and L GOS using R. Egerton's  routines.
 
@@ -96,10 +106,18 @@ class HydrogenicGOS(BaseGOS):
     The Hydrogeninc GOS are calculated using R. Egerton's SIGMAK3 and
     SIGMAL3 routines that has been translated from Matlab to Python by
     I. Iyengar. See http://www.tem-eels.ca/ for the original code.
+    ``gosfuncK`` and ``gosfuncL`` accept arrays, and the q integral is
+    computed for all the energies at once with a fixed order composite
+    Gauss-Legendre quadrature in log(q**2).
 
     """
 
     _name = "hydrogenic"
+    # Number of nodes of each panel of the Gauss-Legendre quadrature used
+    # to integrate the GOS over log(qa0**2) and limits of the panels in
+    # units of the Bethe ridge, E / R
+    _quadrature_order = 16
+    _quadrature_breakpoints = (0.25, 0.5, 1.0, 2.0, 4.0)
 
     def __init__(self, element_subshell):
         """
@@ -158,35 +176,29 @@ class HydrogenicGOS(BaseGOS):
         self.energy_shift = energy_shift
         gamma = 1 + E0 / 511.06
         T = 511060 * (1 - 1 / gamma**2) / 2
-        qint = np.zeros((self.energy_axis.shape[0]))
-        for i, E in enumerate(self.energy_axis + energy_shift):
-            qa0sqmin = (E**2) / (4 * R * T) + (E**3) / (8 * gamma**3 * R * T**2)
-            p02 = T / (R * (1 - 2 * T / 511060))
-            pp2 = p02 - E / R * (gamma - E / 1022120)
-            qa0sqmax = qa0sqmin + 4 * np.sqrt(p02 * pp2) * (math.sin(angle / 2)) ** 2
-
-            # dsbyde IS THE ENERGY-DIFFERENTIAL X-SECN (barn/eV/atom)
-            qint[i] = (
-                3.5166e8
-                * (R / T)
-                * (R / E)
-                * (
-                    integrate.quad(
-                        lambda x: self.gosfunc(E, np.exp(x)),
-                        math.log(qa0sqmin),
-                        math.log(qa0sqmax),
-                    )[0]
-                )
-            )
+        E = self.energy_axis + energy_shift
+        qa0sqmin, qa0sqmax = self._get_qa0sq_limits(E, angle, E0)
+        # Composite Gauss-Legendre quadrature in log(qa0**2), evaluated for
+        # all the energies and all the nodes at once. The panels are split
+        # around the Bethe ridge, qa0**2 ~ E / R, where the GOS is sharply
+        # peaked at high energy loss.
+        nodes, weights = _gauss_legendre(self._quadrature_order)
+        xmin = np.log(qa0sqmin)[:, np.newaxis]
+        xmax = np.log(qa0sqmax)[:, np.newaxis]
+        breakpoints = np.log(np.outer(E / R, self._quadrature_breakpoints))
+        edges = np.hstack((xmin, np.clip(breakpoints, xmin, xmax), xmax))
+        half_width = np.diff(edges, axis=1)[..., np.newaxis] / 2
+        x = edges[:, :-1, np.newaxis] + half_width * (nodes + 1)
+        gos = self.gosfunc(E[:, np.newaxis, np.newaxis], np.exp(x))
+        integral = (half_width * gos * weights).sum(axis=(1, 2))
+        # dsbyde IS THE ENERGY-DIFFERENTIAL X-SECN (barn/eV/atom)
+        qint = 3.5166e8 * (R / T) * (R / E) * integral
         self.qint = qint
-        return interpolate.make_interp_spline(
-            self.energy_axis + energy_shift,
-            qint,
-            k=1,
-        )
+        return interpolate.make_interp_spline(E, qint, k=1)
 
     def gosfuncK(self, E, qa02):
         # gosfunc calculates (=DF/DE) which IS PER EV AND PER ATOM
+        # E and qa02 can be arrays of any broadcastable shapes
         z = self.Z
         r = 13.606
         zs = 1.0
@@ -195,28 +207,25 @@ class HydrogenicGOS(BaseGOS):
             zs = z - 0.5
             rnk = 2
 
-        q = qa02 / zs**2
+        E = np.asarray(E, dtype=float)
+        q = np.asarray(qa02, dtype=float) / zs**2
         kh2 = E / (r * zs**2) - 1
-        akh = np.sqrt(abs(kh2))
-        if akh < 0.01:
-            akh = 0.01
-        if kh2 >= 0.0:
-            d = 1 - np.e ** (-2 * np.pi / akh)
+        akh = np.maximum(np.sqrt(abs(kh2)), 0.01)
+        # Both branches are evaluated, the values of the branch that is not
+        # selected can be invalid
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
             bp = np.arctan(2 * akh / (q - kh2 + 1))
-            if bp < 0:
-                bp = bp + np.pi
-            c = np.e ** ((-2 / akh) * bp)
-        else:
-            d = 1
+            bp = np.where(bp < 0, bp + np.pi, bp)
             y = -1 / akh * np.log((q + 1 - kh2 + 2 * akh) / (q + 1 - kh2 - 2 * akh))
-            c = np.e**y
+            above = kh2 >= 0.0
+            d = np.where(above, 1 - np.exp(-2 * np.pi / akh), 1)
+            c = np.where(above, np.exp((-2 / akh) * bp), np.exp(y))
         a = ((q - kh2 + 1) ** 2 + 4 * kh2) ** 3
         return 128 * rnk * E / (r * zs**4) * c / d * (q + kh2 / 3 + 1 / 3) / (a * r)
 
     def gosfuncL(self, E, qa02):
         # gosfunc calculates (=DF/DE) which IS PER EV AND PER ATOM
-        # Note: quad function only works with qa02 due to IF statements in
-        # function
+        # E and qa02 can be arrays of any broadcastable shapes
 
         z = self.Z
         r = 13.606
@@ -233,45 +242,45 @@ class HydrogenicGOS(BaseGOS):
         el3 = self.onset_energy_L3 + self.energy_shift
         el1 = self.onset_energy_L1 + self.energy_shift
 
-        q = qa02 / zs**2
+        E = np.asarray(E, dtype=float)
+        q = np.asarray(qa02, dtype=float) / zs**2
         kh2 = E / (r * zs**2) - 0.25
         akh = np.sqrt(abs(kh2))
-        if kh2 >= 0.0:
-            d = 1 - np.exp(-2 * np.pi / akh)
+        # Both branches are evaluated, the values of the branch that is not
+        # selected can be invalid
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
             bp = np.arctan(akh / (q - kh2 + 0.25))
-            if bp < 0:
-                bp = bp + np.pi
-            c = np.exp((-2 / akh) * bp)
-        else:
-            d = 1
+            bp = np.where(bp < 0, bp + np.pi, bp)
             y = -1 / akh * np.log((q + 0.25 - kh2 + akh) / (q + 0.25 - kh2 - akh))
-            c = np.exp(y)
-
-        if E - el1 <= 0:
-            g = (
-                2.25 * q**4
-                - (0.75 + 3 * kh2) * q**3
-                + (0.59375 - 0.75 * kh2 - 0.5 * kh2**2) * q * q
-                + (0.11146 + 0.85417 * kh2 + 1.8833 * kh2 * kh2 + kh2**3) * q
-                + 0.0035807
-                + kh2 / 21.333
-                + kh2 * kh2 / 4.5714
-                + kh2**3 / 2.4
-                + kh2**4 / 4
-            )
-
-            a = ((q - kh2 + 0.25) ** 2 + kh2) ** 5
-        else:
-            g = (
-                q**3
-                - (5 / 3 * kh2 + 11 / 12) * q**2
-                + (kh2 * kh2 / 3 + 1.5 * kh2 + 65 / 48) * q
-                + kh2**3 / 3
-                + 0.75 * kh2 * kh2
-                + 23 / 48 * kh2
-                + 5 / 64
-            )
-            a = ((q - kh2 + 0.25) ** 2 + kh2) ** 4
+            above = kh2 >= 0.0
+            d = np.where(above, 1 - np.exp(-2 * np.pi / akh), 1)
+            c = np.where(above, np.exp((-2 / akh) * bp), np.exp(y))
+
+        below_l1 = E - el1 <= 0
+        g = np.where(
+            below_l1,
+            2.25 * q**4
+            - (0.75 + 3 * kh2) * q**3
+            + (0.59375 - 0.75 * kh2 - 0.5 * kh2**2) * q * q
+            + (0.11146 + 0.85417 * kh2 + 1.8833 * kh2 * kh2 + kh2**3) * q
+            + 0.0035807
+            + kh2 / 21.333
+            + kh2 * kh2 / 4.5714
+            + kh2**3 / 2.4
+            + kh2**4 / 4,
+            q**3
+            - (5 / 3 * kh2 + 11 / 12) * q**2
+            + (kh2 * kh2 / 3 + 1.5 * kh2 + 65 / 48) * q
+            + kh2**3 / 3
+            + 0.75 * kh2 * kh2
+            + 23 / 48 * kh2
+            + 5 / 64,
+        )
+        a = np.where(
+            below_l1,
+            ((q - kh2 + 0.25) ** 2 + kh2) ** 5,
+            ((q - kh2 + 0.25) ** 2 + kh2) ** 4,
+        )
         rf = ((E + 0.1 - el3) / 1.8 / z / z) ** u
         # The following commented lines are to give a more accurate GOS
         # for edges presenting white lines. However, this is not relevant
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+"""Linear least squares solvers operating on many spectra at once."""
+
+import numpy as np
+from scipy.optimize import nnls
+
+LINEAR_OPTIMIZERS = ("lstsq", "nnls")
+# Maximum size in bytes of the basis and data arrays of a batch of pixels
+MAX_BATCH_SIZE = 2**27
+
+
+def get_batch_size(n_channels, n_basis, per_pixel_basis):
+    """Return the number of pixels that are solved at once."""
+    pixel_size = 8 * n_channels * (1 + (n_basis if per_pixel_basis else 0))
+    return max(1, MAX_BATCH_SIZE // pixel_size)
+
+
+def solve_linear(basis, data, optimizer="lstsq", weights=None, calculate_errors=False):
+    """Solve the linear least squares problems of many pixels.
+
+    Parameters
+    ----------
+    basis : numpy.ndarray
+        The basis functions, of shape ``(n_basis, n_channels)`` if they are
+        shared by all the pixels or ``(n_pixels, n_basis, n_channels)``.
+    data : numpy.ndarray
+        The data, of shape ``(n_pixels, n_channels)``.
+    optimizer : {"lstsq", "nnls"}
+        If ``"lstsq"``, the ordinary least squares solution. If ``"nnls"``,
+        the coefficients are constrained to be positive.
+    weights : numpy.ndarray, optional
+        The weights of the channels, of shape ``(n_channels,)`` or
+        ``(n_pixels, n_channels)``.
+    calculate_errors : bool
+        If True, also return the standard deviation of the coefficients.
+
+    Returns
+    -------
+    coefficients : numpy.ndarray
+        The coefficients, of shape ``(n_pixels, n_basis)``.
+    std : numpy.ndarray or None
+        The standard deviation of the coefficients, or None if
+        ``calculate_errors`` is False.
+
+    """
+    if optimizer not in LINEAR_OPTIMIZERS:
+        raise ValueError(
+            f"Optimizer `'{optimizer}'` not supported. Use one of {LINEAR_OPTIMIZERS}."
+        )
+    data = np.asarray(data, dtype=float)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)
+        basis = basis * weights[..., np.newaxis, :]
+        data = data * weights
+    shared = basis.ndim == 2
+    npixels, nbasis = len(data), basis.shape[-2]
+
+    if optimizer == "lstsq" and shared:
+        coefficients = np.linalg.lstsq(basis.T, data.T, rcond=None)[0].T
+    elif optimizer == "lstsq":
+        # Solving the normal equations is several times faster than the
+        # decomposition of each basis. The basis functions are normalised
+        # to keep the normal matrices well conditioned.
+        norm = np.linalg.norm(basis, axis=-1, keepdims=True)
+        norm[norm == 0] = 1.0
+        normalised = basis / norm
+        normal = normalised @ normalised.swapaxes(-1, -2)
+        rhs = normalised @ data[..., np.newaxis]
+        coefficients = (np.linalg.pinv(normal) @ rhs)[..., 0] / norm[..., 0]
+    else:
+        # The NNLS problem is reduced to the triangular factor of the QR
+        # decomposition of the basis, so that the solver of each pixel only
+        # works on a n_basis x n_basis matrix
+        q, r = np.linalg.qr(basis.swapaxes(-1, -2))
+        qtb = (data[:, np.newaxis] @ q)[:, 0]
+        r = np.broadcast_to(r, (npixels, nbasis, nbasis))
+        coefficients = np.empty((npixels, nbasis))
+        for i in range(npixels):
+            coefficients[i] = nnls(r[i], qtb[i])[0]
+
+    std = None
+    if calculate_errors:
+        fit = (coefficients[:, np.newaxis] @ basis)[:, 0]
+        dof = max(basis.shape[-1] - nbasis, 1)
+        reduced_chisq = ((data - fit) ** 2).sum(-1) / dof
+        normal = basis @ basis.swapaxes(-1, -2)
+        variance = np.diagonal(np.linalg.pinv(normal), axis1=-2, axis2=-1)
+        std = np.sqrt(variance * reduced_chisq[:, np.newaxis])
+    return coefficients, std
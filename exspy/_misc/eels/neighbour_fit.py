@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+"""Fitting of the navigation space along space filling curves, starting
+each pixel from the values of its fitted neighbours."""
+
+import collections
+
+import numpy as np
+from hyperspy.external.progressbar import progressbar
+
+ITERPATHS = ("flyback", "serpentine", "hilbert")
+
+
+def _hilbert_iter(shape):
+    # Hilbert curve of the smallest square with a power of two side
+    # containing the navigation space, without the points outside it
+    n = 1 << max(0, (max(shape) - 1).bit_length())
+    t = np.arange(n * n)
+    x = np.zeros_like(t)
+    y = np.zeros_like(t)
+    s = 1
+    while s < n:
+        rx = 1 & (t // 2)
+        ry = 1 & (t ^ rx)
+        flip = (ry == 0) & (rx == 1)
+        x = np.where(flip, s - 1 - x, x)
+        y = np.where(flip, s - 1 - y, y)
+        x, y = np.where(ry == 0, y, x), np.where(ry == 0, x, y)
+        x += s * rx
+        y += s * ry
+        t //= 4
+        s *= 2
+    keep = (x < shape[0]) & (y < shape[1])
+    return [(int(i), int(j)) for i, j in zip(x[keep], y[keep])]
+
+
+def get_pixel_order(navigation_shape, iterpath="flyback"):
+    """Return the navigation indices of all the pixels in the order of
+    ``iterpath``.
+
+    Parameters
+    ----------
+    navigation_shape : tuple of int
+        The navigation shape, in the order of the navigation axes.
+    iterpath : {"flyback", "serpentine", "hilbert"}
+        The order of the pixels. The ``"hilbert"`` order follows a Hilbert
+        curve in two dimensions and falls back to ``"serpentine"`` in other
+        dimensions.
+
+    """
+    if iterpath not in ITERPATHS:
+        raise ValueError(f"`iterpath` must be one of {ITERPATHS}, not '{iterpath}'.")
+    if iterpath == "hilbert" and len(navigation_shape) == 2:
+        return _hilbert_iter(navigation_shape)
+    # In array order, the first navigation axis is the fastest
+    shape = tuple(navigation_shape)[::-1]
+    order = []
+    for index in np.ndindex(shape):
+        if iterpath != "flyback":
+            # Reverse the direction along each axis after each step along
+            # the slower axes, i.e. every other row in two dimensions
+            position = 0
+            serpentine = []
+            for i, n in zip(index, shape):
+                serpentine.append(n - 1 - i if position % 2 else i)
+                position = position * n + i
+            index = serpentine
+        order.append(tuple(index[::-1]))
+    return order
+
+
+def _neighbour_median(parameters, done, index):
+    """Return the median and the median absolute deviation of the values
+    of the parameters at the fitted neighbours of ``index``, in array
+    order, or None if no neighbour is fitted."""
+    window = tuple(slice(max(i - 1, 0), i + 2) for i in index)
+    fitted = done[window]
+    if not fitted.any():
+        return None
+    median, spread = [], []
+    for parameter in parameters:
+        values = parameter.map["values"][window][fitted]
+        m = np.median(values, axis=0)
+        median.append(m)
+        spread.append(np.median(np.abs(values - m), axis=0))
+    return median, spread
+
+
+def _deviates(parameters, median, spread, max_deviation):
+    for parameter, m, s in zip(parameters, median, spread):
+        value = np.asarray(parameter.value, dtype=float)
+        if np.any(np.abs(value - m) > max_deviation * (np.abs(m) + s)):
+            return True
+    return False
+
+
+def _set_value(parameter, value):
+    if parameter._number_of_elements == 1:
+        parameter.value = float(value)
+    else:
+        parameter.value = tuple(float(v) for v in value)
+
+
+def neighbour_multifit(
+    model,
+    iterpath="hilbert",
+    mask=None,
+    fetch_only_fixed=False,
+    max_deviation=0.5,
+    max_requeue=1,
+    show_progressbar=None,
+    done=None,
+    callback=None,
+    **kwargs,
+):
+    """Fit each pixel starting from the median of the values of its fitted
+    neighbours.
+
+    See :meth:`exspy.models.EELSModel.multifit` for the parameters.
+
+    Parameters
+    ----------
+    done : numpy.ndarray of bool, optional
+        The pixels which are already fitted, e.g. before resuming from a
+        checkpoint, which are used as neighbours. It is updated in place
+        as the pixels are fitted.
+    callback : callable, optional
+        Called without argument every time a pixel is fitted and added to
+        ``done``.
+
+    """
+    axes_manager = model.axes_manager
+    if isinstance(iterpath, str):
+        pixels = get_pixel_order(axes_manager.navigation_shape, iterpath)
+    else:
+        pixels = [tuple(index) for index in iterpath]
+    if mask is not None:
+        pixels = [index for index in pixels if not mask[index[::-1]]]
+    parameters = [p for c in model for p in c.parameters if p.free]
+    all_parameters = [p for c in model for p in c.parameters]
+    if done is None:
+        done = np.zeros(axes_manager._navigation_shape_in_array, dtype=bool)
+    requeued = collections.Counter()
+    queue = collections.deque(pixels)
+
+    with axes_manager.events.indices_changed.suppress_callback(
+        model.fetch_stored_values
+    ):
+        with model.suspend_update(update_on_resume=True):
+            with progressbar(
+                total=len(pixels), disable=not show_progressbar, leave=True
+            ) as pbar:
+                while queue:
+                    indices = queue.popleft()
+                    index = indices[::-1]
+                    axes_manager.indices = indices
+                    model.fetch_stored_values(only_fixed=fetch_only_fixed)
+                    neighbours = _neighbour_median(parameters, done, index)
+                    if neighbours is not None:
+                        for parameter, value in zip(parameters, neighbours[0]):
+                            _set_value(parameter, value)
+                    if requeued[indices]:
+                        previous = [p.map[index].copy() for p in all_parameters]
+                        previous_chisq = model.chisq.data[index]
+                        previous_dof = model.dof.data[index]
+                    model.fit(**kwargs)
+                    if requeued[indices] and not (
+                        model.chisq.data[index] <= previous_chisq
+                    ):
+                        # Keep the best of the two fits
+                        for parameter, values in zip(all_parameters, previous):
+                            parameter.map[index] = values
+                        model.chisq.data[index] = previous_chisq
+                        model.dof.data[index] = previous_dof
+                        model.fetch_stored_values()
+                    elif (
+                        neighbours is not None
+                        and requeued[indices] < max_requeue
+                        and _deviates(parameters, *neighbours, max_deviation)
+                    ):
+                        # Fit again once more neighbours are fitted
+                        requeued[indices] += 1
+                        queue.append(indices)
+                        continue
+                    done[index] = True
+                    pbar.update(1)
+                    if callback is not None:
+                        callback()
+        # Trigger the indices_changed event to update to current indices,
+        # since the callback was suppressed
+        axes_manager.events.indices_changed.trigger(axes_manager)
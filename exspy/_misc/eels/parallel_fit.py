@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+"""Fitting of EELS models by tiles of the navigation space in worker
+processes sharing the data of the model."""
+
+import concurrent.futures
+import contextlib
+import gc
+import io
+import math
+import os
+import pickle
+import uuid
+from multiprocessing import shared_memory
+
+import numpy as np
+from hyperspy.external.progressbar import progressbar
+from hyperspy.signal import BaseSignal
+
+from exspy._misc.eels.neighbour_fit import ITERPATHS, get_pixel_order
+
+# Arrays smaller than this size in bytes are pickled instead of shared
+MIN_SHARED_SIZE = 2**16
+# Number of tiles per worker when the tile shape is not given, to balance
+# the load of the workers
+TILES_PER_WORKER = 4
+
+
+def _open_shared_memory(name):
+    try:
+        # The segment is unlinked by the process that created it
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # pragma: no cover
+        # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+# The shared memory attached by this process, which must be kept open as
+# long as the arrays using it
+_ATTACHED = []
+
+
+def _attach_shared_array(name, shape, dtype, writeable):
+    shm = _open_shared_memory(name)
+    _ATTACHED.append(shm)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    if not writeable:
+        array.setflags(write=False)
+    return array
+
+
+class SharedMemoryPickler(pickle.Pickler):
+    """Pickler storing large numpy arrays in shared memory.
+
+    The arrays are copied to new shared memory blocks and pickled as a
+    reference to the block, which is attached when unpickling. The arrays
+    are read-only when unpickled, except the ``writeable`` arrays, whose
+    changes can be copied back with :meth:`copy_back`.
+
+    Parameters
+    ----------
+    file : file-like
+        The file the pickle is written to.
+    writeable : list of numpy.ndarray
+        The arrays which are shared whatever their size and are writeable
+        when unpickled.
+    min_size : int
+        The minimum size in bytes of the shared arrays.
+
+    """
+
+    def __init__(self, file, writeable=(), min_size=MIN_SHARED_SIZE):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.min_size = min_size
+        self._writeable = {id(array): array for array in writeable}
+        self._copies = []
+        self.blocks = []
+
+    def reducer_override(self, obj):
+        if not isinstance(obj, np.ndarray) or obj.dtype.hasobject:
+            return NotImplemented
+        writeable = id(obj) in self._writeable
+        if not writeable and obj.nbytes < self.min_size:
+            return NotImplemented
+        shm = shared_memory.SharedMemory(create=True, size=max(obj.nbytes, 1))
+        self.blocks.append(shm)
+        shared = np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)
+        shared[...] = obj
+        if writeable:
+            self._copies.append((obj, shared))
+        return _attach_shared_array, (shm.name, obj.shape, obj.dtype, writeable)
+
+    def copy_back(self):
+        """Copy the shared writeable arrays to the original arrays."""
+        for original, shared in self._copies:
+            original[...] = shared
+
+    def close(self):
+        """Release the shared memory blocks."""
+        self._copies = []
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+
+def _signal_to_dictionary(signal):
+    dic = signal._to_dictionary(add_learning_results=False, add_models=False)
+    dic["original_metadata"] = {}
+    return dic
+
+
+def get_tiles(navigation_shape, tile_shape, iterpath="flyback", mask=None):
+    """Split the navigation space in tiles.
+
+    Parameters
+    ----------
+    navigation_shape, tile_shape : tuple of int
+        The shape of the navigation space and of the tiles, in the order of
+        the navigation axes.
+    iterpath : {"flyback", "serpentine", "hilbert"}
+        The order of the pixels in a tile.
+    mask : numpy.ndarray of bool, optional
+        The pixels which are excluded from the tiles, with the navigation
+        shape in array order.
+
+    Returns
+    -------
+    list of list of tuple
+        The navigation indices of the pixels of each non empty tile.
+
+    """
+    tiles = []
+    starts = [range(0, n, t) for n, t in zip(navigation_shape, tile_shape)]
+    for start in get_pixel_order(tuple(len(s) for s in starts)):
+        origin = [s[i] for s, i in zip(starts, start)]
+        shape = tuple(
+            min(t, n - o) for t, n, o in zip(tile_shape, navigation_shape, origin)
+        )
+        tile = [
+            tuple(o + i for o, i in zip(origin, index))
+            for index in get_pixel_order(shape, iterpath)
+        ]
+        if mask is not None:
+            tile = [index for index in tile if not mask[index[::-1]]]
+        if tile:
+            tiles.append(tile)
+    return tiles
+
+
+def get_default_tile_shape(navigation_shape, num_workers):
+    """Return a tile shape splitting the slowest navigation axis so that
+    there are several tiles per worker."""
+    ntiles = min(navigation_shape[-1], TILES_PER_WORKER * num_workers)
+    return navigation_shape[:-1] + (math.ceil(navigation_shape[-1] / ntiles),)
+
+
+def create_worker_pool(num_workers=None):
+    """Return a pool of worker processes for :func:`parallel_multifit`.
+
+    The same pool can be used to fit several models, e.g. the chunks of a
+    lazy signal, without starting new processes.
+
+    Parameters
+    ----------
+    num_workers : int, optional
+        The number of worker processes. If None or smaller than 1, the
+        number of CPUs.
+
+    """
+    if num_workers is None or num_workers < 1:
+        num_workers = os.cpu_count()
+    return concurrent.futures.ProcessPoolExecutor(max_workers=num_workers)
+
+
+# The identifier of the job of a worker process, the model it fits and the
+# initial values of the parameters
+_job_id = None
+_model = None
+_initial_values = None
+
+
+def _load_job(job_id, payload):
+    global _job_id, _model, _initial_values
+    from exspy.components import EELSCLEdge
+    from exspy.models.eelsmodel import EELSModel
+
+    cross_sections = {}
+    if _model is not None:
+        cross_sections = {
+            component.name: component._cross_sections
+            for component in _model
+            if isinstance(component, EELSCLEdge)
+        }
+    # Release the shared memory of the previous job
+    _job_id = _model = _initial_values = None
+    gc.collect()
+    for shm in list(_ATTACHED):
+        try:
+            shm.close()
+        except BufferError:  # pragma: no cover
+            # Still used
+            continue
+        _ATTACHED.remove(shm)
+
+    job = pickle.loads(payload)
+    signal = BaseSignal(**job["signal"])
+    signal._assign_subclass()
+    _model = EELSModel(
+        signal,
+        auto_background=False,
+        auto_add_edges=False,
+        GOS=job["GOS"],
+        gos_file_path=job["gos_file_path"],
+        dictionary=job["model"],
+    )
+    # The cross sections of the edges are integrated when they are first
+    # evaluated, so that those of the previous job, e.g. the previous chunk
+    # of a lazy signal, are reused when the microscope parameters are the
+    # same
+    for component in _model:
+        if component.name in cross_sections and isinstance(component, EELSCLEdge):
+            component._cross_sections.update(cross_sections[component.name])
+    _initial_values = [
+        (parameter, parameter.value, parameter.std)
+        for component in _model
+        for parameter in component.parameters
+    ]
+    _job_id = job_id
+
+
+def _fit_tile(job_id, payload, tile, kwargs):
+    if job_id != _job_id:
+        _load_job(job_id, payload)
+    # Each tile starts from the same values, so that the result does not
+    # depend on which tile was previously fitted by the worker
+    for parameter, value, std in _initial_values:
+        parameter.value = value
+        parameter.std = std
+    _model.multifit(iterpath=tile, show_progressbar=False, **kwargs)
+    return len(tile)
+
+
+def parallel_multifit(
+    model,
+    mask=None,
+    num_workers=None,
+    tile_shape=None,
+    iterpath=None,
+    show_progressbar=None,
+    executor=None,
+    **kwargs,
+):
+    """Fit an EELS model by tiles of the navigation space in worker
+    processes.
+
+    See :meth:`exspy.models.EELSModel.multifit` for the parameters.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.ProcessPoolExecutor, optional
+        The pool of worker processes given by :func:`create_worker_pool`,
+        whose number of processes is ``num_workers``. If None, a pool is
+        created for this fit.
+
+    """
+    signal = model.signal
+    axes_manager = model.axes_manager
+    navigation_shape = tuple(axes_manager.navigation_shape)
+    if num_workers is None or num_workers < 1:
+        num_workers = os.cpu_count()
+    if tile_shape is None:
+        tile_shape = get_default_tile_shape(navigation_shape, num_workers)
+    elif len(tile_shape) != len(navigation_shape):
+        raise ValueError(
+            f"The tile shape {tuple(tile_shape)} does not match the navigation "
+            f"shape {navigation_shape}."
+        )
+    if iterpath is None:
+        iterpath = axes_manager.iterpath
+    if iterpath not in ITERPATHS:
+        raise ValueError(
+            f"Only the {ITERPATHS} iterpaths are supported when fitting in parallel."
+        )
+    tiles = get_tiles(navigation_shape, tuple(tile_shape), iterpath, mask)
+
+    dictionary = model.as_dictionary(fullcopy=False)
+    if model.low_loss is not None:
+        dictionary["low_loss"] = _signal_to_dictionary(model.low_loss)
+    job = {
+        "signal": _signal_to_dictionary(signal),
+        "model": dictionary,
+        "GOS": model.GOS,
+        "gos_file_path": model.gos_file_path,
+    }
+    # The fitted values are written by the workers in shared copies of the
+    # parameter maps and of the chisq and dof arrays
+    writeable = [model.chisq.data, model.dof.data]
+    writeable.extend(
+        parameter.map for component in model for parameter in component.parameters
+    )
+    buffer = io.BytesIO()
+    pickler = SharedMemoryPickler(buffer, writeable=writeable)
+    try:
+        pickler.dump(job)
+        # Each worker loads the job once, with its first tile
+        payload = buffer.getvalue()
+        job_id = uuid.uuid4().hex
+        with contextlib.ExitStack() as stack:
+            if executor is None:
+                executor = stack.enter_context(create_worker_pool(num_workers))
+            futures = [
+                executor.submit(_fit_tile, job_id, payload, tile, kwargs)
+                for tile in tiles
+            ]
+            try:
+                with progressbar(
+                    total=sum(len(tile) for tile in tiles),
+                    disable=not show_progressbar,
+                    leave=True,
+                ) as pbar:
+                    for future in concurrent.futures.as_completed(futures):
+                        pbar.update(future.result())
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                # The shared memory is used until the running tiles are
+                # fitted, also when the pool is not shut down here
+                concurrent.futures.wait(futures)
+                raise
+    finally:
+        # Keep the values of the tiles fitted before an error or interruption
+        pickler.copy_back()
+        pickler.close()
+    model.fetch_stored_values()
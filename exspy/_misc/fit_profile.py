@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+"""Recording of the cost of the fit of models at every navigation
+position."""
+
+import collections
+import functools
+import time
+
+import numpy as np
+
+_MISSING = object()
+
+
+class FitProfiler:
+    """Context manager recording, for every pixel fitted with the
+    :py:meth:`~hyperspy.model.BaseModel.fit` method of a model, the cost of
+    the fit.
+
+    While the context is active, the ``fit``, ``_model_function`` and
+    ``_jacobian`` methods of the model, the ``function`` method of its
+    components and the ``_set_cross_section`` method of its EELS edges,
+    which integrates the GOS, are replaced by wrappers measuring their
+    calls. When ``fit`` calls itself, e.g. with ``kind="smart"``, the time
+    and the evaluations are counted once for the outer call and the status
+    and reduced chi-squared are those of the last inner fit.
+
+    Parameters
+    ----------
+    model : hyperspy.model.BaseModel
+        The model.
+
+    Attributes
+    ----------
+    arrays : dict
+        The ``"time"``, ``"nfev"``, ``"njev"``, ``"status"`` and
+        ``"red_chisq"`` arrays and the ``"component_time"`` and
+        ``"gos_time"`` dictionaries of arrays, with the navigation shape in
+        array order.
+
+    """
+
+    def __init__(self, model):
+        self.model = model
+        shape = model.axes_manager._navigation_shape_in_array
+        self.fitted = np.zeros(shape, dtype=bool)
+        self.arrays = {
+            name: np.zeros(shape)
+            for name in ("time", "nfev", "njev", "status", "red_chisq")
+        }
+        self.arrays["status"][:] = np.nan
+        self.arrays["red_chisq"][:] = np.nan
+        self.arrays["component_time"] = {c.name: np.zeros(shape) for c in model}
+        self.arrays["gos_time"] = {
+            c.name: np.zeros(shape) for c in model if hasattr(c, "_set_cross_section")
+        }
+        self._counters = collections.Counter()
+        self._patched = []
+        self._depth = 0
+        self._nested = False
+
+    def _patch(self, obj, name, wrapper):
+        self._patched.append((obj, name, obj.__dict__.get(name, _MISSING)))
+        setattr(obj, name, wrapper(getattr(obj, name)))
+
+    def _count(self, key):
+        def wrapper(method):
+            @functools.wraps(method)
+            def counted(*args, **kwargs):
+                self._counters[key] += 1
+                return method(*args, **kwargs)
+
+            return counted
+
+        return wrapper
+
+    def _time(self, key):
+        def wrapper(method):
+            @functools.wraps(method)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    self._counters[key] += time.perf_counter() - start
+
+            return timed
+
+        return wrapper
+
+    def _wrap_fit(self, fit):
+        @functools.wraps(fit)
+        def profiled_fit(*args, **kwargs):
+            outer = self._depth == 0
+            if outer:
+                self._counters.clear()
+                start = time.perf_counter()
+            self._nested = True
+            self._depth += 1
+            self.model.fit_output = None
+            try:
+                return fit(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                if self._nested:
+                    self._record_result()
+                    self._nested = False
+                if outer:
+                    self._record_cost(time.perf_counter() - start)
+
+        return profiled_fit
+
+    def _index(self):
+        return tuple(self.model.axes_manager.indices[::-1])
+
+    def _record_result(self):
+        # Only called by the innermost fit, whose signal range is still set
+        index = self._index()
+        model = self.model
+        fit_output = model.fit_output
+        if fit_output is not None:
+            self.arrays["status"][index] = fit_output.get("status", np.nan)
+        ndata = np.count_nonzero(model._channel_switches)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.arrays["red_chisq"][index] = model.chisq.data[index] / (
+                ndata - model.dof.data[index] - 1
+            )
+
+    def _record_cost(self, elapsed):
+        index = self._index()
+        self.fitted[index] = True
+        self.arrays["time"][index] += elapsed
+        self.arrays["nfev"][index] += self._counters["nfev"]
+        self.arrays["njev"][index] += self._counters["njev"]
+        for group in ("component_time", "gos_time"):
+            for name, array in self.arrays[group].items():
+                array[index] += self._counters[group, name]
+
+    def __enter__(self):
+        model = self.model
+        self._patch(model, "fit", self._wrap_fit)
+        self._patch(model, "_model_function", self._count("nfev"))
+        self._patch(model, "_jacobian", self._count("njev"))
+        for component in model:
+            self._patch(
+                component, "function", self._time(("component_time", component.name))
+            )
+            if component.name in self.arrays["gos_time"]:
+                self._patch(
+                    component,
+                    "_set_cross_section",
+                    self._time(("gos_time", component.name)),
+                )
+        return self
+
+    def __exit__(self, *exc_info):
+        for obj, name, original in reversed(self._patched):
+            if original is _MISSING:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, original)
+        self._patched = []
+
+    def get_signals(self):
+        """Return the recorded arrays as navigation signals.
+
+        The pixels which were not fitted are NaN.
+
+        Returns
+        -------
+        dict
+            The ``"time"``, ``"nfev"``, ``"njev"``, ``"status"`` and
+            ``"red_chisq"`` signals and the ``"component_time"`` and
+            ``"gos_time"`` dictionaries of signals, whose keys are the names
+            of the components.
+
+        """
+        chisq = self.model.chisq
+        title = self.model.signal.metadata.General.title
+
+        def to_signal(array, name):
+            array = np.where(self.fitted, array, np.nan)
+            signal = chisq._deepcopy_with_new_data(array)
+            signal.metadata.General.title = f"{title} {name}"
+            return signal
+
+        signals = {
+            name: to_signal(self.arrays[name], name)
+            for name in ("time", "nfev", "njev", "status", "red_chisq")
+        }
+        for group, label in (
+            ("component_time", "time"),
+            ("gos_time", "GOS integration time"),
+        ):
+            signals[group] = {
+                name: to_signal(array, f"{name} {label}")
+                for name, array in self.arrays[group].items()
+            }
+        return signals
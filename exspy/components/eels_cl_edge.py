@@ -17,15 +17,18 @@
 # along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
 
 
+import contextlib
 import functools
 import logging
 import warnings
 import math
 
 import numpy as np
-from scipy.interpolate import splev
+from scipy.interpolate import BSpline, make_interp_spline
 
 from hyperspy.component import Component
+from hyperspy.docstrings.parameters import FUNCTION_ND_DOCSTRING
+from exspy._misc.eels.array_cache import get_cross_section_cache
 from exspy._misc.eels.gosh_gos import GoshGOS, _GOSH_SOURCES
 from exspy._misc.eels.hartree_slater_gos import HartreeSlaterGOS
 from exspy._misc.eels.hydrogenic_gos import HydrogenicGOS
@@ -142,15 +145,49 @@ class EELSCLEdge(Component):
     fine_structure_components : set, default ``set()``
         A set containing components to model the fine structure region
         of the EELS ionization edge.
+    onset_energy_shift_tolerance : float or None, default None
+        If None, the cross section is integrated every time that the
+        ``onset_energy`` changes. If float, the cross section is integrated
+        only on a grid of energy shifts, whose step is chosen so that the
+        relative error of the linear interpolation between the nodes is
+        lower than the tolerance, and interpolated in between. This speeds
+        up the fitting of the ``onset_energy`` considerably.
     """
 
     _fine_structure_smoothing = 0.3
     _fine_structure_coeff_free = True
     _fine_structure_spline_active = True
+    _onset_energy_shift_tolerance = None
+    _shift_grid_position = None
+    _gradients_cache = None
+    _shift_derivative_cache = None
+    _fine_structure_basis_cache = None
+    # Number of onset energies for which the basis of the fine structure
+    # spline is kept, see `_get_fine_structure_basis`
+    _fine_structure_basis_cache_size = 64
+    # Energy step (eV) used to calculate the change of the tabulated cross
+    # section with the energy shift
+    _shift_derivative_step = 1e-4
+    # Limits of the grid of energy shifts used when
+    # ``onset_energy_shift_tolerance`` is set
+    _max_shift_grid_step = 4.0
+    _min_shift_grid_step = 1 / 64
+    _max_shift_grid_nodes = 256
+    _max_shift_grids = 32
+    # Number of cross sections kept in memory, see `_set_cross_section`
+    _max_cross_sections = 128
+    # Whether the effective angle depends on the navigation position, see
+    # `set_microscope_parameters`
+    _effective_angle_map = False
+    # When deferred, the cross section is only integrated when the component
+    # is evaluated, e.g. while the EELSModel appends several edges
+    _integration_deferred = False
+    _integration_pending = False
 
     def __init__(self, element_subshell, GOS="dft", gos_file_path=None):
         # Declare the parameters
         self.fine_structure_components = FSet(component=self)
+        self._cross_sections = {}
         Component.__init__(
             self,
             ["intensity", "fine_structure_coeff", "effective_angle", "onset_energy"],
@@ -203,12 +240,13 @@ class EELSCLEdge(Component):
         self.intensity.bmax = None
 
         self._whitelist["GOS"] = ("init", GOS)
-        if GOS == "dft":
-            self._whitelist["element_subshell"] = ("init", self.GOS.as_dictionary(True))
-        elif GOS == "dirac":
-            self._whitelist["element_subshell"] = ("init", self.GOS.as_dictionary(True))
-        elif GOS == "Hartree-Slater":  # pragma: no cover
-            self._whitelist["element_subshell"] = ("init", self.GOS.as_dictionary(True))
+        # The tables of the GOS are read-only and shared, therefore they are
+        # only referenced here and copied when exporting the component
+        if GOS in ("dft", "dirac", "Hartree-Slater"):
+            self._whitelist["element_subshell"] = (
+                "init",
+                self.GOS.as_dictionary(fullcopy=False),
+            )
         elif GOS == "hydrogenic":
             self._whitelist["element_subshell"] = ("init", element_subshell)
         self._whitelist["fine_structure_active"] = None
@@ -217,6 +255,7 @@ class EELSCLEdge(Component):
         self._whitelist["fine_structure_spline_onset"] = None
         self._whitelist["fine_structure_spline_active"] = None
         self._whitelist["_fine_structure_coeff_free"] = None
+        self._whitelist["onset_energy_shift_tolerance"] = None
         self.effective_angle.events.value_changed.connect(self._integrate_GOS, [])
         self.onset_energy.events.value_changed.connect(self._integrate_GOS, [])
         self.onset_energy.events.value_changed.connect(self._calculate_knots, [])
@@ -289,16 +328,69 @@ class EELSCLEdge(Component):
         self._calculate_effective_angle()
 
     def _calculate_effective_angle(self):
+        try:
+            alpha = self.convergence_angle
+            beta = self.collection_angle
+        except AttributeError:
+            # All the parameters may not be defined yet...
+            return
+        if np.ndim(alpha) or np.ndim(beta):
+            self._calculate_effective_angle_map(alpha, beta)
+            return
         try:
             self.effective_angle.value = effective_angle(
                 self.E0,
                 self.GOS.onset_energy,
-                self.convergence_angle,
-                self.collection_angle,
+                alpha,
+                beta,
             )
         except BaseException:
             # All the parameters may not be defined yet...
-            pass
+            return
+        if self._effective_angle_map:
+            # The angles do not depend on the navigation position anymore
+            self._effective_angle_map = False
+            self.effective_angle.assign_current_value_to_all()
+
+    def _calculate_effective_angle_map(self, alpha, beta):
+        """Store the effective angle of every navigation position in the map
+        of the ``effective_angle`` parameter.
+
+        The effective angle is only calculated once for each distinct pair
+        of convergence and collection angles.
+        """
+        try:
+            E0 = self.E0
+        except AttributeError:
+            return
+        parameter = self.effective_angle
+        if parameter.map is None or self.model is None:
+            raise ValueError(
+                "The component must be added to a model to set navigation "
+                "dependent microscope parameters."
+            )
+        shape = parameter.map.shape
+        try:
+            alpha = np.broadcast_to(alpha, shape)
+            beta = np.broadcast_to(beta, shape)
+        except ValueError:
+            raise ValueError(
+                "The convergence and collection angles must be scalars or "
+                f"arrays of the navigation shape {shape}."
+            )
+        pairs, inverse = np.unique(
+            np.stack((alpha.ravel(), beta.ravel()), axis=-1),
+            axis=0,
+            return_inverse=True,
+        )
+        angles = np.array(
+            [effective_angle(E0, self.GOS.onset_energy, a, b) for a, b in pairs]
+        )
+        parameter.map["values"][:] = angles[inverse.ravel()].reshape(shape)
+        parameter.map["std"][:] = 0
+        parameter.map["is_set"][:] = True
+        self._effective_angle_map = True
+        parameter.fetch()
 
     def _set_active_fine_structure_components(self, active, **kwargs):
         if not self.fine_structure_active:
@@ -368,6 +460,7 @@ class EELSCLEdge(Component):
         )
         self.fine_structure_coeff.bmin = None
         self.fine_structure_coeff.bmax = None
+        self._fine_structure_basis_cache = None
         self._calculate_knots()
         if self.fine_structure_coeff.map is not None:
             self.fine_structure_coeff._create_array()
@@ -419,12 +512,21 @@ class EELSCLEdge(Component):
         ----------
         E0 : float
             Electron beam energy in keV.
-        alpha: float
+        alpha: float or numpy.ndarray
             Convergence semi-angle in mrad.
-        beta: float
+        beta: float or numpy.ndarray
             Collection semi-angle in mrad.
         energy_scale : float
             The energy step in eV.
+
+        Notes
+        -----
+        If ``alpha`` or ``beta`` are arrays with the navigation shape of the
+        model, the effective angle is calculated for every navigation position
+        and stored in ``effective_angle.map``. The cross section is then
+        integrated once for each distinct effective angle and kept in
+        memory when navigating or fitting. This requires the component to be
+        in a model.
         """
         # Relativistic correction factors
         old = self.effective_angle.value
@@ -438,10 +540,89 @@ class EELSCLEdge(Component):
         if self.effective_angle.value != old:
             self._integrate_GOS()
 
+    def _get_cross_section_cache_key(self, onset_energy, effective_angle):
+        return (
+            self.GOS._source_hash(),
+            self.element,
+            self.subshell,
+            float(self.E0),
+            float(effective_angle),
+            float(onset_energy - self.GOS.onset_energy),
+        )
+
     def _integrate_GOS(self):
-        # Integration over q using splines
-        angle = self.effective_angle.value * 1e-3  # in rad
-        self.tab_xsection = self.GOS.integrateq(self.onset_energy.value, angle, self.E0)
+        if self._integration_deferred:
+            # The cross section is integrated when the component is evaluated,
+            # see `_check_cross_section`
+            self._integration_pending = True
+            return
+        self._set_cross_section(self.onset_energy.value, self.effective_angle.value)
+
+    def _set_cross_section(self, onset_energy, effective_angle, use_cache=True):
+        """Calculate the cross section for the given onset energy (eV) and
+        effective angle (mrad) and store it in the component.
+
+        The cross sections are kept in memory, so that the GOS is only
+        integrated once for each distinct set of onset energy and microscope
+        parameters, e.g. when the effective angle varies across the
+        navigation space. If ``use_cache`` is True, the cross section cache
+        on disk is used as well.
+        """
+        if self.onset_energy_shift_tolerance is not None:
+            self._interpolate_GOS_shift(onset_energy, effective_angle)
+            return
+        self._shift_grid_position = None
+        shift = onset_energy - self.GOS.onset_energy
+        # The onset energy changes at every iteration when it is being fitted
+        # and caching these transient cross sections is not worth the I/O
+        parameter = self.onset_energy
+        fitting_onset = parameter.free or (
+            parameter.twin is not None and parameter.twin.free
+        )
+        # The hash of the source of the GOS changes when its table is edited
+        memory_key = (
+            self.GOS._source_hash(),
+            float(self.E0),
+            float(effective_angle),
+            shift,
+        )
+        cross_section = self._cross_sections.get(memory_key)
+        cache = None if fitting_onset or not use_cache else get_cross_section_cache()
+        if cross_section is None and cache is not None:
+            key = self._get_cross_section_cache_key(onset_energy, effective_angle)
+            cross_section = cache.get(key)
+        if cross_section is not None:
+            self.GOS.energy_shift = shift
+            self.GOS.qint = cross_section["qint"]
+            self.tab_xsection = BSpline(
+                cross_section["t"], cross_section["c"], int(cross_section["k"])
+            )
+            self._power_law_r = float(cross_section["power_law_r"])
+            self._power_law_A = float(cross_section["power_law_A"])
+        else:
+            # Integration over q using splines
+            angle = effective_angle * 1e-3  # in rad
+            self.tab_xsection = self.GOS.integrateq(onset_energy, angle, self.E0)
+            self._calculate_power_law_extrapolation()
+            cross_section = dict(
+                qint=self.GOS.qint,
+                t=self.tab_xsection.t,
+                c=self.tab_xsection.c,
+                k=self.tab_xsection.k,
+                power_law_r=self._power_law_r,
+                power_law_A=self._power_law_A,
+            )
+            if cache is not None:
+                cache.set(key, **cross_section)
+        if not fitting_onset:
+            # Move the cross section to the end, as the most recently used
+            self._cross_sections.pop(memory_key, None)
+            if len(self._cross_sections) >= self._max_cross_sections:
+                # Discard the least recently used cross section
+                del self._cross_sections[next(iter(self._cross_sections))]
+            self._cross_sections[memory_key] = cross_section
+
+    def _calculate_power_law_extrapolation(self):
         # Calculate extrapolation powerlaw extrapolation parameters
         E1 = self.GOS.energy_axis[-2] + self.GOS.energy_shift
         E2 = self.GOS.energy_axis[-1] + self.GOS.energy_shift
@@ -450,10 +631,179 @@ class EELSCLEdge(Component):
         self._power_law_r = math.log(y2 / y1) / math.log(E1 / E2)
         self._power_law_A = y1 / E1**-self._power_law_r
 
-    def _calculate_knots(self):
-        start = self.onset_energy.value
+    @contextlib.contextmanager
+    def _preserve_cross_section(self):
+        """Restore the cross section stored in the component on exit."""
+        state = (
+            self.GOS.energy_shift,
+            self.GOS.qint,
+            self.tab_xsection,
+            self._power_law_A,
+            self._power_law_r,
+            self._shift_grid_position,
+        )
+        try:
+            yield
+        finally:
+            (
+                self.GOS.energy_shift,
+                self.GOS.qint,
+                self.tab_xsection,
+                self._power_law_A,
+                self._power_law_r,
+                self._shift_grid_position,
+            ) = state
+
+    @property
+    def onset_energy_shift_tolerance(self):
+        return self._onset_energy_shift_tolerance
+
+    @onset_energy_shift_tolerance.setter
+    def onset_energy_shift_tolerance(self, value):
+        if value is not None and value <= 0:
+            raise ValueError("The tolerance must be a positive number or None.")
+        self._onset_energy_shift_tolerance = value
+        self._shift_grids = {}
+        if self.GOS is not None and getattr(self, "E0", None) is not None:
+            self._integrate_GOS()
+
+    def _integrate_GOS_shift(self, shift, effective_angle):
+        """Integrate the GOS for the given energy shift and return the
+        cross section and the spline coefficients, with the knots relative to
+        the shift."""
+        angle = effective_angle * 1e-3  # in rad
+        spline = self.GOS.integrateq(self.GOS.onset_energy + shift, angle, self.E0)
+        return self.GOS.qint.copy(), spline.c, spline.t - shift, spline.k
+
+    def _get_shift_grid_step(self, effective_angle):
+        # Halve the distance between the nodes until the linear interpolation
+        # between two nodes reproduces the cross section at the midpoint
+        # within the tolerance
+        tolerance = self.onset_energy_shift_tolerance
+        step = self._max_shift_grid_step
+        qint0 = self._integrate_GOS_shift(0, effective_angle)[0]
+        scale = np.abs(qint0).max()
+        while step > self._min_shift_grid_step:
+            qint1 = self._integrate_GOS_shift(step, effective_angle)[0]
+            qint_mid = self._integrate_GOS_shift(step / 2, effective_angle)[0]
+            error = np.abs(qint_mid - (qint0 + qint1) / 2).max() / scale
+            if error <= tolerance:
+                break
+            step /= 2
+        return step
+
+    def _get_shift_grid(self, effective_angle):
+        """Return the step and the nodes of the grid of energy shifts for the
+        given effective angle.
+
+        A grid is kept for each effective angle so that the pixels of a
+        model with navigation dependent microscope parameters do not reset
+        each other's grid. The hash of the source of the GOS changes when its
+        table is edited, which discards the grids of the previous table.
+        """
+        key = (self.GOS._source_hash(), self.E0, effective_angle)
+        grid = self._shift_grids.get(key)
+        if grid is None:
+            if len(self._shift_grids) >= self._max_shift_grids:
+                # Discard the oldest grid
+                del self._shift_grids[next(iter(self._shift_grids))]
+            grid = (self._get_shift_grid_step(effective_angle), {})
+            self._shift_grids[key] = grid
+        return grid
+
+    def _get_shift_grid_node(self, grid, index, effective_angle):
+        step, nodes = grid
+        node = nodes.get(index)
+        if node is None:
+            if len(nodes) >= self._max_shift_grid_nodes:
+                nodes.clear()
+            node = self._integrate_GOS_shift(index * step, effective_angle)
+            nodes[index] = node
+        return node
+
+    def _interpolate_GOS_shift(self, onset_energy, effective_angle):
+        """Calculate the cross section by linear interpolation between cross
+        sections pre-integrated on a grid of energy shifts."""
+        grid = self._get_shift_grid(effective_angle)
+        step, _ = grid
+        shift = onset_energy - self.GOS.onset_energy
+        position = shift / step
+        index = math.floor(position)
+        weight = position - index
+        qint0, c0, t0, k = self._get_shift_grid_node(grid, index, effective_angle)
+        if weight == 0:
+            qint, c = qint0, c0
+        else:
+            qint1, c1, _, _ = self._get_shift_grid_node(
+                grid, index + 1, effective_angle
+            )
+            # The interpolating spline is linear in the data points, therefore
+            # its coefficients can be interpolated as well
+            qint = (1 - weight) * qint0 + weight * qint1
+            c = (1 - weight) * c0 + weight * c1
+        self._shift_grid_position = (grid, index, effective_angle)
+        self.GOS.energy_shift = shift
+        self.GOS.qint = qint
+        self.tab_xsection = BSpline(t0 + shift, c, k)
+        self._calculate_power_law_extrapolation()
+
+    def _get_shift_derivative(self):
+        """Return the derivatives of ``GOS.qint`` and of the coefficients of
+        the tabulated cross section with respect to the energy shift.
+
+        When the cross section is interpolated between the nodes of the grid
+        of energy shifts, the derivatives of the interpolation are returned.
+        Otherwise, the derivative of ``GOS.qint`` is calculated analytically
+        by the tabulated GOS. The hydrogenic GOS depends on the energy inside
+        the integral over q, therefore its derivative is the forward finite
+        difference of ``GOS.qint``, which integrates the GOS again for a
+        slightly larger energy shift. The derivatives are cached.
+        """
+        if self._shift_grid_position is not None:
+            grid, index, effective_angle = self._shift_grid_position
+            qint0, c0, _, _ = self._get_shift_grid_node(grid, index, effective_angle)
+            qint1, c1, _, _ = self._get_shift_grid_node(
+                grid, index + 1, effective_angle
+            )
+            step, _ = grid
+            return (qint1 - qint0) / step, (c1 - c0) / step
+        shift = self.GOS.energy_shift
+        key = (
+            self.GOS._source_hash(),
+            self.E0,
+            self.effective_angle.value,
+            shift,
+        )
+        if (
+            self._shift_derivative_cache is None
+            or self._shift_derivative_cache[0] != key
+        ):
+            dqint = self.GOS.get_qint_shift_derivative(
+                self.effective_angle.value * 1e-3, self.E0
+            )
+            if dqint is not None:
+                # The knots move with the energy shift, therefore the
+                # coefficients are linear in the tabulated cross section
+                E = self.GOS.energy_axis + shift
+                spline = make_interp_spline(E, dqint, k=self.tab_xsection.k)
+                derivative = (dqint, spline.c)
+            else:
+                step = self._shift_derivative_step
+                with self._preserve_cross_section():
+                    qint1, c1, _, _ = self._integrate_GOS_shift(
+                        shift + step, self.effective_angle.value
+                    )
+                derivative = (
+                    (qint1 - self.GOS.qint) / step,
+                    (c1 - self.tab_xsection.c) / step,
+                )
+            self._shift_derivative_cache = (key, derivative)
+        return self._shift_derivative_cache[1]
+
+    def _get_knots(self, onset_energy):
+        start = onset_energy
         stop = start + self.fine_structure_width
-        self.__knots = np.r_[
+        return np.r_[
             [start] * 4,
             np.linspace(start, stop, self.fine_structure_coeff._number_of_elements)[
                 2:-2
@@ -461,43 +811,310 @@ class EELSCLEdge(Component):
             [stop] * 4,
         ]
 
-    def function(self, E):
-        """Returns the number of counts in barns"""
-        shift = self.onset_energy.value - self.GOS.onset_energy
-        if shift != self.GOS.energy_shift:
-            # Because hspy Events are not executed in any given order,
-            # an external function could be in the same event execution list
-            # as _integrate_GOS and be executed first. That can potentially
-            # cause an error that enforcing _integrate_GOS here prevents. Note
-            # that this is suboptimal because _integrate_GOS is computed twice
-            # unnecessarily.
-            self._integrate_GOS()
+    def _calculate_knots(self):
+        self.__knots = self._get_knots(self.onset_energy.value)
+
+    def _get_fine_structure_basis(self, E, bifs, onset_energy):
+        """Return the B-spline basis of the fine structure evaluated at the
+        energies ``E[bifs]``, with one column per coefficient.
+
+        The basis only depends on the knots, therefore it is cached for each
+        onset energy and energy axis and the fine structure is calculated as
+        a matrix-vector product.
+        """
+        if self._fine_structure_basis_cache is None:
+            self._fine_structure_basis_cache = {}
+        cache = self._fine_structure_basis_cache
+        key = (
+            onset_energy,
+            self.fine_structure_width,
+            self.fine_structure_coeff._number_of_elements,
+            E.shape,
+        )
+        cached = cache.get(key)
+        if (
+            cached is not None
+            and np.array_equal(cached[0], E)
+            and np.array_equal(cached[1], bifs)
+        ):
+            return cached[2]
+        basis = BSpline.design_matrix(
+            E[bifs], self._get_knots(onset_energy), 3
+        ).toarray()
+        basis.flags.writeable = False
+        cache.pop(key, None)
+        if len(cache) >= self._fine_structure_basis_cache_size:
+            # Discard the oldest entry
+            del cache[next(iter(cache))]
+        cache[key] = (E.copy(), bifs.copy(), basis)
+        return basis
+
+    def _get_cross_section_regions(self, E, onset_energy):
+        """Return the masks of the energies where the tabulated cross
+        section, its power law extrapolation and the fine structure spline
+        are used. The latter is None if the spline is not active."""
         Emax = self.GOS.energy_axis[-1] + self.GOS.energy_shift
-        cts = np.zeros_like(E, dtype="float")
+        bifs = None
+        bext = E >= Emax
         if self.fine_structure_active:
-            ifsx1 = self.onset_energy.value + self.fine_structure_spline_onset
-            ifsx2 = self.onset_energy.value + self.fine_structure_width
+            ifsx1 = onset_energy + self.fine_structure_spline_onset
+            ifsx2 = onset_energy + self.fine_structure_width
             if self.fine_structure_spline_active:
-                bifs = (E >= ifsx1) & (E < ifsx2)
-                # Only set the spline values if the spline is in the energy region
-                if np.any(bifs):
-                    cts[bifs] = splev(
-                        E[bifs],
-                        (self.__knots, self.fine_structure_coeff.value + (0,) * 4, 3),
-                    )
+                bifs = (E >= ifsx1) & (E < ifsx2) & ~bext
             # The cross-section is set to 0 in the fine structure region
             itab = (E < Emax) & (E >= ifsx2)
         else:
-            itab = (E < Emax) & (E >= self.onset_energy.value)
+            itab = (E < Emax) & (E >= onset_energy)
+        return itab, bext, bifs
+
+    def _get_support(self):
+        """Return the energy interval outside of which the component is
+        zero, which is used by the model to only evaluate the component at
+        the energies where it is not zero.
+
+        Returns
+        -------
+        start, end : float
+            The bounds of the interval ``[start, end)``, the end being
+            infinite.
+        """
+        onset_energy = self.onset_energy.value
+        # Same regions as in `_get_cross_section_regions`, with the energy
+        # shift of the GOS that is used once the cross section is integrated
+        Emax = self.GOS.energy_axis[-1] + onset_energy - self.GOS.onset_energy
+        start = onset_energy
+        if self.fine_structure_active:
+            start = onset_energy + self.fine_structure_width
+            if self.fine_structure_spline_active:
+                start = min(start, onset_energy + self.fine_structure_spline_onset)
+        return min(start, Emax), np.inf
+
+    def _get_cross_section_values(self, E, onset_energy):
+        """Evaluate the cross section stored in the component, without the
+        intensity and the fine structure spline.
+
+        Returns
+        -------
+        cts : numpy.ndarray
+            The cross section, which is zero in the fine structure region.
+        bifs : numpy.ndarray or None
+            The mask of the energies where the fine structure spline must be
+            added or None if the spline is not active.
+        """
+        itab, bext, bifs = self._get_cross_section_regions(E, onset_energy)
+        cts = np.zeros_like(E, dtype="float")
         if itab.any():
             cts[itab] = self.tab_xsection(E[itab])
-        bext = E >= Emax
         if bext.any():
             cts[bext] = self._power_law_A * E[bext] ** -self._power_law_r
+        return cts, bifs
+
+    def _check_cross_section(self):
+        if self._integration_pending:
+            self._integration_pending = False
+            self._set_cross_section(self.onset_energy.value, self.effective_angle.value)
+            return
+        shift = self.onset_energy.value - self.GOS.onset_energy
+        if shift != self.GOS.energy_shift:
+            # Because hspy Events are not executed in any given order,
+            # an external function could be in the same event execution list
+            # as _integrate_GOS and be executed first. That can potentially
+            # cause an error that enforcing _integrate_GOS here prevents. Note
+            # that this is suboptimal because _integrate_GOS is computed twice
+            # unnecessarily.
+            self._integrate_GOS()
+
+    def function(self, E):
+        """Returns the number of counts in barns"""
+        self._check_cross_section()
+        cts, bifs = self._get_cross_section_values(E, self.onset_energy.value)
+        # Only set the spline values if the spline is in the energy region
+        if bifs is not None and np.any(bifs):
+            basis = self._get_fine_structure_basis(E, bifs, self.onset_energy.value)
+            coefficients = np.atleast_1d(self.fine_structure_coeff.value)
+            n = min(coefficients.size, basis.shape[1])
+            cts[bifs] = basis[:, :n] @ coefficients[:n]
         return cts * self.intensity.value
 
+    def function_nd(self, axis, parameters_values=None):
+        """
+        Calculate the component over the given axis and the parameters
+        values of all the navigation positions.
+
+        The pixels that have the same onset energy and effective angle are
+        calculated at once, so that the cross section is only evaluated once
+        for each of these groups. If the onset energy varies from pixel to
+        pixel, setting :attr:`onset_energy_shift_tolerance` avoids
+        integrating the GOS for every pixel.
+
+        Parameters
+        ----------
+        axis : numpy.ndarray
+            The axis onto which the component is calculated.
+        %s
+
+        Returns
+        -------
+        numpy.ndarray
+            The component values.
+        """
+        if parameters_values is None:
+            parameters_values = [p.map["values"] for p in self.parameters]
+        if not self._is_navigation_multidimensional:
+            return self.function(axis)
+        values = {
+            p._id_name: np.asarray(value)
+            for p, value in zip(self.parameters, parameters_values)
+        }
+        intensity = values["intensity"]
+        navigation_shape = intensity.shape
+        npixels = intensity.size
+        onset_energy = np.broadcast_to(values["onset_energy"], navigation_shape)
+        effective_angle = np.broadcast_to(values["effective_angle"], navigation_shape)
+        groups, inverse = np.unique(
+            np.stack((onset_energy.ravel(), effective_angle.ravel()), axis=-1),
+            axis=0,
+            return_inverse=True,
+        )
+        inverse = inverse.ravel()
+        # As in `function`, the missing coefficients of the spline are zero
+        fine_structure_coeff = np.pad(
+            np.reshape(values["fine_structure_coeff"], (npixels, -1)),
+            ((0, 0), (0, 4)),
+        )
+        current = (self.onset_energy.value, self.effective_angle.value)
+        self._check_cross_section()
+        result = np.empty((npixels, axis.size))
+        with self._preserve_cross_section():
+            for i, (onset, angle) in enumerate(groups):
+                if (onset, angle) != current:
+                    self._set_cross_section(onset, angle, use_cache=False)
+                    current = (onset, angle)
+                cts, bifs = self._get_cross_section_values(axis, onset)
+                pixels = inverse == i
+                block = np.broadcast_to(cts, (np.count_nonzero(pixels), axis.size))
+                if bifs is not None and np.any(bifs):
+                    block = block.copy()
+                    basis = self._get_fine_structure_basis(axis, bifs, onset)
+                    block[:, bifs] = (
+                        fine_structure_coeff[pixels, : basis.shape[1]] @ basis.T
+                    )
+                result[pixels] = block
+        result *= intensity.reshape(npixels, 1)
+        return result.reshape(navigation_shape + axis.shape)
+
+    function_nd.__doc__ %= FUNCTION_ND_DOCSTRING
+
+    def function_and_gradients(self, E):
+        """Calculate the component and its gradients in a single pass.
+
+        Parameters
+        ----------
+        E : numpy.ndarray
+            The energy axis.
+
+        Returns
+        -------
+        values : numpy.ndarray
+            The values of the component, as returned by :meth:`function`.
+        gradients : dict
+            The gradients with respect to the ``"intensity"``,
+            ``"onset_energy"`` and ``"fine_structure_coeff"`` parameters.
+            The gradient of ``fine_structure_coeff`` has one row per
+            coefficient.
+
+        Notes
+        -----
+        The gradient with respect to the onset energy is calculated from the
+        derivatives of the tabulated cross section and of the fine
+        structure spline. The change of the tabulated values with the energy
+        shift is obtained by integrating the GOS once more for a slightly
+        larger shift, unless :attr:`onset_energy_shift_tolerance` is set, in
+        which case the gradient of the interpolated cross section is used.
+        The discontinuity at the end of the fine structure region is
+        neglected.
+        """
+        values, gradients = self._get_values_and_gradients(E)
+        gradients = {name: grad.copy() for name, grad in gradients.items()}
+        gradients["onset_energy"] = self.grad_onset_energy(E)
+        return values.copy(), gradients
+
+    def _get_values_and_gradients(self, E):
+        """Return the values of the component and the gradients of the
+        linear parameters, ``intensity`` and ``fine_structure_coeff``."""
+        # The result is cached because the model requests the gradient of
+        # each parameter separately
+        self._check_cross_section()
+        key = (
+            self.intensity.value,
+            self.onset_energy.value,
+            self.fine_structure_coeff.value,
+            self.tab_xsection,
+            self.fine_structure_active,
+            self.fine_structure_spline_active,
+            self.fine_structure_spline_onset,
+            self.fine_structure_width,
+        )
+        cached = self._gradients_cache
+        if cached is not None and cached[0] == key and np.array_equal(cached[1], E):
+            return cached[2]
+
+        intensity = self.intensity.value
+        cts, bifs = self._get_cross_section_values(E, self.onset_energy.value)
+        coefficients = np.atleast_1d(self.fine_structure_coeff.value)
+        dcoeff = np.zeros((coefficients.size,) + E.shape)
+        if bifs is not None and bifs.any():
+            basis = self._get_fine_structure_basis(E, bifs, self.onset_energy.value)
+            n = min(coefficients.size, basis.shape[1])
+            dcoeff[:n, bifs] = basis[:, :n].T
+            cts[bifs] = basis[:, :n] @ coefficients[:n]
+        gradients = {"intensity": cts, "fine_structure_coeff": dcoeff * intensity}
+        result = (cts * intensity, gradients)
+        self._gradients_cache = (key, E.copy(), result)
+        return result
+
     def grad_intensity(self, E):
-        return self.function(E) / self.intensity.value
+        return self._get_values_and_gradients(E)[1]["intensity"].copy()
+
+    def grad_fine_structure_coeff(self, E):
+        return self._get_values_and_gradients(E)[1]["fine_structure_coeff"].copy()
+
+    def grad_onset_energy(self, E):
+        self._check_cross_section()
+        onset_energy = self.onset_energy.value
+        itab, bext, bifs = self._get_cross_section_regions(E, onset_energy)
+        dqint, dc = self._get_shift_derivative()
+        grad = np.zeros_like(E, dtype="float")
+        if itab.any():
+            # The tabulated cross section moves with the onset energy and
+            # its values change with the energy shift
+            t, _, k = self.tab_xsection.tck
+            grad[itab] = BSpline(t, dc, k)(E[itab]) - self.tab_xsection.derivative()(
+                E[itab]
+            )
+        if bext.any():
+            # Power law extrapolation, A * E**-r = y1 * (E1 / E)**r
+            qint = self.GOS.qint
+            E1 = self.GOS.energy_axis[-2] + self.GOS.energy_shift
+            E2 = self.GOS.energy_axis[-1] + self.GOS.energy_shift
+            dlogy1 = dqint[-2] / qint[-2]
+            dlogy2 = dqint[-1] / qint[-1]
+            log_ratio = math.log(E1 / E2)
+            dr = (
+                (dlogy2 - dlogy1) * log_ratio
+                - math.log(qint[-1] / qint[-2]) * (1 / E1 - 1 / E2)
+            ) / log_ratio**2
+            grad[bext] = (
+                self._power_law_A
+                * E[bext] ** -self._power_law_r
+                * (dlogy1 + self._power_law_r / E1 + dr * np.log(E1 / E[bext]))
+            )
+        if bifs is not None and bifs.any():
+            # The knots of the fine structure spline move with the onset
+            coefficients = np.atleast_1d(self.fine_structure_coeff.value)
+            spline = BSpline(self.__knots, np.pad(coefficients, (0, 4)), 3)
+            grad[bifs] = -spline.derivative()(E[bifs])
+        return grad * self.intensity.value
 
     def fine_structure_coeff_to_txt(self, filename):
         np.savetxt(filename + ".dat", self.fine_structure_coeff.value, fmt="%12.6G")
@@ -48,6 +48,44 @@ def add_np(doctest_namespace):
     doctest_namespace["hs"] = hs
 
 
+@pytest.fixture(scope="session")
+def gosh_file(tmp_path_factory):
+    """Small synthetic GOS database in the gosh format, to test the tabulated
+    GOS without downloading the GOSH databases."""
+    import h5py
+
+    filename = tmp_path_factory.mktemp("gosh") / "synthetic.gosh"
+    free_energies = np.geomspace(1, 1000, 40)
+    q = np.geomspace(1e8, 5e11, 60)
+    with h5py.File(filename, "w") as h:
+        edges_info = h.create_group("metadata/edges_info")
+        edges = [
+            ("K", "K1", 1),
+            ("L1", "L1", 1),
+            ("L2", "L3", 1 / 2),
+            ("L3", "L3", 1),
+            ("M1", "M1", 1),
+            ("M2", "M3", 1 / 2),
+            ("M3", "M3", 1),
+            ("M4", "M5", 2 / 3),
+            ("M5", "M5", 1),
+        ]
+        tables = sorted(set(edge[1] for edge in edges))
+        for subshell, table, ratio in edges:
+            group = edges_info.create_group(subshell)
+            group.attrs["table"] = table
+            group.attrs["occupancy_ratio"] = ratio
+        h.create_group("metadata/data_ref").attrs["data_doi"] = "10.0/synthetic"
+        for Z, element in enumerate(["B", "C", "N", "O", "Ti", "Mn"]):
+            for table in tables:
+                group = h.create_group(f"{element}/{table}")
+                gos = np.exp(-q[:, np.newaxis] / (1e10 * (1 + free_energies / 50)))
+                group["data"] = (gos / (1 + free_energies / 100) ** 2)[..., np.newaxis]
+                group["q"] = q
+                group["free_energies"] = free_energies + Z
+    return str(filename)
+
+
 @pytest.fixture
 def pdb_cmdopt(request):
     return request.config.getoption("--pdb")
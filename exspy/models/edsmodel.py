@@ -18,13 +18,17 @@
 
 from __future__ import division
 
+import functools
 import warnings
 import numpy as np
 import math
 import logging
 
+import hyperspy.api as hs
 from hyperspy.misc.utils import stash_active_state
+from exspy._misc.checkpoint import checkpointed_multifit
 from exspy._misc.eds.utils import _get_element_and_line
+from exspy._misc.fit_profile import FitProfiler
 
 from hyperspy.models.model1d import Model1D
 from exspy.signals.eds import EDSSpectrum
@@ -133,6 +137,7 @@ class EDSModel(Model1D):
         self.end_energy = min(end_energy, self.signal._get_beam_energy())
         self.start_energy = self.axes_manager.signal_axes[0].low_value
         self.background_components = list()
+        self.fit_profile = None
         if "dictionary" in kwargs or len(args) > 1:
             auto_add_lines = False
             auto_background = False
@@ -401,6 +406,103 @@ class EDSModel(Model1D):
                     self.set_signal_range_from_mask(signal_range_mask)
                 self.fix_background()
 
+    def multifit(
+        self,
+        mask=None,
+        *,
+        checkpoint=None,
+        checkpoint_every=1000,
+        resume=False,
+        profile=False,
+        show_progressbar=None,
+        **kwargs,
+    ):
+        """Fit the data to the model at all positions of the navigation
+        dimensions, optionally saving checkpoints.
+
+        Parameters
+        ----------
+        mask : numpy.ndarray of bool, optional
+            An array with the navigation shape of the signal, where True
+            indicates that the pixel is not fitted.
+        checkpoint : str or os.PathLike, optional
+            If given, the parameter maps and the pixels which are fitted are
+            saved to this file every ``checkpoint_every`` pixels.
+        checkpoint_every : int
+            Only with ``checkpoint``. The number of pixels fitted between
+            two checkpoints.
+        resume : bool
+            Only with ``checkpoint``. If True and the ``checkpoint`` file
+            exists, the parameter maps are loaded from it and only the pixels
+            which are not fitted yet are fitted.
+        profile : bool
+            If True, the cost of the fit of every pixel is recorded in the
+            ``fit_profile`` attribute. See the Notes section.
+        show_progressbar : bool, optional
+            If None, the default from the preferences settings is used.
+        **kwargs : dict
+            Any extra keyword argument is passed to
+            :py:meth:`~hyperspy.model.BaseModel.multifit`.
+
+        Notes
+        -----
+        The checkpoint file is a pickle of the dictionary of the model given
+        by :py:meth:`~hyperspy.model.BaseModel.as_dictionary` and of the mask
+        of the fitted pixels. If the process is interrupted, running the same
+        script with ``resume=True`` carries on from the last checkpoint. Only
+        load checkpoints from trusted sources.
+
+        With ``profile=True``, ``fit_profile`` is a dictionary of signals
+        with the navigation shape: the wall time of the fit in seconds
+        (``"time"``), the number of evaluations of the model
+        (``"nfev"``) and of its Jacobian (``"njev"``), the status of the
+        optimizer (``"status"``) and the reduced chi-squared
+        (``"red_chisq"``) of every pixel, and the dictionary of the time
+        spent in the ``function`` method of every component
+        (``"component_time"``). The pixels fitted all at once by the linear
+        optimizers are not recorded and are NaN.
+
+        See Also
+        --------
+        * :py:meth:`~hyperspy.model.BaseModel.multifit`
+
+        """
+        if profile:
+            with FitProfiler(self) as profiler:
+                self.multifit(
+                    mask=mask,
+                    checkpoint=checkpoint,
+                    checkpoint_every=checkpoint_every,
+                    resume=resume,
+                    show_progressbar=show_progressbar,
+                    **kwargs,
+                )
+            self.fit_profile = profiler.get_signals()
+            return
+        if checkpoint is None or self.axes_manager.navigation_dimension == 0:
+            return super().multifit(
+                mask=mask, show_progressbar=show_progressbar, **kwargs
+            )
+        if show_progressbar is None:
+            show_progressbar = hs.preferences.General.show_progressbar
+        nav_shape = self.axes_manager._navigation_shape_in_array
+        if mask is not None and mask.shape != nav_shape:
+            raise ValueError(
+                "The mask must be a numpy array of boolean type with "
+                f"shape: {nav_shape}"
+            )
+        iterpath = kwargs.pop("iterpath", None)
+        checkpointed_multifit(
+            self,
+            functools.partial(super().multifit, show_progressbar=False, **kwargs),
+            checkpoint,
+            checkpoint_every=checkpoint_every,
+            resume=resume,
+            mask=mask,
+            iterpath=iterpath,
+            show_progressbar=show_progressbar,
+        )
+
     def _twin_xray_lines_width(self, xray_lines):
         """
         Twin the width of the peaks
@@ -16,24 +16,57 @@
 # You should have received a copy of the GNU General Public License
 # along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
 
+import contextlib
 import copy
+import functools
 import logging
 import warnings
 
+import hyperspy.api as hs
+import numpy as np
 from hyperspy import components1d
 from hyperspy.components1d import PowerLaw
 from hyperspy.docstrings.model import FIT_PARAMETERS_ARG
 from hyperspy.misc.utils import dummy_context_manager
 from hyperspy.misc.axis_tools import calculate_convolution1D_axis
+from hyperspy.external.progressbar import progressbar
+from hyperspy.model import _twinned_parameter
 from hyperspy.models.model1d import Model1D
+from hyperspy.signal import BaseSignal
 
 from exspy._docstrings.model import EELSMODEL_PARAMETERS
-from exspy.components import EELSCLEdge
+from exspy._misc.checkpoint import checkpointed_multifit
+from exspy._misc.eels.background_fit import fit_power_law
+from exspy._misc.eels.chunked_fit import chunked_multifit
+from exspy._misc.eels.convolution import LowLossFFT
+from exspy._misc.eels.linear_fit import (
+    LINEAR_OPTIMIZERS,
+    get_batch_size,
+    solve_linear,
+)
+from exspy._misc.eels.neighbour_fit import get_pixel_order, neighbour_multifit
+from exspy._misc.eels.parallel_fit import parallel_multifit
+from exspy._misc.fit_profile import FitProfiler
+from exspy.components import DoublePowerLaw, EELSCLEdge
 from exspy.signals.eels import EELSSpectrum
 
 
 _logger = logging.getLogger(__name__)
 
+# The optimizers with which hyperspy fits all the navigation positions at once
+_VECTORIZED_OPTIMIZERS = ("lstsq", "ols", "nnls", "ridge", "ridge_regression")
+
+
+def _get_twinned_value(parameter, twin, value):
+    """Return the value of a parameter twinned, possibly through a chain of
+    twins, with ``twin`` when ``twin`` has the given value."""
+    chain = [parameter]
+    while chain[-1].twin is not twin:
+        chain.append(chain[-1].twin)
+    for twinned in chain[::-1]:
+        value = np.vectorize(twinned._twin_function, otypes=[float])(value)
+    return value
+
 
 class EELSModel(Model1D):
     def __init__(
@@ -67,6 +100,11 @@ class EELSModel(Model1D):
         self._preedge_safe_window_width = 2
         self._suspend_auto_fine_structure_width = False
         self._low_loss = None
+        self._low_loss_fft = None
+        self._appending_in_bulk = False
+        self._deferred_edges = []
+        self.fit_profile = None
+        self._model_buffer = None
         self._convolved = False
         self._convolution_axis = None
         self.low_loss = low_loss
@@ -84,7 +122,8 @@ class EELSModel(Model1D):
         if dictionary is not None:
             auto_background = False
             auto_add_edges = False
-            self._load_dictionary(dictionary)
+            with self._bulk_append():
+                self._load_dictionary(dictionary)
             for edge in self.edges:
                 fine_structure_components = set()
                 for comp_name in edge.fine_structure_components:
@@ -150,6 +189,10 @@ class EELSModel(Model1D):
 
     @low_loss.setter
     def low_loss(self, value):
+        if self._low_loss is not None:
+            event = self._low_loss.events.data_changed
+            if self._clear_low_loss_fft in event.connected:
+                event.disconnect(self._clear_low_loss_fft)
         if value is not None:
             if (
                 value.axes_manager.navigation_shape
@@ -165,12 +208,21 @@ class EELSModel(Model1D):
                 )
             self._low_loss = value
             self._set_convolution_axis()
+            self._low_loss_fft = LowLossFFT(value, len(self._convolution_axis))
+            value.events.data_changed.connect(self._clear_low_loss_fft, [])
             self.convolved = True
         else:
             self._low_loss = value
+            self._low_loss_fft = None
             self._convolution_axis = None
             self.convolved = False
 
+    def _clear_low_loss_fft(self):
+        # The FFTs of the low-loss spectra are out of date once its data
+        # has changed
+        if self._low_loss_fft is not None:
+            self._low_loss_fft.clear()
+
     # Extend the list methods to call the _touch when the model is modified
 
     def set_convolution_axis(self):
@@ -193,6 +245,160 @@ class EELSModel(Model1D):
         # Used in hyperspy
         return self._low_loss
 
+    def _convolve(self, values, pixels=None):
+        """Convolve arrays calculated on the convolution axis with the
+        low-loss spectrum.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            The arrays to convolve, along their last axis.
+        pixels : numpy.ndarray of int, optional
+            The indices of the pixels in the flattened navigation space, to
+            convolve ``values[i]`` with the low-loss spectrum of
+            ``pixels[i]``. If None, the low-loss spectrum of the current
+            pixel is used.
+
+        """
+        low_loss_fft = self._low_loss_fft
+        if low_loss_fft is not None and low_loss_fft.signal is self._low_loss:
+            if pixels is None:
+                pixels = low_loss_fft.get_pixel(self.axes_manager.indices)
+            return low_loss_fft.convolve(values, pixels)
+        # The low-loss spectrum has been set without the `low_loss` setter
+        low_loss = self._low_loss._get_current_data(self.axes_manager)
+        return np.apply_along_axis(np.convolve, -1, values, low_loss, mode="valid")
+
+    def _convolve_component_values(self, component_values):
+        return self._convolve(component_values * np.ones(self._convolution_axis.shape))
+
+    def _get_support_slice(self, component, axis):
+        """Return the slice of the ascending ``axis`` outside of which the
+        values of the component are zero, as given by its ``_get_support``
+        method, e.g. above the onset of the ionisation edges."""
+        get_support = getattr(component, "_get_support", None)
+        if get_support is None or axis.size == 0 or axis[0] > axis[-1]:
+            return slice(None)
+        return slice(*axis.searchsorted(get_support()))
+
+    def _add_component_values(self, component, axis, out):
+        """Add the values of the component on ``axis`` to ``out``, only
+        evaluating the component on its support."""
+        support = self._get_support_slice(component, axis)
+        E = axis[support]
+        if E.size:
+            out[support] += component.function(E)
+
+    def _get_model_buffer(self, size):
+        # The sum of the components is written in the same array at every
+        # evaluation of the model
+        if self._model_buffer is None or self._model_buffer.size != size:
+            self._model_buffer = np.empty(size)
+        self._model_buffer[:] = 0.0
+        return self._model_buffer
+
+    def _get_current_data(
+        self,
+        onlyactive=False,
+        component_list=None,
+        binned=None,
+        ignore_channel_switches=False,
+    ):
+        # Same as Model1D._get_current_data, but the components are only
+        # evaluated on their support and the convolution uses the FFT of the
+        # low-loss spectrum, which is only calculated once. Model1D has no
+        # hook for the convolution, therefore the results are compared with
+        # those of Model1D in test_current_data_and_jacobian_match_model1d
+        if component_list is None:
+            component_list = self
+        if not isinstance(component_list, (list, tuple)):
+            raise ValueError("'Component_list' parameter need to be a list or None")
+        if onlyactive:
+            component_list = [
+                component for component in component_list if component.active
+            ]
+
+        channels = slice(None) if ignore_channel_switches else self._channel_switches
+        axis = self.axis.axis[channels]
+        model_data = self._get_model_buffer(axis.size)
+        if self._convolved:
+            sum_convolved = np.zeros_like(self._convolution_axis, dtype=float)
+            for component in component_list:
+                if component.convolved:
+                    self._add_component_values(
+                        component, self._convolution_axis, sum_convolved
+                    )
+            model_data += self._convolve(sum_convolved)[channels]
+        for component in component_list:
+            if not (self._convolved and component.convolved):
+                self._add_component_values(component, axis, model_data)
+
+        if binned is None:
+            binned = self.axis.is_binned
+        if binned:
+            if self.axis.is_uniform:
+                return model_data * self.axis.scale
+            return model_data * np.gradient(self.axis.axis)[channels]
+        return model_data.copy()
+
+    _get_current_data.__doc__ = Model1D._get_current_data.__doc__
+
+    def _get_parameter_gradient(self, parameter, axis):
+        """Return the gradient of the parameter on ``axis``, only evaluated
+        on the support of its component."""
+        support = self._get_support_slice(parameter.component, axis)
+        if support == slice(None):
+            return parameter.grad(axis)
+        E = axis[support]
+        if not E.size:
+            return np.zeros((parameter._number_of_elements, axis.size))
+        par_grad = parameter.grad(E)
+        grad = np.zeros(np.shape(par_grad)[:-1] + axis.shape)
+        grad[..., support] = par_grad
+        return grad
+
+    def _jacobian(self, param, y, weights=None):
+        # Same as Model1D._jacobian, but the gradients are only evaluated on
+        # the fitted channels in the support of the components and the
+        # gradients of the parameters with several elements, e.g. the fine
+        # structure coefficients of the edges, are also supported when the
+        # model is convolved. See also the comment of _get_current_data
+        if weights is None:
+            weights = 1.0
+
+        channels = self._channel_switches
+        axis = self.axis.axis[channels]
+        counter = 0
+        grads = [np.zeros((0, axis.size))]
+        for component in self:  # Cut the parameters list
+            if component.active:
+                component.fetch_values_from_array(
+                    param[counter : counter + component._nfree_param], onlyfree=True
+                )
+                convolved = self._convolved and component.convolved
+                grad_axis = self._convolution_axis if convolved else axis
+                for parameter in component.free_parameters:
+                    par_grad = self._get_parameter_gradient(parameter, grad_axis)
+                    for par in parameter._twins:
+                        par_grad = par_grad + self._get_parameter_gradient(
+                            par, grad_axis
+                        )
+                    if convolved:
+                        par_grad = self._convolve(par_grad)[..., channels]
+                    grads.append(np.atleast_2d(par_grad))
+
+                counter += component._nfree_param
+
+        to_return = np.vstack(grads) * weights
+
+        if self.axis.is_binned:
+            if self.axis.is_uniform:
+                to_return *= self.axis.scale
+            else:
+                to_return *= np.gradient(self.axis.axis)[channels]
+
+        return to_return
+
     def append(self, component):
         """Append component to EELS model.
 
@@ -213,6 +419,9 @@ class EELSModel(Model1D):
                 raise NotImplementedError(
                     "This operation is not yet implemented for non-uniform energy axes"
                 )
+            if self._appending_in_bulk:
+                component._integration_deferred = True
+                self._deferred_edges.append(component)
             tem = self.signal.metadata.Acquisition_instrument.TEM
             component.set_microscope_parameters(
                 E0=tem.beam_energy,
@@ -222,10 +431,40 @@ class EELSModel(Model1D):
             )
             component.energy_scale = self.axis.scale
             component._set_fine_structure_coeff()
-        self._classify_components()
+        if not self._appending_in_bulk:
+            self._classify_components()
 
     append.__doc__ = Model1D.append.__doc__
 
+    def extend(self, iterable):
+        with self._bulk_append():
+            super().extend(iterable)
+
+    extend.__doc__ = Model1D.extend.__doc__
+
+    @contextlib.contextmanager
+    def _bulk_append(self):
+        """Append several components at once.
+
+        The classification of the components, which sorts the edges,
+        resolves the fine structure and estimates the background, is done
+        once on exit instead of after each component. The cross sections of
+        the edges are integrated when they are first evaluated.
+        """
+        if self._appending_in_bulk:
+            # Nested call, the outermost one classifies the components
+            yield
+            return
+        self._appending_in_bulk = True
+        try:
+            yield
+        finally:
+            self._appending_in_bulk = False
+            for edge in self._deferred_edges:
+                edge._integration_deferred = False
+            self._deferred_edges = []
+            self._classify_components()
+
     def remove(self, component):
         super().remove(component)
         self._classify_components()
@@ -296,35 +535,36 @@ class EELSModel(Model1D):
         if e_shells is None:
             e_shells = list(self.signal.subshells)
         e_shells.sort()
-        master_edge = EELSCLEdge(
-            e_shells.pop(), self.GOS, gos_file_path=self.gos_file_path
-        )
-        self.append(master_edge)
-        element = master_edge.element
-        while len(e_shells) > 0:
-            next_element = e_shells[-1].split("_")[0]
-            if next_element != element:
-                # New master edge
-                self._add_edges_from_subshells_names(e_shells=e_shells)
-            elif self.GOS == "hydrogenic":
-                # The hydrogenic GOS includes all the L subshells in one
-                # so we get rid of the others
-                e_shells.pop()
-            else:
-                # Add the other subshells of the same element
-                # and couple their intensity and onset_energy to that of the
-                # master edge
-                edge = EELSCLEdge(
-                    e_shells.pop(), GOS=self.GOS, gos_file_path=self.gos_file_path
-                )
+        with self._bulk_append():
+            master_edge = EELSCLEdge(
+                e_shells.pop(), self.GOS, gos_file_path=self.gos_file_path
+            )
+            self.append(master_edge)
+            element = master_edge.element
+            while len(e_shells) > 0:
+                next_element = e_shells[-1].split("_")[0]
+                if next_element != element:
+                    # New master edge
+                    self._add_edges_from_subshells_names(e_shells=e_shells)
+                elif self.GOS == "hydrogenic":
+                    # The hydrogenic GOS includes all the L subshells in one
+                    # so we get rid of the others
+                    e_shells.pop()
+                else:
+                    # Add the other subshells of the same element
+                    # and couple their intensity and onset_energy to that of the
+                    # master edge
+                    edge = EELSCLEdge(
+                        e_shells.pop(), GOS=self.GOS, gos_file_path=self.gos_file_path
+                    )
 
-                edge.intensity.twin = master_edge.intensity
-                edge.onset_energy.twin = master_edge.onset_energy
-                edge.onset_energy.twin_function_expr = "x + {}".format(
-                    (edge.GOS.onset_energy - master_edge.GOS.onset_energy)
-                )
-                edge.free_onset_energy = False
-                self.append(edge)
+                    edge.intensity.twin = master_edge.intensity
+                    edge.onset_energy.twin = master_edge.onset_energy
+                    edge.onset_energy.twin_function_expr = "x + {}".format(
+                        (edge.GOS.onset_energy - master_edge.GOS.onset_energy)
+                    )
+                    edge.free_onset_energy = False
+                    self.append(edge)
 
     def resolve_fine_structure(self, preedge_safe_window_width=2, i1=0):
         """Adjust the fine structure of all edges to avoid overlapping
@@ -479,6 +719,655 @@ class EELSModel(Model1D):
 
     smart_fit.__doc__ %= FIT_PARAMETERS_ARG
 
+    def smart_multifit(self, start_energy=None, *, profile=False, **kwargs):
+        """Fits EELS edges in a cascade style at all positions of the
+        navigation dimensions.
+
+        The stages of :py:meth:`~.models.EELSModel.smart_fit` are run one
+        after the other over all the pixels: first the background is fitted
+        at all the pixels, then the first edge, and so on. Therefore, the
+        signal range, the active edges and the fine structure are set once
+        per stage instead of once per pixel, as with
+        ``multifit(kind="smart")``. Each pixel starts every stage from the
+        values fitted at this pixel in the previous stage.
+
+        Parameters
+        ----------
+        start_energy : {float, None}
+            If float, limit the range of energies from the left to the
+            given value.
+        profile : bool
+            If True, the cost of all the stages of the fit of every pixel is
+            recorded in the ``fit_profile`` attribute, as described in
+            :py:meth:`~.models.EELSModel.multifit`.
+        **kwargs : dict
+            All extra keyword arguments are passed to
+            :py:meth:`~.models.EELSModel.multifit`.
+
+        Notes
+        -----
+        The energy ranges of the stages are defined by the onset energies
+        of the edges at the current pixel, while they are defined by the
+        onset energies at every pixel with ``multifit(kind="smart")``. The
+        results differ when the onset energies vary across the navigation
+        space.
+
+        See Also
+        --------
+        * :py:meth:`~hyperspy.model.EELSModel.smart_fit`
+        * :py:meth:`~hyperspy.model.EELSModel.multifit`
+
+        """
+        if profile:
+            with FitProfiler(self) as profiler:
+                self.smart_multifit(start_energy, **kwargs)
+            self.fit_profile = profiler.get_signals()
+            return
+        self.fit_background(start_energy, only_current=False, **kwargs)
+        for i in range(0, len(self._active_edges)):
+            self._fit_edge(i, start_energy, only_current=False, **kwargs)
+
+    def multifit(
+        self,
+        mask=None,
+        *,
+        num_workers=None,
+        tile_shape=None,
+        store=None,
+        warm_start=None,
+        max_deviation=0.5,
+        max_requeue=1,
+        checkpoint=None,
+        checkpoint_every=1000,
+        resume=False,
+        profile=False,
+        show_progressbar=None,
+        **kwargs,
+    ):
+        """Fit the data to the model at all positions of the navigation
+        dimensions, optionally in several processes.
+
+        Parameters
+        ----------
+        mask : numpy.ndarray of bool, optional
+            An array with the navigation shape of the signal, where True
+            indicates that the pixel is not fitted.
+        num_workers : None or int
+            If None or 1, the pixels are fitted in the current process. If
+            larger than 1, the navigation space is split in tiles, which are
+            fitted by ``num_workers`` worker processes. If 0 or negative,
+            use as many workers as there are CPUs.
+        tile_shape : tuple of int, optional
+            Only with several workers. The shape of the tiles in the order
+            of the navigation axes. If None, the slowest navigation axis is
+            split in several tiles per worker.
+        store : str, os.PathLike, h5py.Group or zarr.Group, optional
+            Only with lazy signals. The group, or the path of a zarr store
+            if it ends with ``".zarr"`` and of a HDF5 file otherwise, where
+            the parameter maps are written after fitting each chunk. See
+            the Notes section.
+        warm_start : None or "neighbours"
+            If None, each pixel starts from the stored values of the
+            parameters or from the values of the previously fitted pixel,
+            see :py:meth:`~hyperspy.model.BaseModel.multifit`. If
+            ``"neighbours"``, the free parameters of each pixel start from
+            the median of their values at the already fitted neighbouring
+            pixels and the pixels are fitted along a Hilbert curve, unless
+            another ``iterpath`` is given. See the Notes section.
+        max_deviation : float
+            Only with ``warm_start="neighbours"``. The pixels where a free
+            parameter differs from the median of its neighbours by more
+            than ``max_deviation`` times the sum of the absolute value of
+            the median and of the median absolute deviation of the
+            neighbours are fitted again later.
+        max_requeue : int
+            Only with ``warm_start="neighbours"``. The maximum number of
+            times a pixel is fitted again.
+        checkpoint : str or os.PathLike, optional
+            If given, the parameter maps and the pixels which are fitted are
+            saved to this file every ``checkpoint_every`` pixels. Only when
+            fitting in the current process. See the Notes section.
+        checkpoint_every : int
+            Only with ``checkpoint``. The number of pixels fitted between
+            two checkpoints.
+        resume : bool
+            Only with ``checkpoint``. If True and the ``checkpoint`` file
+            exists, the parameter maps are loaded from it and only the pixels
+            which are not fitted yet are fitted.
+        profile : bool
+            If True, the cost of the fit of every pixel is recorded in the
+            ``fit_profile`` attribute. Only when fitting in the current
+            process. See the Notes section.
+        show_progressbar : bool, optional
+            If None, the default from the preferences settings is used.
+        **kwargs : dict
+            Any extra keyword argument is passed to
+            :py:meth:`~hyperspy.model.BaseModel.multifit`. In addition to
+            the iterpaths of :py:meth:`~hyperspy.model.BaseModel.multifit`,
+            ``iterpath="hilbert"`` fits the pixels along a Hilbert curve,
+            which keeps consecutive pixels adjacent, in two navigation
+            dimensions and falls back to ``"serpentine"`` otherwise.
+
+        Raises
+        ------
+        ValueError
+            If ``autosave``, ``interactive_plot`` or a custom ``iterpath``
+            are used with several workers, with a lazy signal or with
+            ``warm_start``, if ``store`` is used with a signal which is not
+            lazy or if ``checkpoint`` or ``profile`` are used with several
+            workers or a lazy signal.
+
+        Notes
+        -----
+        The workers read the signal, the low-loss spectrum and the GOS
+        tables from shared memory and write the fitted values to shared
+        copies of the parameter maps, which are copied to the maps of the
+        model once all the tiles are fitted. Each tile starts from the
+        current values of the parameters, so that the result does not
+        depend on the number of workers, and is therefore not strictly
+        identical to the result of the serial fit, where the first pixel of
+        a tile starts from the values of the previous pixel.
+
+        On platforms that start the workers with the ``"spawn"`` method,
+        e.g. Windows and macOS, the calling script must be protected by an
+        ``if __name__ == "__main__":`` block.
+
+        Lazy signals are fitted one chunk of the navigation space of their
+        data at a time, optionally with several workers. Only the data of
+        one chunk is loaded in memory and, like the tiles, every chunk
+        starts from the current values of the parameters. The maps of each
+        parameter are written to the ``values``, ``std`` and ``is_set``
+        datasets of the ``<component>/<parameter>`` group of ``store``, and
+        ``chisq`` and ``dof`` to the datasets of the same name. The fitting
+        of the linear parameters of lazy signals in one operation, i.e. with
+        a linear ``optimizer``, is left to
+        :py:meth:`~hyperspy.model.BaseModel.multifit`.
+
+        With ``warm_start="neighbours"``, only the pixels which are already
+        fitted are used as neighbours, which is why the order of the pixels
+        matters: along a Hilbert curve, most pixels have several fitted
+        neighbours. A pixel whose fitted values deviate from its neighbours,
+        e.g. because the fit converged to a local minimum, is put back at
+        the end of the queue, fitted again from the median of its then
+        fitted neighbours and the fit with the lowest chi-squared is kept.
+        With several workers or lazy signals, the neighbours are limited to
+        the tile or the chunk of the pixel.
+
+        The checkpoint file is a pickle of the dictionary of the model given
+        by :py:meth:`~hyperspy.model.BaseModel.as_dictionary`, without the
+        low-loss spectrum, and of the mask of the fitted pixels, which is
+        replaced atomically after fitting each block of pixels. If the
+        process is interrupted, running the same script with
+        ``resume=True`` carries on from the last checkpoint, which must have
+        been saved by a model with the same components and navigation shape.
+        Only load checkpoints from trusted sources.
+
+        With ``profile=True``, ``fit_profile`` is a dictionary of signals
+        with the navigation shape: the wall time of the fit in seconds
+        (``"time"``), the number of evaluations of the model
+        (``"nfev"``) and of its Jacobian (``"njev"``), the status of the
+        optimizer (``"status"``) and the reduced chi-squared
+        (``"red_chisq"``) of every pixel, and the dictionaries of the time
+        spent in the ``function`` method of every component
+        (``"component_time"``) and in the integration of the GOS of every
+        edge (``"gos_time"``). The pixels fitted all at once by the linear
+        optimizers are not recorded and are NaN.
+
+        See Also
+        --------
+        * :py:meth:`~hyperspy.model.BaseModel.multifit`
+        * :py:meth:`~hyperspy.model.EELSModel.linear_multifit`
+
+        """
+        if show_progressbar is None:
+            show_progressbar = hs.preferences.General.show_progressbar
+        lazy = (
+            self.signal._lazy and kwargs.get("optimizer") not in _VECTORIZED_OPTIMIZERS
+        )
+        if store is not None and not lazy:
+            raise ValueError("`store` is only supported with lazy signals.")
+        if profile:
+            if num_workers not in (None, 1) or lazy:
+                raise ValueError(
+                    "`profile` is not supported with several workers or lazy signals."
+                )
+            with FitProfiler(self) as profiler:
+                self.multifit(
+                    mask=mask,
+                    warm_start=warm_start,
+                    max_deviation=max_deviation,
+                    max_requeue=max_requeue,
+                    checkpoint=checkpoint,
+                    checkpoint_every=checkpoint_every,
+                    resume=resume,
+                    show_progressbar=show_progressbar,
+                    **kwargs,
+                )
+            self.fit_profile = profiler.get_signals()
+            return
+        if warm_start not in (None, "neighbours"):
+            raise ValueError(
+                f"`warm_start` must be None or 'neighbours', not '{warm_start}'."
+            )
+        if warm_start is not None and kwargs.get("iterpath") is None:
+            kwargs["iterpath"] = "hilbert"
+        if self.axes_manager.navigation_dimension == 0:
+            kwargs.pop("iterpath", None)
+            return super().multifit(
+                mask=mask, show_progressbar=show_progressbar, **kwargs
+            )
+        nav_shape = self.axes_manager._navigation_shape_in_array
+        if mask is not None and mask.shape != nav_shape:
+            raise ValueError(
+                "The mask must be a numpy array of boolean type with "
+                f"shape: {nav_shape}"
+            )
+        if checkpoint is not None:
+            if num_workers not in (None, 1) or lazy:
+                raise ValueError(
+                    "`checkpoint` is not supported with several workers or lazy "
+                    "signals."
+                )
+            iterpath = kwargs.pop("iterpath", None)
+            if warm_start is None:
+                multifit = functools.partial(
+                    self.multifit, show_progressbar=False, **kwargs
+                )
+            else:
+                for key in ("autosave", "interactive_plot"):
+                    if kwargs.pop(key, False):
+                        raise ValueError(f"`{key}` is not supported with `warm_start`.")
+                # The pixels are fitted in a single pass, so that the pixels
+                # fitted in previous blocks, or before resuming, are used as
+                # neighbours and the requeued pixels are fitted at the end
+                multifit = functools.partial(
+                    neighbour_multifit,
+                    self,
+                    max_deviation=max_deviation,
+                    max_requeue=max_requeue,
+                    **kwargs,
+                )
+            return checkpointed_multifit(
+                self,
+                multifit,
+                checkpoint,
+                checkpoint_every=checkpoint_every,
+                resume=resume,
+                mask=mask,
+                iterpath=iterpath,
+                show_progressbar=show_progressbar,
+                incremental=warm_start is not None,
+            )
+        if num_workers in (None, 1) and not lazy:
+            if warm_start is None:
+                if kwargs.get("iterpath") == "hilbert":
+                    kwargs["iterpath"] = get_pixel_order(
+                        self.axes_manager.navigation_shape, "hilbert"
+                    )
+                return super().multifit(
+                    mask=mask, show_progressbar=show_progressbar, **kwargs
+                )
+            for key in ("autosave", "interactive_plot"):
+                if kwargs.pop(key, False):
+                    raise ValueError(f"`{key}` is not supported with `warm_start`.")
+            return neighbour_multifit(
+                self,
+                mask=mask,
+                max_deviation=max_deviation,
+                max_requeue=max_requeue,
+                show_progressbar=show_progressbar,
+                **kwargs,
+            )
+        if warm_start is not None:
+            kwargs.update(
+                warm_start=warm_start,
+                max_deviation=max_deviation,
+                max_requeue=max_requeue,
+            )
+        for key in ("autosave", "interactive_plot"):
+            if kwargs.pop(key, False):
+                raise ValueError(
+                    f"`{key}` is not supported with several workers or lazy signals."
+                )
+        if lazy:
+            chunked_multifit(
+                self,
+                mask=mask,
+                store=store,
+                show_progressbar=show_progressbar,
+                num_workers=num_workers,
+                tile_shape=tile_shape,
+                **kwargs,
+            )
+        else:
+            parallel_multifit(
+                self,
+                mask=mask,
+                num_workers=num_workers,
+                tile_shape=tile_shape,
+                show_progressbar=show_progressbar,
+                **kwargs,
+            )
+
+    def linear_multifit(
+        self,
+        optimizer="lstsq",
+        mask=None,
+        calculate_errors=False,
+        show_progressbar=None,
+    ):
+        """Fit the linear parameters of the model at all navigation
+        positions at once.
+
+        When the non-linear parameters, e.g. the onset energy and the fine
+        structure of the edges and the exponent of the power law, are not
+        free, the model is linear in the remaining free parameters, e.g. the
+        intensities of the edges and the amplitude of the background. The
+        basis of each component is calculated once for each distinct set of
+        values of its non-free parameters and the pixels are solved in
+        batches with one least squares call.
+
+        Parameters
+        ----------
+        optimizer : {"lstsq", "nnls"}, default "lstsq"
+            If ``"lstsq"``, ordinary least squares. If ``"nnls"``, the free
+            parameters are constrained to be positive.
+        mask : numpy.ndarray of bool, optional
+            An array with the navigation shape of the signal, where True
+            indicates that the pixel is not fitted.
+        calculate_errors : bool, default False
+            If True, calculate the standard deviation of the free
+            parameters.
+        show_progressbar : bool, optional
+            If None, the default from the preferences settings is used.
+
+        Raises
+        ------
+        RuntimeError
+            If the model has free non-linear parameters or no free
+            parameters.
+        ValueError
+            If a component has more than one free linear parameter.
+
+        Notes
+        -----
+        Twinned linear parameters contribute to the parameter they are
+        twinned with, which must be free, and the channels excluded by the
+        signal range are not fitted. The convolution with the low-loss
+        spectrum and the noise variance of the signal, if set, are taken
+        into account.
+
+        See Also
+        --------
+        * :py:meth:`~hyperspy.model.BaseModel.multifit`
+
+        """
+        if show_progressbar is None:
+            show_progressbar = hs.preferences.General.show_progressbar
+        if optimizer not in LINEAR_OPTIMIZERS:
+            raise ValueError(
+                f"Optimizer `'{optimizer}'` not supported. "
+                f"Use one of {LINEAR_OPTIMIZERS}."
+            )
+        nav_shape = self.axes_manager._navigation_shape_in_array
+        npixels = int(np.prod(nav_shape, dtype=int))
+        if mask is not None and mask.shape != nav_shape:
+            raise ValueError(
+                "The mask must be a numpy array of boolean type with "
+                f"shape: {nav_shape}"
+            )
+        components = [c for c in self if c.active or c.active_is_multidimensional]
+        free_nonlinear_parameters = [
+            p for c in components for p in c.parameters if p.free and not p._linear
+        ]
+        if free_nonlinear_parameters:
+            raise RuntimeError(
+                "Not all free parameters are linear. Set the non-linear "
+                "parameters not free, e.g. with "
+                "`m.set_parameters_not_free(only_nonlinear=True)`. "
+                "These parameters are nonlinear and free:\n\t"
+                + "\n\t".join(str(p) for p in free_nonlinear_parameters)
+            )
+        free_parameters = [p for c in components for p in c.parameters if p.free]
+        if not free_parameters:
+            raise RuntimeError("Model does not contain any free components!")
+        fitted = np.arange(npixels)
+        if mask is not None:
+            fitted = fitted[~mask.ravel()]
+
+        # For each component, the linear parameter that is fitted and the
+        # distinct values of the other parameters
+        specs = []
+        fixed_parameters = {}
+        for component in components:
+            linear = [
+                p
+                for p in component.parameters
+                if p.free or (p._linear and _twinned_parameter(p) in free_parameters)
+            ]
+            if len(linear) > 1:
+                raise ValueError(
+                    f"Component {component} has more than one free linear "
+                    "parameter, which is not supported."
+                )
+            linear = linear[0] if linear else None
+            others = [p for p in component.parameters if p is not linear]
+            keys = [np.zeros((npixels, 0))]
+            for p in others:
+                values = np.array(p.map["values"], dtype=float).reshape(npixels, -1)
+                values[~p.map["is_set"].ravel()] = np.ravel(p.value)
+                fixed_parameters[p] = values
+                keys.append(values)
+            groups, inverse = np.unique(
+                np.hstack(keys)[fitted], axis=0, return_inverse=True
+            )
+            if component.active_is_multidimensional:
+                active = component._active_array.ravel()[fitted]
+            else:
+                active = np.ones(len(fitted), dtype=bool)
+            spec = {
+                "component": component,
+                "linear": linear,
+                "others": others,
+                "groups": groups,
+                "inverse": inverse.ravel(),
+                "active": active,
+                "convolved": int(self.convolved and component.convolved),
+                "cached": None,
+            }
+            if linear is not None:
+                spec["column"] = free_parameters.index(
+                    linear if linear.free else _twinned_parameter(linear)
+                )
+            specs.append(spec)
+
+        channels = self._channel_switches
+        convolved = self.convolved
+        data = self.signal.data.reshape(npixels, -1)
+        variance = self.signal.get_noise_variance()
+        if isinstance(variance, BaseSignal):
+            variance = variance.data.reshape(npixels, -1)
+        else:
+            # A constant variance does not change the solution
+            variance = None
+        if self.axis.is_binned:
+            if self.axis.is_uniform:
+                scale = self.axis.scale
+            else:
+                scale = np.gradient(self.axis.axis)
+        else:
+            scale = 1.0
+        scale = np.broadcast_to(scale, self.axis.axis.shape)[channels]
+        nbasis = len(free_parameters)
+        batch_size = get_batch_size(
+            np.count_nonzero(channels), nbasis + 1, per_pixel_basis=True
+        )
+
+        coefficients = np.full((npixels, nbasis), np.nan)
+        std = np.full_like(coefficients, np.nan)
+        pbar = progressbar(total=len(fitted), disable=not show_progressbar)
+        with self.suspend_update(update_on_resume=False):
+            for start in range(0, len(fitted), batch_size):
+                positions = slice(start, start + batch_size)
+                batch = fitted[positions]
+                parts = [
+                    self._get_linear_basis_part(spec, positions, channels, scale)
+                    for spec in specs
+                ]
+                # The basis is shared by all the pixels of the batch when
+                # none of the components vary within the batch
+                shared = not convolved and all(part[2] is None for part in parts)
+                n = 1 if shared else len(batch)
+                # The last row is the sum of the components that do not
+                # depend on the free parameters
+                basis = np.zeros((n, nbasis + 1, np.count_nonzero(channels)))
+                bases = [basis]
+                if convolved:
+                    size = len(self._convolution_axis)
+                    bases.append(np.zeros((n, nbasis + 1, size)))
+                for spec, (values, column, inverse, active) in zip(specs, parts):
+                    rows = {-1: values}
+                    if column is not None:
+                        rows[spec["column"]] = column
+                    for row, values in rows.items():
+                        if inverse is None:
+                            if active:
+                                bases[spec["convolved"]][:, row] += values[0]
+                        else:
+                            bases[spec["convolved"]][:, row] += (
+                                values[inverse] * active[:, np.newaxis]
+                            )
+                if convolved:
+                    convolved_basis = self._convolve(bases[1], pixels=batch)
+                    basis = basis + convolved_basis[..., channels] * scale
+                if len(basis) == 1:
+                    basis = basis[0]
+                weights = None
+                if variance is not None:
+                    weights = 1 / np.sqrt(
+                        np.asarray(variance[batch], dtype=float)[:, channels]
+                    )
+                target = np.asarray(data[batch], dtype=float)[:, channels]
+                x, x_std = solve_linear(
+                    basis[..., :-1, :],
+                    target - basis[..., -1, :],
+                    optimizer=optimizer,
+                    weights=weights,
+                    calculate_errors=calculate_errors,
+                )
+                coefficients[batch] = x
+                if x_std is not None:
+                    std[batch] = x_std
+                pbar.update(len(batch))
+        pbar.close()
+
+        for i, p in enumerate(free_parameters):
+            p.map["values"].flat[fitted] = coefficients[fitted, i]
+            p.map["std"].flat[fitted] = std[fitted, i]
+            p.map["is_set"].flat[fitted] = True
+        for spec in specs:
+            p = spec["linear"]
+            if p is not None and not p.free:
+                twin = _twinned_parameter(p)
+                p.map["values"].flat[fitted] = _get_twinned_value(
+                    p, twin, twin.map["values"].flat[fitted]
+                )
+                p.map["std"].flat[fitted] = np.nan
+                p.map["is_set"].flat[fitted] = True
+        for p, values in fixed_parameters.items():
+            if p._number_of_elements:
+                p.map["values"].reshape(npixels, -1)[fitted] = values[fitted]
+                p.map["is_set"].flat[fitted] = True
+        self.fetch_stored_values()
+
+    def _get_linear_basis_part(self, spec, positions, channels, scale):
+        """Calculate a component for the pixels of a batch.
+
+        Returns
+        -------
+        values : numpy.ndarray
+            The component with its linear parameter set to zero, for each
+            distinct set of parameter values in the batch.
+        column : numpy.ndarray or None
+            The change of the component when its linear parameter
+            increases by one, if it has a free linear parameter.
+        inverse : numpy.ndarray or None
+            The index of the set of parameter values of each pixel, or None
+            if the component does not vary within the batch.
+        active : numpy.ndarray or bool
+            Whether the component is active in each pixel.
+
+        Notes
+        -----
+        The components that are not convolved are returned for the channels
+        of the signal range and multiplied by the bin width if the signal
+        is binned.
+        """
+        groups, inverse = np.unique(spec["inverse"][positions], return_inverse=True)
+        inverse = inverse.ravel()
+        active = spec["active"][positions]
+        if len(groups) == 1 and np.all(active == active[0]):
+            inverse, active = None, active[0]
+        cached = spec["cached"]
+        if len(groups) == 1 and cached is not None and cached[0] == groups[0]:
+            return cached[1] + (inverse, active)
+
+        axis = self._convolution_axis if spec["convolved"] else self.axis.axis
+        values = self._evaluate_linear_component(spec, groups, 0.0, axis)
+        column = None
+        if spec["linear"] is not None:
+            column = self._evaluate_linear_component(spec, groups, 1.0, axis) - values
+        if not spec["convolved"]:
+            values = values[:, channels] * scale
+            if column is not None:
+                column = column[:, channels] * scale
+        if len(groups) == 1:
+            spec["cached"] = (groups[0], (values, column))
+        return values, column, inverse, active
+
+    def _evaluate_linear_component(self, spec, groups, linear_value, axis):
+        """Calculate a component for several sets of values of its
+        parameters."""
+        component = spec["component"]
+        values = spec["groups"][groups]
+        linear = spec["linear"]
+        parameters_values = {}
+        i = 0
+        for p in spec["others"]:
+            n = p._number_of_elements
+            parameters_values[p] = values[:, i : i + n]
+            if n == 1:
+                parameters_values[p] = parameters_values[p][:, 0]
+            i += n
+        if linear is not None:
+            if linear.free:
+                parameters_values[linear] = np.full(len(values), linear_value)
+            else:
+                parameters_values[linear] = np.full(
+                    len(values),
+                    _get_twinned_value(
+                        linear, _twinned_parameter(linear), linear_value
+                    ),
+                )
+        if self.axes_manager.navigation_dimension and hasattr(component, "function_nd"):
+            return component.function_nd(
+                axis,
+                parameters_values=[parameters_values[p] for p in component.parameters],
+            ).reshape(len(values), len(axis))
+        # Evaluate the component one set of values at a time. The twinned
+        # parameters take the value of their twin.
+        result = np.empty((len(values), len(axis)))
+        for j in range(len(values)):
+            for p in component.parameters:
+                if p.twin is None and p._number_of_elements == 1:
+                    p.value = parameters_values[p][j]
+                elif p.twin is None and p._number_of_elements > 1:
+                    p.value = tuple(parameters_values[p][j])
+            if linear is not None and linear.twin is not None:
+                _twinned_parameter(linear).value = linear_value
+            result[j] = component.function(axis)
+        return result
+
     def _get_first_ionization_edge_energy(self, start_energy=None):
         """Calculate the first ionization edge energy.
 
@@ -506,7 +1395,15 @@ class EELSModel(Model1D):
             start_energy = E0
         return start_energy
 
-    def fit_background(self, start_energy=None, only_current=True, **kwargs):
+    def fit_background(
+        self,
+        start_energy=None,
+        only_current=True,
+        *,
+        closed_form=False,
+        iterations=5,
+        **kwargs,
+    ):
         """Fit the background to the first active ionization edge
         in the energy range.
 
@@ -518,9 +1415,38 @@ class EELSModel(Model1D):
         only_current : bool, optional
             If True, only fit the background at the current coordinates.
             Default True.
+        closed_form : bool, optional
+            If True, the amplitude and the exponent of a
+            :py:class:`hyperspy.api.model.components1D.PowerLaw` or
+            :py:class:`~.components.DoublePowerLaw` background are fitted
+            to all the pixels at once, without calling fit or multifit.
+            See the Notes section. Default False.
+        iterations : int, optional
+            Only with ``closed_form=True``. The number of Gauss-Newton
+            steps refining the fit. Default 5.
         **kwargs : extra key word arguments
             All extra key word arguments are passed to fit or
-            multifit.
+            multifit. With ``closed_form=True``, only the ``mask`` and
+            ``show_progressbar`` arguments of multifit are accepted.
+
+        Raises
+        ------
+        ValueError
+            With ``closed_form=True``, if the background is not a single
+            power law, if it is convolved, if other components are active
+            in the fitted energy range or if other parameters than ``A``
+            and ``r`` are free.
+
+        Notes
+        -----
+        With ``closed_form=True``, the exponent is first estimated by a
+        weighted least squares fit in logarithmic scale, which is refined by
+        ``iterations`` vectorised Gauss-Newton steps, the amplitude taking
+        its least squares value for each exponent. The channels excluded by
+        the signal range or where the data is not finite are not fitted and
+        the noise variance of the signal, if set, is taken into account.
+        The ``origin``, ``shift`` and ``ratio`` parameters take their
+        current values. The bounds of the parameters are not enforced.
 
         """
 
@@ -537,13 +1463,120 @@ class EELSModel(Model1D):
         else:
             E2 = None
         self.set_signal_range(start_energy, E2)
+        try:
+            if closed_form:
+                self._fit_power_law_background(only_current, iterations, **kwargs)
+            elif only_current:
+                self.fit(**kwargs)
+            else:
+                self.multifit(**kwargs)
+        finally:
+            self._channel_switches = copy.copy(self._backup_channel_switches)
+            if iee is not None:
+                self.enable_edges(to_disable)
+
+    def _fit_power_law_background(
+        self, only_current, iterations, mask=None, show_progressbar=None
+    ):
+        if show_progressbar is None:
+            show_progressbar = hs.preferences.General.show_progressbar
+        background = self._active_background_components
+        if len(background) != 1 or not isinstance(
+            background[0], (PowerLaw, DoublePowerLaw)
+        ):
+            raise ValueError(
+                "The closed form fit requires a single `PowerLaw` or "
+                "`DoublePowerLaw` background component."
+            )
+        background = background[0]
+        others = [c for c in self if c.active and c is not background]
+        if others:
+            raise ValueError(
+                "The closed form fit requires the background to be the only "
+                "active component in the fitted energy range, but these "
+                f"components are active: {[c.name for c in others]}."
+            )
+        if self.convolved and background.convolved:
+            raise ValueError(
+                "The closed form fit does not support convolved backgrounds."
+            )
+        free = {p.name for p in background.parameters if p.free}
+        if free != {"A", "r"}:
+            raise ValueError(
+                "The closed form fit requires the `A` and `r` parameters, and "
+                "only them, to be free."
+            )
+        nav_shape = self.axes_manager._navigation_shape_in_array
+        npixels = int(np.prod(nav_shape, dtype=int))
+        if mask is not None and mask.shape != nav_shape:
+            raise ValueError(
+                "The mask must be a numpy array of boolean type with "
+                f"shape: {nav_shape}"
+            )
         if only_current:
-            self.fit(**kwargs)
+            current = np.ravel_multi_index(self.axes_manager.indices[::-1], nav_shape)
+            fitted = np.array([current])
         else:
-            self.multifit(**kwargs)
-        self._channel_switches = copy.copy(self._backup_channel_switches)
-        if iee is not None:
-            self.enable_edges(to_disable)
+            fitted = np.arange(npixels)
+        if mask is not None:
+            fitted = fitted[~mask.ravel()[fitted]]
+
+        shift = None
+        x = self.axis.axis - background.origin.value
+        channels = self._channel_switches & (
+            self.axis.axis > background.left_cutoff.value
+        )
+        if isinstance(background, DoublePowerLaw):
+            shift, ratio = background.shift.value, background.ratio.value
+            channels &= x > max(shift, 0)
+        else:
+            ratio = None
+            channels &= x > 0
+        if self.axis.is_binned:
+            if self.axis.is_uniform:
+                scale = self.axis.scale
+            else:
+                scale = np.gradient(self.axis.axis)[channels]
+        else:
+            scale = 1.0
+        data = self.signal.data.reshape(npixels, -1)
+        variance = self.signal.get_noise_variance()
+        if isinstance(variance, BaseSignal):
+            variance = variance.data.reshape(npixels, -1)
+        else:
+            # A constant variance does not change the solution
+            variance = None
+        batch_size = get_batch_size(np.count_nonzero(channels), 4, False)
+
+        parameters = (background.A, background.r)
+        with progressbar(total=len(fitted), disable=not show_progressbar) as pbar:
+            for start in range(0, len(fitted), batch_size):
+                batch = fitted[start : start + batch_size]
+                weights = None
+                if variance is not None:
+                    with np.errstate(divide="ignore"):
+                        weights = 1 / np.sqrt(
+                            np.asarray(variance[batch], dtype=float)[:, channels]
+                        )
+                A, r, A_std, r_std = fit_power_law(
+                    x[channels],
+                    np.asarray(data[batch], dtype=float)[:, channels],
+                    weights=weights,
+                    scale=scale,
+                    shift=shift,
+                    ratio=ratio,
+                    iterations=iterations,
+                )
+                for parameter, values, std in zip(parameters, (A, r), (A_std, r_std)):
+                    parameter.map["values"].flat[batch] = values
+                    parameter.map["std"].flat[batch] = std
+                    parameter.map["is_set"].flat[batch] = True
+                pbar.update(len(batch))
+        for parameter in background.parameters:
+            if parameter not in parameters and parameter._number_of_elements:
+                parameter.map["values"].flat[fitted] = parameter.value
+                parameter.map["is_set"].flat[fitted] = True
+        self.fetch_stored_values()
 
     def two_area_background_estimation(self, E1=None, E2=None, powerlaw=None):
         """Estimates the parameters of a power law background with the two
@@ -591,7 +1624,8 @@ class EELSModel(Model1D):
             )
             return
 
-    def _fit_edge(self, edgenumber, start_energy=None, **kwargs):
+    def _fit_edge(self, edgenumber, start_energy=None, only_current=True, **kwargs):
+        fit = self.fit if only_current else self.multifit
         backup_channel_switches = self._channel_switches.copy()
         ea = self.axis.axis[self._channel_switches]
         if start_energy is None:
@@ -651,7 +1685,7 @@ class EELSModel(Model1D):
         self.set_signal_range(start_energy, nextedgeenergy)
         if edge.free_onset_energy is True:
             edge.onset_energy.free = True
-            self.fit(**kwargs)
+            fit(**kwargs)
             edge.onset_energy.free = False
             _logger.info("onset_energy = %s", edge.onset_energy.value)
             self._classify_components()
@@ -659,12 +1693,12 @@ class EELSModel(Model1D):
             self.enable_fine_structure(to_activate_fs)
             self.remove_fine_structure_data(to_activate_fs)
             self.disable_fine_structure(to_activate_fs)
-            self.fit(**kwargs)
+            fit(**kwargs)
 
         if len(to_activate_fs) > 0:
             self.set_signal_range(start_energy, nextedgeenergy)
             self.enable_fine_structure(to_activate_fs)
-            self.fit(**kwargs)
+            fit(**kwargs)
 
         self.enable_edges(edges_to_activate)
         # Recover the _channel_switches. Remove it or make it smarter.
@@ -674,6 +1708,10 @@ class EELSModel(Model1D):
         """Prints the value of the intensity of all the independent
         active EELS core loss edges defined in the model
 
+        See Also
+        --------
+        get_quantification_maps
+
         """
         elements = {}
         for edge in self._active_edges:
@@ -696,6 +1734,157 @@ class EELSModel(Model1D):
                         "%s_%s\t%f" % (element, subshell, elements[element][subshell])
                     )
 
+    def _get_quantification_edges(self, edges=None):
+        """Return a dictionary of the edges used to quantify each element,
+        replacing the edges whose intensity is twinned by the edge they are
+        twinned to."""
+        if edges is None:
+            edges = [edge for edge in self._active_edges if edge.intensity.twin is None]
+        elements = {}
+        for edge in edges:
+            edge = self._get_component(edge)
+            while isinstance(edge, EELSCLEdge) and edge.intensity.twin is not None:
+                edge = edge.intensity.twin.component
+            if not isinstance(edge, EELSCLEdge):
+                raise ValueError(f"{edge} is not an EELS core-loss edge.")
+            other = elements.setdefault(edge.element, edge)
+            if other is not edge:
+                raise ValueError(
+                    f"Both the {other.name} and {edge.name} edges quantify "
+                    f"{edge.element}. Select one of them with `edges`."
+                )
+        if not elements:
+            raise ValueError("There are no edges to quantify.")
+        return elements
+
+    def get_quantification_maps(self, edges=None):
+        """Return the absolute and relative quantification of the elements
+        at all navigation positions.
+
+        The areal density of each element is given by the intensity of one of
+        its ionisation edges and the composition is calculated from the areal
+        densities for all the pixels at once.
+
+        Parameters
+        ----------
+        edges : list of EELSCLEdge or str, optional
+            The edges, or their names, used to quantify the elements, one per
+            element. An edge whose intensity is twinned, e.g. the L2 edge
+            twinned to the L3 edge, is replaced by the edge it is twinned
+            to. If None, all the active edges whose intensity is not twinned
+            are used.
+
+        Returns
+        -------
+        areal_density : list of hyperspy.api.signals.BaseSignal
+            The areal density of each element.
+        composition : list of hyperspy.api.signals.BaseSignal
+            The composition of the sample in atomic percent.
+
+        Raises
+        ------
+        ValueError
+            If several edges quantify the same element or if there are no
+            edges.
+
+        Notes
+        -----
+        When the model is convolved with the low-loss spectrum, the
+        intensities of the edges are the areal densities in atoms per barn.
+        Otherwise, the areal densities are multiplied by the intensity of the
+        low-loss spectrum, which cancels out in the composition.
+
+        The variance of the maps is propagated from the standard deviation
+        of the intensities, neglecting their correlations, and is stored in
+        ``metadata.Signal.Noise_properties.variance``, as in
+        :py:meth:`~hyperspy.component.Parameter.as_signal`. The pixels that
+        are not fitted are NaN. The signals are lazy if the signal of the
+        model is lazy.
+
+        Examples
+        --------
+        >>> m.multifit(kind="smart")  # doctest: +SKIP
+        >>> areal_density, composition = m.get_quantification_maps()  # doctest: +SKIP
+        >>> composition[0].plot()  # doctest: +SKIP
+
+        See Also
+        --------
+        quantify
+        """
+        elements = self._get_quantification_edges(edges)
+        lazy = self.signal._lazy
+        if lazy:
+            import dask.array as da
+
+            chunks = self.signal.data.chunks[: self.axes_manager.navigation_dimension]
+
+        def as_array(array):
+            return da.from_array(array, chunks=chunks) if lazy else array
+
+        values, variances = [], []
+        for edge in elements.values():
+            fitted = edge.intensity.map["is_set"]
+            if edge.active_is_multidimensional:
+                fitted = fitted & edge._active_array
+            values.append(
+                as_array(np.where(fitted, edge.intensity.map["values"], np.nan))
+            )
+            variances.append(as_array(edge.intensity.map["std"] ** 2))
+
+        total = sum(values)
+        total_variance = sum(variances)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            composition = [value / total * 100 for value in values]
+            # The derivatives of value_i / total are (total - value_i) / total**2
+            # and -value_i / total**2 with respect to value_i and value_j
+            composition_variances = [
+                (
+                    (total - value) ** 2 * variance
+                    + value**2 * (total_variance - variance)
+                )
+                / total**4
+                * 100**2
+                for value, variance in zip(values, variances)
+            ]
+
+        axes = self.axes_manager._get_navigation_axes_dicts()
+
+        def to_signal(data, variance, title, element):
+            signal = BaseSignal(data, axes=axes)
+            for axis in signal.axes_manager._axes:
+                axis.navigate = False
+            signal.metadata.General.title = title
+            signal.metadata.set_item("Sample.elements", [element])
+            if variance is not None:
+                variance = to_signal(variance, None, "Variance", element)
+                signal.metadata.set_item("Signal.Noise_properties.variance", variance)
+            signal._assign_subclass()
+            return signal.as_lazy() if lazy else signal
+
+        # As in Parameter.as_signal, the variance is only set if it is known
+        known = [
+            not np.isnan(edge.intensity.map["std"]).all() for edge in elements.values()
+        ]
+        areal_density_signals, composition_signals = [], []
+        for i, element in enumerate(elements):
+            areal_density_signals.append(
+                to_signal(
+                    values[i],
+                    variances[i] if known[i] else None,
+                    f"areal density of {element}",
+                    element,
+                )
+            )
+            composition_signals.append(
+                to_signal(
+                    composition[i],
+                    composition_variances[i] if all(known) else None,
+                    f"atomic percent of {element}",
+                    element,
+                )
+            )
+        return areal_density_signals, composition_signals
+
     def remove_fine_structure_data(self, edges_list=None):
         """Remove the fine structure data from the fitting routine as
         defined in the fine_structure_width parameter of the
@@ -950,6 +2139,118 @@ class EELSModel(Model1D):
             if edge.isbackground is False:
                 edge.free_onset_energy = True
 
+    def set_onset_energy_shift_tolerance(self, tolerance, edges_list=None):
+        """Set the tolerance of the interpolation of the cross sections when
+        the onset energy of the edges listed in edges_list changes.
+
+        When the tolerance is not None, the cross sections are only
+        integrated on a grid of energy shifts and linearly interpolated in
+        between, which makes fitting the onset energy much faster.
+        See :attr:`~.components.EELSCLEdge.onset_energy_shift_tolerance`.
+
+        Parameters
+        ----------
+        tolerance : float or None
+            Maximum relative error of the interpolated cross sections. If
+            None, the cross sections are integrated for every onset energy.
+        edges_list : None or list of EELSCLEdge or list of edge names
+            If None, the operation is performed on all the edges in the model.
+            Otherwise, it will be performed only on the listed components.
+
+        See Also
+        --------
+        enable_free_onset_energy, disable_free_onset_energy
+
+        """
+        if edges_list is None:
+            edges_list = self._active_edges
+        else:
+            edges_list = [self._get_component(x) for x in edges_list]
+        for edge in edges_list:
+            edge.onset_energy_shift_tolerance = tolerance
+
+    def set_microscope_parameters(
+        self,
+        beam_energy=None,
+        convergence_angle=None,
+        collection_angle=None,
+        edges_list=None,
+    ):
+        """Set the microscope parameters of the edges listed in edges_list.
+
+        Contrary to the microscope parameters in the metadata of the signal,
+        the convergence and collection angles can vary across the navigation
+        space, e.g. in a tilt series or when the collection angle drifts
+        during the acquisition. The cross section of each edge is then only
+        integrated once for each distinct effective angle.
+
+        Parameters
+        ----------
+        beam_energy : float or None
+            The energy of the electron beam in keV. If None, the value in
+            the metadata of the signal is used.
+        convergence_angle : float, numpy.ndarray, BaseSignal or None
+            The convergence semi-angle in mrad. Arrays must have the
+            navigation shape of the model in array order and signals must
+            have the same navigation shape as the model and no signal
+            dimension. If None, the value in the metadata of the signal is
+            used.
+        collection_angle : float, numpy.ndarray, BaseSignal or None
+            The collection semi-angle in mrad, as ``convergence_angle``.
+        edges_list : None or list of EELSCLEdge or list of edge names
+            If None, the operation is performed on all the edges in the model.
+            Otherwise, it will be performed only on the listed components.
+
+        Raises
+        ------
+        ValueError
+            If the beam energy is not a scalar or if the shape of the angles
+            does not match the navigation shape of the model.
+
+        Notes
+        -----
+        The microscope parameters of the edges that are added to the model
+        afterwards are read from the metadata of the signal.
+
+        Examples
+        --------
+        >>> collection_angle = np.linspace(20, 22, 10)
+        >>> m.set_microscope_parameters(collection_angle=collection_angle)  # doctest: +SKIP
+
+        """
+        tem = self.signal.metadata.Acquisition_instrument.TEM
+        if beam_energy is None:
+            beam_energy = tem.beam_energy
+        if convergence_angle is None:
+            convergence_angle = tem.convergence_angle
+        if collection_angle is None:
+            collection_angle = tem.Detector.EELS.collection_angle
+        if np.ndim(beam_energy):
+            raise ValueError("The beam energy must be a scalar.")
+        angles = []
+        for angle in (convergence_angle, collection_angle):
+            if isinstance(angle, BaseSignal):
+                if angle.axes_manager.signal_dimension != 0:
+                    raise ValueError(
+                        "The signals of the convergence and collection "
+                        "angles must have no signal dimension."
+                    )
+                angle = angle.data
+            angle = np.asarray(angle, dtype=float)
+            angles.append(angle if angle.ndim else float(angle))
+        convergence_angle, collection_angle = angles
+        if edges_list is None:
+            edges_list = self.edges
+        else:
+            edges_list = [self._get_component(x) for x in edges_list]
+        for edge in edges_list:
+            edge.set_microscope_parameters(
+                E0=beam_energy,
+                alpha=convergence_angle,
+                beta=collection_angle,
+                energy_scale=self.axis.scale,
+            )
+
     def fix_edges(self, edges_list=None):
         """Fixes all the parameters of the edges given in edges_list.
         If edges_list is None (default) all the edges will be fixed.
@@ -18,9 +18,12 @@
 
 import numbers
 import logging
+from contextlib import nullcontext
 
 import numpy as np
+import dask
 import dask.array as da
+from dask.diagnostics import ProgressBar
 import traits.api as t
 from scipy import constants
 from prettytable import PrettyTable
@@ -48,6 +51,7 @@ from hyperspy.docstrings.signal import (
 
 from exspy._docstrings.model import EELSMODEL_PARAMETERS
 from exspy._misc.elements import elements as elements_db
+from exspy._misc.eels.deconvolution import get_chunk_rows, richardson_lucy
 from exspy._misc.eels.tools import get_edges_near_energy
 from exspy._misc.eels.electron_inelastic_mean_free_path import (
     iMFP_Iakoubovskii,
@@ -1115,10 +1119,19 @@ class EELSSpectrum(Signal1D):
         %s
         %s
 
+        Returns
+        -------
+        EELSSpectrum
+            The deconvolved spectrum, which is lazy if the spectrum is lazy
+            and single precision if the spectrum and the kernel are.
+
         Raises
         ------
         NotImplementedError
             If the signal axis is a non-uniform axis.
+        ValueError
+            If the shape of the psf does not match the shape of the
+            spectrum.
 
         Notes
         -----
@@ -1127,6 +1140,9 @@ class EELSSpectrum(Signal1D):
         EELS Spectra: An Alternative to the Monochromator Solution.”
         Ultramicroscopy 96, no. 3–4 (September 2003): 385–400.
 
+        The convolutions are calculated with FFTs for chunks of spectra at
+        once.
+
         """
         if not self.axes_manager.signal_axes[0].is_uniform:
             raise NotImplementedError(
@@ -1135,31 +1151,49 @@ class EELSSpectrum(Signal1D):
         if show_progressbar is None:
             show_progressbar = hs.preferences.General.show_progressbar
         self._check_signal_dimension_equals_one()
-        psf_size = psf.axes_manager.signal_axes[0].size
-        maxval = self.axes_manager.navigation_size
-        show_progressbar = show_progressbar and (maxval > 0)
-
-        def deconv_function(signal, kernel=None, iterations=15, psf_size=None):
-            imax = kernel.argmax()
-            result = np.array(signal).copy()
-            mimax = psf_size - 1 - imax
-            for _ in range(iterations):
-                first = np.convolve(kernel, result)[imax : imax + psf_size]
-                result *= np.convolve(kernel[::-1], signal / first)[
-                    mimax : mimax + psf_size
-                ]
-            return result
+        axis = self.axes_manager.signal_axes[0]
+        psf_axis = psf.axes_manager.signal_axes[0]
+        if psf_axis.size != axis.size:
+            raise ValueError(
+                f"The size of the signal axis of the psf ({psf_axis.size}) does "
+                f"not match the size of the signal axis ({axis.size})."
+            )
+        if psf.axes_manager.navigation_dimension and (
+            psf.axes_manager.navigation_shape != self.axes_manager.navigation_shape
+        ):
+            raise ValueError(
+                "The navigation shape of the psf "
+                f"{psf.axes_manager.navigation_shape} does not match the "
+                f"navigation shape {self.axes_manager.navigation_shape}."
+            )
 
-        ds = self.map(
-            deconv_function,
-            kernel=psf,
+        # The spectra are deconvolved by chunks of pixels, with the signal
+        # axis last and in a single chunk
+        data = da.moveaxis(da.asarray(self.data), axis.index_in_array, -1)
+        kernel = np.moveaxis(psf.data, psf_axis.index_in_array, -1)
+        if self._lazy:
+            data = data.rechunk({-1: -1})
+        else:
+            rows = get_chunk_rows(axis.size, data.dtype.itemsize)
+            data = data.reshape(-1, axis.size).rechunk((rows, -1))
+        if psf.axes_manager.navigation_dimension:
+            kernel = da.asarray(kernel).reshape(data.shape).rechunk(data.chunks)
+        else:
+            kernel = np.asarray(kernel)
+        dtype = np.result_type(data.dtype, kernel.dtype, np.float32)
+        result = da.map_blocks(
+            richardson_lucy,
+            data,
+            kernel,
             iterations=iterations,
-            psf_size=psf_size,
-            show_progressbar=show_progressbar,
-            num_workers=num_workers,
-            ragged=False,
-            inplace=False,
+            dtype=dtype,
         )
+        if not self._lazy:
+            progressbar = ProgressBar() if show_progressbar else nullcontext()
+            with progressbar:
+                (result,) = dask.compute(result, num_workers=num_workers)
+        result = result.reshape(self.axes_manager._navigation_shape_in_array + (-1,))
+        ds = self._deepcopy_with_new_data(np.moveaxis(result, -1, axis.index_in_array))
 
         ds.metadata.General.title += (
             " after Richardson-Lucy deconvolution %i iterations" % iterations
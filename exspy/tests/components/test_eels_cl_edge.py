@@ -17,9 +17,15 @@
 # along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
 
 from pathlib import Path
+from unittest import mock
 
 import hyperspy.api as hs
+
 import numpy as np
+import pytest
+from scipy.interpolate import splev
+
+from exspy.components import EELSCLEdge
 
 
 TEST_DATA_DIR = Path(__file__).parent
@@ -75,3 +81,297 @@ def test_restore_EELS_model_dirac(tmp_path):
     s2 = hs.load(fname)
     m3 = s2.models.restore(model_name)
     np.testing.assert_allclose(m.as_signal(), m3.as_signal(), rtol=5e-7)
+
+
+def test_gos_tables_shared_between_models(gosh_file):
+    s = hs.load(TEST_DATA_DIR / "coreloss_spectrum.msa", signal_type="EELS")
+    s.add_elements(("Mn", "O"))
+    s.set_microscope_parameters(
+        beam_energy=300, convergence_angle=24.6, collection_angle=13.6
+    )
+    m = s.create_model(gos_file_path=gosh_file)
+    # to use `as_signal`
+    m.assign_current_values_to_all()
+    m2 = s.create_model(gos_file_path=gosh_file)
+    assert m["Mn_L3"].GOS.gos_array is m2["Mn_L3"].GOS.gos_array
+    assert m["Mn_L3"].GOS.gos_array is m["Mn_L2"].GOS.gos_array
+    # The component only references the table
+    init_dict = m["Mn_L3"]._whitelist["element_subshell"][1]
+    assert init_dict["gos_array"] is m["Mn_L3"].GOS.gos_array
+
+    m.store("a")
+    m3 = s.models.restore("a")
+    assert m3["Mn_L3"].GOS.gos_array is not m["Mn_L3"].GOS.gos_array
+    np.testing.assert_array_equal(m3["Mn_L3"].GOS.gos_array, m["Mn_L3"].GOS.gos_array)
+    m4 = s.models.restore("a")
+    assert m4["Mn_L3"].GOS.gos_array is m3["Mn_L3"].GOS.gos_array
+    np.testing.assert_allclose(m.as_signal(), m4.as_signal())
+
+
+@pytest.mark.parametrize("tolerance", [None, 1e-3])
+def test_edit_gos_table(gosh_file, tolerance):
+    edge = EELSCLEdge("Ti_L3", gos_file_path=gosh_file)
+    edge.onset_energy_shift_tolerance = tolerance
+    edge.E0 = 100
+    edge.effective_angle.value = 10
+    edge.intensity.value = 1
+    E = np.linspace(460, 600, 50)
+    edge._integrate_GOS()
+    values = edge.function(E)
+    # The cross section kept in memory is not used once the table is edited
+    edge.GOS.copy_table()
+    edge.GOS.gos_array[:] *= 2
+    edge._integrate_GOS()
+    np.testing.assert_allclose(edge.function(E), 2 * values)
+    edge.GOS.gos_array[:] *= 2
+    edge._integrate_GOS()
+    np.testing.assert_allclose(edge.function(E), 4 * values)
+    if tolerance is not None:
+        # The grid of energy shifts of the edited table is used
+        edge.onset_energy.value += 0.3
+        edge.GOS.gos_array[:] /= 4
+        edge._integrate_GOS()
+        edge_ref = EELSCLEdge("Ti_L3", gos_file_path=gosh_file)
+        edge_ref.onset_energy_shift_tolerance = tolerance
+        edge_ref.E0 = 100
+        edge_ref.effective_angle.value = 10
+        edge_ref.intensity.value = 1
+        edge_ref.onset_energy.value = edge.onset_energy.value
+        edge_ref._integrate_GOS()
+        np.testing.assert_allclose(edge.function(E), edge_ref.function(E))
+
+
+@pytest.mark.parametrize("tolerance", [1e-3, 1e-4])
+def test_onset_energy_shift_tolerance(tolerance):
+    edge = EELSCLEdge("C_K", GOS="hydrogenic")
+    edge.set_microscope_parameters(E0=200, alpha=10, beta=20, energy_scale=0.5)
+    edge_fast = EELSCLEdge("C_K", GOS="hydrogenic")
+    edge_fast.set_microscope_parameters(E0=200, alpha=10, beta=20, energy_scale=0.5)
+    edge_fast.onset_energy_shift_tolerance = tolerance
+    E = np.linspace(270, 800, 500)
+    np.testing.assert_allclose(edge_fast.function(E), edge.function(E))
+
+    calls = []
+    integrateq = edge_fast.GOS.integrateq
+
+    def counting_integrateq(*args):
+        calls.append(args)
+        return integrateq(*args)
+
+    edge_fast.GOS.integrateq = counting_integrateq
+    for shift in np.linspace(-3, 3, 50):
+        edge.onset_energy.value = edge.GOS.onset_energy + shift
+        edge_fast.onset_energy.value = edge_fast.GOS.onset_energy + shift
+        expected = edge.function(E)
+        np.testing.assert_allclose(
+            edge_fast.function(E), expected, atol=tolerance * expected.max()
+        )
+    # Only the nodes of the grid are integrated
+    assert len(calls) < 10
+
+    # Changing the microscope parameters resets the grid
+    edge_fast.set_microscope_parameters(E0=300, alpha=10, beta=20, energy_scale=0.5)
+    edge.set_microscope_parameters(E0=300, alpha=10, beta=20, energy_scale=0.5)
+    expected = edge.function(E)
+    np.testing.assert_allclose(
+        edge_fast.function(E), expected, atol=tolerance * expected.max()
+    )
+
+    edge_fast.onset_energy_shift_tolerance = None
+    np.testing.assert_allclose(edge_fast.function(E), expected)
+
+
+def test_onset_energy_shift_tolerance_error():
+    edge = EELSCLEdge("C_K", GOS="hydrogenic")
+    with pytest.raises(ValueError):
+        edge.onset_energy_shift_tolerance = 0
+
+
+@pytest.mark.parametrize("fine_structure", [False, True])
+def test_function_nd(fine_structure):
+    s = hs.signals.Signal1D(np.ones((3, 4, 600)))
+    s.set_signal_type("EELS")
+    s.axes_manager.signal_axes[0].offset = 250
+    s.axes_manager.signal_axes[0].scale = 0.5
+    s.set_microscope_parameters(
+        beam_energy=200, convergence_angle=10, collection_angle=20
+    )
+    s.add_elements(("C",))
+    m = s.create_model(GOS="hydrogenic", auto_background=False)
+    edge = m.components.C_K
+    edge.fine_structure_active = fine_structure
+    rng = np.random.default_rng(0)
+    edge.intensity.map["values"][:] = rng.random((3, 4))
+    # Some pixels share the same onset energy
+    shifts = rng.integers(-2, 3, size=(3, 4)) * 0.7
+    edge.onset_energy.map["values"][:] = edge.onset_energy.value + shifts
+    edge.effective_angle.map["values"][:] = edge.effective_angle.value
+    coeff_map = edge.fine_structure_coeff.map["values"]
+    coeff_map[:] = rng.random(coeff_map.shape)
+    for parameter in edge.parameters:
+        parameter.map["is_set"][:] = True
+    shift = edge.GOS.energy_shift
+
+    E = s.axes_manager.signal_axes[0].axis
+    data = edge.function_nd(E)
+    assert data.shape == (3, 4, 600)
+    # The cross section of the current position is not modified
+    assert edge.GOS.energy_shift == shift
+
+    for indices in np.ndindex(3, 4):
+        m.axes_manager.indices = indices[::-1]
+        edge.fetch_stored_values()
+        np.testing.assert_allclose(data[indices], edge.function(E), rtol=1e-12)
+
+
+@pytest.mark.parametrize("element_subshell", ["Ti_L3", "C_K"])
+def test_grad_onset_energy_tabulated(gosh_file, element_subshell):
+    edge = EELSCLEdge(element_subshell, gos_file_path=gosh_file)
+    edge.set_microscope_parameters(E0=200, alpha=10, beta=20, energy_scale=0.5)
+    edge.onset_energy.free = True
+    edge.onset_energy.value += 0.3
+    onset_energy = edge.onset_energy.value
+    E = np.arange(onset_energy - 20, onset_energy + 2000, 0.5) + 0.123
+    # The derivative of the cross section is calculated without integrating
+    # the GOS again
+    with mock.patch.object(
+        edge.GOS, "integrateq", side_effect=AssertionError
+    ) as integrateq:
+        grad = edge.grad_onset_energy(E)
+    integrateq.assert_not_called()
+
+    step = 1e-3
+    edge.onset_energy.value = onset_energy + step
+    f1 = edge.function(E)
+    edge.onset_energy.value = onset_energy - step
+    f2 = edge.function(E)
+    expected = (f1 - f2) / (2 * step)
+    np.testing.assert_allclose(grad, expected, atol=1e-4 * np.abs(expected).max())
+
+
+@pytest.mark.parametrize("fine_structure", [False, True])
+@pytest.mark.parametrize("tolerance", [None, 1e-4])
+@pytest.mark.parametrize("element_subshell", ["C_K", "Ti_L3"])
+def test_function_and_gradients(element_subshell, tolerance, fine_structure):
+    edge = EELSCLEdge(element_subshell, GOS="hydrogenic")
+    edge.set_microscope_parameters(E0=200, alpha=10, beta=20, energy_scale=0.5)
+    edge.onset_energy_shift_tolerance = tolerance
+    edge.fine_structure_active = fine_structure
+    rng = np.random.default_rng(0)
+    coeff = rng.random(edge.fine_structure_coeff._number_of_elements)
+    edge.fine_structure_coeff.value = tuple(coeff)
+    edge.intensity.value = 2.0
+    edge.onset_energy.value += 0.3
+    onset_energy = edge.onset_energy.value
+    # The energies go beyond the tabulated cross section
+    E = np.arange(onset_energy - 20, onset_energy + 2000, 0.5) + 0.123
+
+    values, gradients = edge.function_and_gradients(E)
+    np.testing.assert_allclose(values, edge.function(E), rtol=1e-12)
+    np.testing.assert_allclose(gradients["intensity"], values / 2.0, rtol=1e-12)
+    np.testing.assert_allclose(edge.grad_onset_energy(E), gradients["onset_energy"])
+
+    step = 1e-4
+    edge.onset_energy.value = onset_energy + step
+    f1 = edge.function(E)
+    edge.onset_energy.value = onset_energy - step
+    f2 = edge.function(E)
+    edge.onset_energy.value = onset_energy
+    expected = (f1 - f2) / (2 * step)
+    np.testing.assert_allclose(
+        gradients["onset_energy"], expected, atol=1e-4 * np.abs(expected).max()
+    )
+
+    grad = gradients["fine_structure_coeff"]
+    assert grad.shape == (coeff.size, E.size)
+    if not fine_structure:
+        assert not grad.any()
+    else:
+        for i in range(coeff.size):
+            c = coeff.copy()
+            c[i] += 1
+            edge.fine_structure_coeff.value = tuple(c)
+            np.testing.assert_allclose(
+                grad[i], edge.function(E) - values, atol=1e-12 * values.max()
+            )
+        edge.fine_structure_coeff.value = tuple(coeff)
+
+    # The gradient of the intensity does not depend on its value
+    edge.intensity.value = 0
+    np.testing.assert_allclose(edge.grad_intensity(E), gradients["intensity"])
+
+
+def test_fine_structure_basis_cache():
+    edge = EELSCLEdge("C_K", GOS="hydrogenic")
+    edge.set_microscope_parameters(E0=200, alpha=10, beta=20, energy_scale=0.5)
+    edge.fine_structure_active = True
+    rng = np.random.default_rng(0)
+    coeff = rng.random(edge.fine_structure_coeff._number_of_elements)
+    edge.fine_structure_coeff.value = tuple(coeff)
+    E = np.arange(270, 800, 0.5)
+
+    def expected_fine_structure():
+        onset_energy = edge.onset_energy.value
+        knots = edge._get_knots(onset_energy)
+        bifs = (E >= onset_energy) & (E < onset_energy + edge.fine_structure_width)
+        tck = (knots, edge.fine_structure_coeff.value + (0,) * 4, 3)
+        return bifs, splev(E[bifs], tck) * edge.intensity.value
+
+    bifs, expected = expected_fine_structure()
+    np.testing.assert_allclose(edge.function(E)[bifs], expected)
+    basis = edge._get_fine_structure_basis(E, bifs, edge.onset_energy.value)
+    # The basis is reused when only the coefficients change
+    edge.fine_structure_coeff.value = tuple(2 * coeff)
+    _, expected = expected_fine_structure()
+    np.testing.assert_allclose(edge.function(E)[bifs], expected)
+    assert edge._get_fine_structure_basis(E, bifs, edge.onset_energy.value) is basis
+
+    # and it is recalculated when the knots change
+    edge.fine_structure_width = 40
+    edge.fine_structure_coeff.value = tuple(
+        rng.random(edge.fine_structure_coeff._number_of_elements)
+    )
+    bifs, expected = expected_fine_structure()
+    np.testing.assert_allclose(edge.function(E)[bifs], expected)
+    edge.onset_energy.value += 1.5
+    bifs, expected = expected_fine_structure()
+    np.testing.assert_allclose(edge.function(E)[bifs], expected)
+
+
+def test_navigation_dependent_effective_angle():
+    edge = EELSCLEdge("C_K", GOS="hydrogenic")
+    with pytest.raises(ValueError, match="model"):
+        edge.set_microscope_parameters(
+            E0=200, alpha=10, beta=np.array([20, 30]), energy_scale=0.5
+        )
+
+    s = hs.signals.Signal1D(np.ones((2, 300)))
+    s.set_signal_type("EELS")
+    s.axes_manager.signal_axes[0].offset = 250
+    s.axes_manager.signal_axes[0].scale = 0.5
+    s.set_microscope_parameters(
+        beam_energy=200, convergence_angle=10, collection_angle=20
+    )
+    s.add_elements(("C",))
+    m = s.create_model(GOS="hydrogenic", auto_background=False)
+    edge = m.components.C_K
+    edge.onset_energy_shift_tolerance = 1e-3
+    edge.set_microscope_parameters(
+        E0=200, alpha=10, beta=np.array([20, 30]), energy_scale=0.5
+    )
+    calls = []
+    integrateq = edge.GOS.integrateq
+
+    def counting_integrateq(*args):
+        calls.append(args)
+        return integrateq(*args)
+
+    for index in (0, 1):
+        m.axes_manager.indices = (index,)
+        edge.onset_energy.value = edge.GOS.onset_energy + 0.3
+    edge.GOS.integrateq = counting_integrateq
+    # The grids of energy shifts of both effective angles are kept
+    for index in (0, 1, 0, 1):
+        m.axes_manager.indices = (index,)
+        edge.onset_energy.value = edge.GOS.onset_energy + 0.1 * index
+    assert not calls
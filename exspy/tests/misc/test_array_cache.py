@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Copyright 2007-2025 The eXSpy developers
+#
+# This file is part of eXSpy.
+#
+# eXSpy is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# eXSpy is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
+
+import os
+
+import numpy as np
+import pytest
+
+from exspy._defaults_parser import preferences
+from exspy._misc.eels import array_cache
+from exspy._misc.eels.array_cache import ArrayCache
+from exspy.components import EELSCLEdge
+
+
+@pytest.fixture
+def enable_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(preferences.EELS, "eels_cross_section_cache", True)
+    monkeypatch.setattr(array_cache, "config_path", tmp_path)
+    return tmp_path / "cross_sections"
+
+
+def test_cache_get_set(tmp_path):
+    cache = ArrayCache(tmp_path, max_size=1e6)
+    key = ("hash", "Ti", "L3", 200.0, 10.0, 0.0)
+    assert cache.get(key) is None
+    cache.set(key, qint=np.arange(5.0), k=3)
+    arrays = cache.get(key)
+    np.testing.assert_array_equal(arrays["qint"], np.arange(5.0))
+    assert arrays["k"] == 3
+    assert cache.get(key[:-1] + (0.1,)) is None
+    cache.clear()
+    assert cache.get(key) is None
+
+
+def test_cache_eviction(tmp_path):
+    cache = ArrayCache(tmp_path, max_size=np.inf)
+    keys = [("hash", i) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.set(key, qint=np.zeros(100))
+        # Make sure that the access times are different
+        filename = cache._get_filename(key)
+        os.utime(filename, (i, i))
+    # Room for three entries only
+    cache.max_size = 3.5 * cache._get_filename(keys[0]).stat().st_size
+    # Access the first entry so that the second one is the least recently used
+    assert cache.get(keys[0]) is not None
+    cache.set(("hash", 3), qint=np.zeros(100))
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(("hash", 3)) is not None
+
+
+def test_cache_invalid_file(tmp_path):
+    cache = ArrayCache(tmp_path, max_size=1e6)
+    key = ("hash",)
+    cache._get_filename(key).write_text("not a npz file")
+    assert cache.get(key) is None
+    assert not cache._get_filename(key).exists()
+
+
+@pytest.mark.parametrize("path", ["file", "file/cache"])
+def test_cache_write_error(tmp_path, path, caplog):
+    # The cache directory can't be created where a file exists
+    (tmp_path / "file").touch()
+    cache = ArrayCache(tmp_path / path, max_size=1e6)
+    with caplog.at_level("WARNING"):
+        cache.set(("hash",), qint=np.zeros(5))
+    assert "could not be cached" in caplog.text
+    assert cache.get(("hash",)) is None
+    assert list(tmp_path.iterdir()) == [tmp_path / "file"]
+
+
+def test_edge_cross_section_cache(enable_cache):
+    edge = EELSCLEdge("C_K", GOS="hydrogenic")
+    edge.set_microscope_parameters(E0=200, alpha=10, beta=20, energy_scale=0.5)
+    assert len(list(enable_cache.glob("*.npz"))) == 1
+
+    edge2 = EELSCLEdge("C_K", GOS="hydrogenic")
+    edge2.GOS.integrateq = None  # it must not be called
+    edge2.set_microscope_parameters(E0=200, alpha=10, beta=20, energy_scale=0.5)
+    E = np.linspace(250, 500, 100)
+    np.testing.assert_allclose(edge2.function(E), edge.function(E))
+    np.testing.assert_allclose(edge2.GOS.qint, edge.GOS.qint)
+    assert edge2._power_law_r == edge._power_law_r
+
+    edge3 = EELSCLEdge("C_K", GOS="hydrogenic")
+    edge3.set_microscope_parameters(E0=300, alpha=10, beta=20, energy_scale=0.5)
+    assert len(list(enable_cache.glob("*.npz"))) == 2
+
+
+def test_edge_cross_section_cache_free_onset(enable_cache):
+    edge = EELSCLEdge("C_K", GOS="hydrogenic")
+    edge.onset_energy.free = True
+    edge.set_microscope_parameters(E0=200, alpha=10, beta=20, energy_scale=0.5)
+    edge.onset_energy.value += 1
+    assert not enable_cache.exists()
+
+
+def test_edge_cross_section_kept_when_fitting_onset():
+    # Only the cross sections in memory are used
+    assert not preferences.EELS.eels_cross_section_cache
+    edge = EELSCLEdge("C_K", GOS="hydrogenic")
+    edge.set_microscope_parameters(E0=200, alpha=10, beta=20, energy_scale=0.5)
+    onset_energy = edge.onset_energy.value
+    edge.onset_energy.free = True
+    edge.onset_energy.value += 1
+    edge.onset_energy.value = onset_energy
+    edge.onset_energy.value += 1
+    # The cross section of the initial onset energy is still in memory
+    edge.GOS.integrateq = None  # it must not be called
+    edge.onset_energy.free = False
+    edge.onset_energy.value = onset_energy
+    assert edge.GOS.energy_shift == 0
+
+
+def test_edge_cross_section_cache_disabled(tmp_path, monkeypatch):
+    monkeypatch.setattr(array_cache, "config_path", tmp_path)
+    assert not preferences.EELS.eels_cross_section_cache
+    edge = EELSCLEdge("C_K", GOS="hydrogenic")
+    edge.set_microscope_parameters(E0=200, alpha=10, beta=20, energy_scale=0.5)
+    assert not (tmp_path / "cross_sections").exists()
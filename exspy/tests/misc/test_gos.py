@@ -16,17 +16,26 @@
 # You should have received a copy of the GNU General Public License
 # along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
 
+import gc
+import os
 from pathlib import Path
 
 import h5py
+import numpy as np
 import pooch
 import pytest
+from scipy import integrate
 
 from exspy._defaults_parser import preferences
-from exspy._misc.eels.gosh_gos import GoshGOS
+from exspy._misc.eels import array_cache, base_gos, hartree_slater_gos
+from exspy._misc.eels.base_gos import R, TabulatedGOS, _simpson_rows, a0
+from exspy._misc.eels import gosh_gos
+from exspy._misc.eels.gos_store import HARTREE_SLATER_STORE_NAME, get_gos_store
+from exspy._misc.eels.gosh_gos import GoshGOS, get_gosh_database
 from exspy._misc.eels.hartree_slater_gos import HartreeSlaterGOS
 from exspy._misc.eels import HydrogenicGOS
 from exspy._misc.elements import elements
+from exspy.utils.eels import convert_gos_to_store
 
 
 GOSH10 = pooch.retrieve(
@@ -93,3 +102,372 @@ def test_dirac_gosh_not_in_file():
     # Dirac GOS which doesn't have the Uue element
     with pytest.raises(ValueError):
         _ = GoshGOS("Uue_L3", source="dirac")
+
+
+def _synthetic_tabulated_gos(element_subshell="Ti_L3"):
+    element, subshell = element_subshell.split("_")
+    rel_energy_axis = np.linspace(0, 300, 120) ** 1.3 / 10
+    qaxis = 5e10 * (np.exp(np.arange(100) * 0.06) - 1) / (np.exp(99 * 0.06) - 1)
+    E = rel_energy_axis[:, np.newaxis] + 460
+    gos_array = (
+        np.exp(-((qaxis / 3e10) ** 2)) * (1 + 0.2 * np.sin(E / 10)) / (1 + E / 500)
+    )
+    dictionary = {
+        "element": element,
+        "subshell": subshell,
+        "gos_array": gos_array,
+        "rel_energy_axis": rel_energy_axis,
+        "qaxis": qaxis,
+        "subshell_factor": 1.0,
+    }
+    dictionary["_whitelist"] = {key: "" for key in dictionary}
+    return TabulatedGOS(dictionary)
+
+
+def test_tabulated_gos_shared_table():
+    gos = _synthetic_tabulated_gos()
+    gos2 = TabulatedGOS(gos.as_dictionary(fullcopy=True))
+    assert gos2._table is gos._table
+    assert not gos2.gos_array.flags.writeable
+    with pytest.raises(ValueError):
+        gos2.gos_array[0] = 0
+
+    # Copy on write
+    source_hash = gos._source_hash()
+    gos2.gos_array = gos2.gos_array * 2
+    assert gos2._table is None
+    assert gos2.gos_array.flags.writeable
+    np.testing.assert_array_equal(gos2.qaxis, gos.qaxis)
+    np.testing.assert_array_equal(gos.gos_array * 2, gos2.gos_array)
+    assert gos2._source_hash() != source_hash
+    gos2.gos_array[:] = gos.gos_array
+    assert gos2._source_hash() == source_hash
+
+    # The table is removed from the registry when it is not used anymore
+    key = ("content", gos._table.hash)
+    assert key in base_gos._GOS_TABLES
+    del gos
+    assert key not in base_gos._GOS_TABLES
+
+
+@pytest.mark.parametrize("npoints", [2, 3, 4, 7, 10])
+def test_simpson_rows(npoints):
+    rng = np.random.default_rng(0)
+    x = np.cumsum(rng.random((5, 10)), axis=1)
+    y = rng.random((5, 10))
+    n = np.array([npoints, 2, 3, 10, 9])
+    expected = [integrate.simpson(y[i, : n[i]], x=x[i, : n[i]]) for i in range(5)]
+    np.testing.assert_allclose(_simpson_rows(y, x, n), expected)
+
+
+@pytest.mark.parametrize("angle", [1e-3, 20e-3, 0.2])
+@pytest.mark.parametrize("onset_energy", [456, 470])
+def test_tabulated_gos_integrateq(angle, onset_energy):
+    gos = _synthetic_tabulated_gos()
+    E0 = 200
+    gos.integrateq(onset_energy, angle, E0)
+    E = gos.energy_axis + gos.energy_shift
+    qa0sqmin, qa0sqmax = gos._get_qa0sq_limits(E, angle, E0)
+    expected = np.zeros_like(E)
+    for i in range(E.size):
+        qaxis, qgos = gos.get_qaxis_and_gos(
+            i, np.sqrt(qa0sqmin[i]) / a0, np.sqrt(qa0sqmax[i]) / a0
+        )
+        expected[i] = integrate.simpson(qgos, x=np.log((a0 * qaxis) ** 2))
+    gamma = 1 + E0 / 511.06
+    T = 511060 * (1 - 1 / gamma**2) / 2
+    expected *= 4.0 * np.pi * a0**2.0 * R**2 / E / T * 1e28
+    np.testing.assert_allclose(gos.qint, expected, rtol=1e-10)
+
+
+# Values of the GOS calculated one energy and one q at a time by the scalar
+# implementation of R. Egerton's SIGMAK3 and SIGMAL3 routines, with an energy
+# shift of 2 eV and qa0² = 1e-3, 1 and 1e3, below and above the threshold
+# of the hydrogenic model and, for the L edges, above the L1 onset
+HYDROGENIC_GOS_REFERENCE = {
+    "H_K": (
+        [25.598, 315.598],
+        [
+            [1.011974181633e-02, 2.926234772123e-02, 1.764881450215e-14],
+            [4.630801583214e-06, 6.698454935403e-06, 3.380568423533e-13],
+        ],
+    ),
+    "C_K": (
+        [296.0, 586.0],
+        [
+            [9.016287019934e-03, 8.203907899055e-03, 8.109006055679e-09],
+            [1.455559489508e-03, 1.568025534045e-03, 1.813291816522e-08],
+        ],
+    ),
+    "Ti_L3": (
+        [468.0, 576.0, 758.0],
+        [
+            [1.510577912167e-02, 1.274431461739e-02, 1.914344626240e-07],
+            [1.387003857848e-02, 1.321767588930e-02, 5.356061250654e-07],
+            [7.432154322414e-03, 7.581659225991e-03, 8.441578741861e-07],
+        ],
+    ),
+    "Fe_L1": (
+        [720.0, 858.0, 1010.0],
+        [
+            [7.059182961403e-03, 6.353412532228e-03, 5.565891546367e-07],
+            [8.346857198627e-03, 8.068780320687e-03, 1.343118546905e-06],
+            [6.100117410219e-03, 6.090554621319e-03, 1.876243645305e-06],
+        ],
+    ),
+}
+
+
+@pytest.mark.parametrize("element_subshell", list(HYDROGENIC_GOS_REFERENCE))
+def test_hydrogenic_gosfunc_array(element_subshell):
+    gos = HydrogenicGOS(element_subshell)
+    gos.energy_shift = 2.0
+    E, expected = HYDROGENIC_GOS_REFERENCE[element_subshell]
+    E = np.array(E)
+    qa02 = np.array([1e-3, 1.0, 1e3])
+    np.testing.assert_allclose(
+        gos.gosfunc(E[:, np.newaxis], qa02), expected, rtol=1e-10
+    )
+    # Scalars
+    np.testing.assert_allclose(gos.gosfunc(E[-1], qa02[1]), expected[-1][1], rtol=1e-10)
+
+
+@pytest.mark.parametrize("element_subshell", ["H_K", "C_K", "Ti_L3", "Mo_L2"])
+@pytest.mark.parametrize("angle", [1e-3, 20e-3, 0.2])
+@pytest.mark.parametrize("E0", [60, 300])
+def test_hydrogenic_gos_integrateq(element_subshell, angle, E0):
+    gos = HydrogenicGOS(element_subshell)
+    onset_energy = gos.onset_energy + 5
+    gos.integrateq(onset_energy, angle, E0)
+    E = gos.energy_axis + gos.energy_shift
+    qa0sqmin, qa0sqmax = gos._get_qa0sq_limits(E, angle, E0)
+    expected = [
+        integrate.quad(
+            lambda x: gos.gosfunc(Ei, np.exp(x)),
+            np.log(qmin),
+            np.log(qmax),
+            epsabs=0,
+            epsrel=1e-10,
+            limit=200,
+        )[0]
+        for Ei, qmin, qmax in zip(E, qa0sqmin, qa0sqmax)
+    ]
+    gamma = 1 + E0 / 511.06
+    T = 511060 * (1 - 1 / gamma**2) / 2
+    expected = 3.5166e8 * (R / T) * (R / E) * np.array(expected)
+    np.testing.assert_allclose(gos.qint, expected, rtol=1e-8)
+
+
+def test_gosh_database(gosh_file):
+    filename = gosh_file
+    database = get_gosh_database(filename)
+    try:
+        assert get_gosh_database(filename) is database
+        assert database.elements == {"B", "C", "N", "O", "Ti", "Mn"}
+        assert database.edges_info["L2"] == {"table": "L3", "occupancy_ratio": 0.5}
+        assert database.doi == "10.0/synthetic"
+        assert database.has_table("Ti", "L3")
+        assert not database.has_table("Fe", "L3")
+
+        gos_L3 = GoshGOS("Ti_L3", gos_file_path=filename)
+        gos_L2 = GoshGOS("Ti_L2", gos_file_path=filename)
+        assert gos_L2.subshell_factor == 0.5
+        np.testing.assert_array_equal(gos_L3.gos_array, gos_L2.gos_array)
+        assert gos_L3.gos_array.shape == (40, 60)
+        # The table is read only once and shared between the GOS
+        gos, q, free_energies = database.get_table("Ti", "L3")
+        assert database.get_table("Ti", "L3")[0] is gos
+        assert not gos.flags.writeable
+        assert gos_L3.gos_array is gos_L2.gos_array
+        with pytest.raises(ValueError):
+            gos_L3.gos_array[:] = 0
+        gos_L3.copy_table()
+        gos_L3.gos_array[:] = 0
+        assert np.all(gos_L2.gos_array == np.squeeze(gos.T))
+
+        with pytest.raises(ValueError):
+            GoshGOS("Fe_L3", gos_file_path=filename)
+    finally:
+        database.close()
+        del gosh_gos._GOSH_DATABASES[str(Path(filename).resolve())]
+
+
+def test_gosh_database_lru(gosh_file):
+    filename = gosh_file
+    database = gosh_gos.GoshDatabase(filename, max_tables=2)
+    first = database.get_table("Ti", "L3")
+    database.get_table("Ti", "K1")
+    database.get_table("Ti", "L3")
+    database.get_table("O", "K1")
+    assert list(database._tables) == [("Ti", "L3"), ("O", "K1")]
+    assert database.get_table("Ti", "L3") is first
+    # Reopen the file after a fork
+    database._pid = -1
+    np.testing.assert_array_equal(database.get_table("O", "L3")[1], first[1])
+    database.close()
+    assert not database._tables
+
+
+def test_gosh_file_retrieved_once(gosh_file, monkeypatch):
+    filename = gosh_file
+    calls = []
+
+    def retrieve(**kwargs):
+        calls.append(kwargs)
+        return filename
+
+    monkeypatch.setattr(gosh_gos.pooch, "retrieve", retrieve)
+    monkeypatch.setattr(gosh_gos, "_GOSH_FILE_PATHS", {})
+    monkeypatch.setattr(gosh_gos, "_GOSH_DATABASES", {})
+    GoshGOS("Ti_L3")
+    GoshGOS("O_K")
+    assert len(calls) == 1
+    gosh_gos._GOSH_DATABASES[str(Path(filename).resolve())].close()
+
+
+@pytest.mark.parametrize("dtype", [None, "float32"])
+def test_gos_store_gosh(gosh_file, tmp_path, dtype):
+    filename = convert_gos_to_store(gosh_file, tmp_path / "gosh.gosstore", dtype)
+    store = get_gos_store(filename)
+    assert get_gos_store(filename) is store
+    assert store.source == "gosh"
+    assert store.doi == "10.0/synthetic"
+    assert store.edges_info["L2"] == {"table": "L3", "occupancy_ratio": 0.5}
+    assert len(store.tables) == 6 * 6
+
+    gos = GoshGOS("Ti_L2", gos_file_path=gosh_file)
+    gos_store = GoshGOS("Ti_L2", gos_file_path=str(filename))
+    assert gos_store.subshell_factor == 0.5
+    assert gos_store.doi == gos.doi
+    # The arrays are views of the memory mapped file
+    assert isinstance(gos_store.gos_array.base, np.memmap)
+    assert not gos_store.gos_array.flags.writeable
+    assert gos_store.gos_array.dtype == np.dtype(dtype or float)
+    rtol = 1e-6 if dtype == "float32" else 0
+    for name in ("gos_array", "qaxis", "rel_energy_axis", "energy_axis"):
+        np.testing.assert_allclose(
+            getattr(gos_store, name), getattr(gos, name), rtol=rtol
+        )
+    np.testing.assert_allclose(
+        gos_store.integrateq(460, 0.02, 200).c,
+        gos.integrateq(460, 0.02, 200).c,
+        rtol=10 * rtol,
+    )
+    with pytest.raises(ValueError):
+        GoshGOS("Fe_L3", gos_file_path=str(filename))
+
+
+def _write_hartree_slater_file(filename, nrow=40, ncol=60):
+    rng = np.random.default_rng(0)
+    values = [0, 0, 0.01, 0.1, 0, ncol, 2.0, 0.1, nrow]
+    values += list(rng.random(nrow * ncol))
+    filename.write_text("\r\n".join(str(value) for value in values))
+
+
+def test_gos_store_hartree_slater(tmp_path, monkeypatch, caplog):
+    _write_hartree_slater_file(tmp_path / "Ti.L3")
+    _write_hartree_slater_file(tmp_path / "O.K1")
+    monkeypatch.setattr(preferences.EELS, "eels_gos_files_path", str(tmp_path))
+    monkeypatch.setattr(array_cache, "config_path", tmp_path / "config")
+    gos = HartreeSlaterGOS("Ti_L2")
+    assert gos.gos_array.shape == (40, 60)
+
+    filename = convert_gos_to_store(tmp_path)
+    assert filename == tmp_path / HARTREE_SLATER_STORE_NAME
+    assert sorted(get_gos_store(filename).tables) == ["O/K1", "Ti/L3"]
+    # The store is used instead of the files
+    (tmp_path / "Ti.L3").unlink()
+    gos_store = HartreeSlaterGOS("Ti_L2")
+    assert isinstance(gos_store.gos_array.base, np.memmap)
+    assert gos_store.subshell_factor == gos.subshell_factor
+    for name in ("gos_array", "qaxis", "rel_energy_axis"):
+        np.testing.assert_array_equal(getattr(gos_store, name), getattr(gos, name))
+    with pytest.raises(FileNotFoundError):
+        HartreeSlaterGOS("Mn_L3")
+    with pytest.raises(ValueError):
+        GoshGOS("Ti_L3", gos_file_path=str(filename))
+
+    # The files missing from the store are read
+    _write_hartree_slater_file(tmp_path / "Mn.L3", nrow=20)
+    gos_file = HartreeSlaterGOS("Mn_L3")
+    assert gos_file.gos_array.shape == (20, 60)
+    assert not isinstance(gos_file.gos_array.base, np.memmap)
+    # and so are the files modified after the store was created
+    _write_hartree_slater_file(tmp_path / "O.K1", nrow=30)
+    stat = filename.stat()
+    os.utime(tmp_path / "O.K1", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    with caplog.at_level("WARNING"):
+        gos_file = HartreeSlaterGOS("O_K")
+    assert "newer than the GOS store" in caplog.text
+    assert gos_file.gos_array.shape == (30, 60)
+    (tmp_path / "empty").mkdir()
+    with pytest.raises(ValueError):
+        convert_gos_to_store(tmp_path / "empty", tmp_path / "empty.gosstore")
+
+
+def test_hartree_slater_table_cache(tmp_path, monkeypatch):
+    gos_file = tmp_path / "Ti.L3"
+    _write_hartree_slater_file(gos_file)
+    monkeypatch.setattr(preferences.EELS, "eels_gos_files_path", str(tmp_path))
+    monkeypatch.setattr(array_cache, "config_path", tmp_path / "config")
+    monkeypatch.setattr(preferences.EELS, "eels_gos_table_cache", True)
+    calls = []
+    read_gos_file = hartree_slater_gos._read_gos_file
+
+    def counting_read_gos_file(filename):
+        calls.append(filename)
+        return read_gos_file(filename)
+
+    monkeypatch.setattr(hartree_slater_gos, "_read_gos_file", counting_read_gos_file)
+    expected = read_gos_file(gos_file)
+
+    def load():
+        # The tables are shared between the GOS that exist at the same time
+        gos = HartreeSlaterGOS("Ti_L3")
+        arrays = tuple(
+            np.array(getattr(gos, name))
+            for name in ("gos_array", "qaxis", "rel_energy_axis")
+        )
+        del gos
+        gc.collect()
+        return arrays
+
+    for _ in range(2):
+        for array, expected_array in zip(load(), expected):
+            np.testing.assert_array_equal(array, expected_array)
+    # The file is parsed once and then read from the cache
+    assert len(calls) == 1
+    assert len(list((tmp_path / "config" / "gos_tables").glob("*.npz"))) == 1
+
+    # The file is parsed again when its content changes, even if its size and
+    # modification time don't
+    stat = gos_file.stat()
+    content = gos_file.read_bytes()
+    last_digit = b"1" if content[-1:] != b"1" else b"2"
+    gos_file.write_bytes(content[:-1] + last_digit)
+    os.utime(gos_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert gos_file.stat().st_size == stat.st_size
+    gos_array = load()[0]
+    assert len(calls) == 2
+    assert gos_array[-1, -1] != expected[0][-1, -1]
+    np.testing.assert_array_equal(gos_array[:-1], expected[0][:-1])
+    # and the cache is shared between copies of the same file
+    copy_path = tmp_path / "copy"
+    copy_path.mkdir()
+    (copy_path / "Ti.L3").write_bytes(gos_file.read_bytes())
+    monkeypatch.setattr(preferences.EELS, "eels_gos_files_path", str(copy_path))
+    np.testing.assert_array_equal(load()[0], gos_array)
+    assert len(calls) == 2
+
+
+def test_hartree_slater_table_cache_disabled(tmp_path, monkeypatch):
+    gos_file = tmp_path / "Ti.L3"
+    _write_hartree_slater_file(gos_file)
+    monkeypatch.setattr(preferences.EELS, "eels_gos_files_path", str(tmp_path))
+    monkeypatch.setattr(array_cache, "config_path", tmp_path / "config")
+    assert not preferences.EELS.eels_gos_table_cache
+    gos = HartreeSlaterGOS("Ti_L3")
+    np.testing.assert_array_equal(
+        gos.gos_array, hartree_slater_gos._read_gos_file(gos_file)[0]
+    )
+    assert not (tmp_path / "config").exists()
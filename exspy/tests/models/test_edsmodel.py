@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU General Public License
 # along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
 
+import pickle
+
 import numpy as np
 import pytest
 
@@ -338,3 +340,35 @@ class TestMaps:
             m_single_fit.inav[0, 0].get_lines_intensity(xray_lines),
         ):
             np.testing.assert_allclose(fitted, expected, atol=1e-7)
+
+    def test_multifit_checkpoint(self, tmp_path):
+        m_ref = self.s.create_model()
+        m_ref.multifit()
+        checkpoint = tmp_path / "checkpoint.pkl"
+        m = self.s.create_model()
+        mask = np.array([[False, False], [False, True]])
+        m.multifit(mask=mask, checkpoint=checkpoint, checkpoint_every=2)
+        m = self.s.create_model()
+        m.multifit(checkpoint=checkpoint, resume=True)
+        for fitted, expected in zip(
+            m.get_lines_intensity(), m_ref.get_lines_intensity()
+        ):
+            np.testing.assert_allclose(fitted.data, expected.data, atol=1e-7)
+        with open(checkpoint, "rb") as f:
+            assert pickle.load(f)["done"].all()
+
+    def test_multifit_keyword_only(self, tmp_path, monkeypatch):
+        # The second positional argument is `fetch_only_fixed` in
+        # BaseModel.multifit and must not be taken as `checkpoint`
+        monkeypatch.chdir(tmp_path)
+        m = self.s.create_model()
+        with pytest.raises(TypeError):
+            m.multifit(None, True)
+        assert not list(tmp_path.iterdir())
+
+    def test_multifit_profile(self):
+        m = self.s.create_model()
+        m.multifit(profile=True)
+        assert np.all(m.fit_profile["time"].data > 0)
+        assert np.all(m.fit_profile["nfev"].data >= 1)
+        assert set(m.fit_profile["component_time"]) == {c.name for c in m}
@@ -16,10 +16,12 @@
 # You should have received a copy of the GNU General Public License
 # along with eXSpy. If not, see <https://www.gnu.org/licenses/#GPL>.
 
+import concurrent.futures
 import contextlib
 import logging
 from packaging.version import Version
 import io
+import pickle
 from unittest import mock
 
 import dask
@@ -30,9 +32,23 @@ import pytest
 import hyperspy.api as hs
 from hyperspy.decorators import lazifyTestClass
 from hyperspy.exceptions import VisibleDeprecationWarning
+from hyperspy.models.model1d import Model1D
 
+import exspy._misc.checkpoint as checkpoint_module
+from exspy._misc.eels.convolution import LowLossFFT
 from exspy._misc.eels.gosh_gos import _DFT_GOSH, _DIRAC_GOSH
+import exspy._misc.eels.neighbour_fit as neighbour_fit_module
+from exspy._misc.eels.neighbour_fit import get_pixel_order
+import exspy._misc.eels.parallel_fit as parallel_fit_module
+from exspy._misc.eels.hydrogenic_gos import HydrogenicGOS
+from exspy._misc.eels.parallel_fit import (
+    SharedMemoryPickler,
+    _signal_to_dictionary,
+    get_tiles,
+)
 from exspy._misc.elements import elements_db as elements
+from exspy.components import DoublePowerLaw, EELSCLEdge
+from exspy.models.eelsmodel import EELSModel
 from exspy.signals import EELSSpectrum
 
 
@@ -423,6 +439,721 @@ class TestEELSModel:
         assert m.components.C_K.fine_structure_coeff.free
 
 
+def test_set_onset_energy_shift_tolerance():
+    s = EELSSpectrum(np.ones(200))
+    s.set_microscope_parameters(100, 10, 10)
+    s.axes_manager[-1].offset = 150
+    s.add_elements(("B", "C"))
+    m = s.create_model(GOS="hydrogenic")
+    m.set_onset_energy_shift_tolerance(1e-3, edges_list=[m.components.B_K])
+    assert m.components.B_K.onset_energy_shift_tolerance == 1e-3
+    assert m.components.C_K.onset_energy_shift_tolerance is None
+    m.set_onset_energy_shift_tolerance(1e-4)
+    assert m.components.B_K.onset_energy_shift_tolerance == 1e-4
+    assert m.components.C_K.onset_energy_shift_tolerance == 1e-4
+    m.components.B_K.onset_energy.free = True
+    m.fit()
+    m.set_onset_energy_shift_tolerance(None)
+    assert m.components.B_K.onset_energy_shift_tolerance is None
+
+
+def test_create_model_bulk_edges(monkeypatch):
+    E = np.arange(100, 1100, 1.0)
+    s = EELSSpectrum(np.tile(1e10 * E**-3, (2, 1)))
+    s.axes_manager[-1].offset = 100
+    s.set_microscope_parameters(100, 10, 10)
+    s.add_elements(("B", "C", "N", "O"))
+    calls = []
+    classify_components = EELSModel._classify_components
+
+    def counting_classify_components(self):
+        calls.append(self)
+        return classify_components(self)
+
+    monkeypatch.setattr(EELSModel, "_classify_components", counting_classify_components)
+    m = s.create_model(GOS="hydrogenic")
+    # Once for the background and once for all the edges
+    assert len(calls) == 2
+    assert [edge.name for edge in m.edges] == ["B_K", "C_K", "N_K", "O_K"]
+    # The background is estimated before the first edge
+    background = m.components.PowerLaw
+    r = background.r.map["values"].copy()
+    m.two_area_background_estimation()
+    np.testing.assert_allclose(background.r.map["values"], r)
+
+    # The cross sections are integrated when the edges are evaluated
+    for edge in m.edges:
+        assert edge._integration_pending
+        expected = EELSCLEdge(edge.name, GOS="hydrogenic")
+        expected.set_microscope_parameters(100, 10, 10, 1.0)
+        np.testing.assert_allclose(edge.function(E), expected.function(E))
+        assert not edge._integration_pending
+        assert not edge._integration_deferred
+
+    # Appending a single edge is not deferred
+    m.extend([EELSCLEdge("F_K", GOS="hydrogenic")])
+    assert len(calls) == 3
+    edge = EELSCLEdge("Ne_K", GOS="hydrogenic")
+    m.append(edge)
+    assert not edge._integration_pending
+
+
+def test_set_microscope_parameters_navigation():
+    s = EELSSpectrum(np.ones((2, 3, 300)))
+    s.set_microscope_parameters(100, 10, 10)
+    s.axes_manager[-1].offset = 250
+    s.axes_manager[-1].scale = 0.5
+    s.add_elements(("C",))
+    collection_angle = np.array([[10.0, 12.0, 10.0], [12.0, 14.0, 10.0]])
+    intensity = np.arange(1, 7).reshape(2, 3) * 1e4
+    for indices in np.ndindex(2, 3):
+        m = s.inav[indices[::-1]].create_model(GOS="hydrogenic", auto_background=False)
+        m.set_microscope_parameters(collection_angle=collection_angle[indices])
+        m.components.C_K.intensity.value = intensity[indices]
+        m.assign_current_values_to_all()
+        s.data[indices] = m.as_signal().data
+
+    m = s.create_model(GOS="hydrogenic", auto_background=False)
+    edge = m.components.C_K
+    calls = []
+    integrateq = edge.GOS.integrateq
+
+    def counting_integrateq(*args):
+        calls.append(args)
+        return integrateq(*args)
+
+    edge.GOS.integrateq = counting_integrateq
+    m.set_microscope_parameters(
+        collection_angle=hs.signals.BaseSignal(collection_angle).T
+    )
+    angles = edge.effective_angle.map["values"]
+    assert len(np.unique(angles)) == 3
+    assert angles[0, 0] == angles[0, 2] == angles[1, 2]
+    m.multifit()
+    np.testing.assert_allclose(edge.intensity.map["values"], intensity, rtol=1e-6)
+    # The GOS is only integrated once for each distinct effective angle
+    assert len(calls) == len(np.unique(angles))
+
+    m.set_microscope_parameters(collection_angle=10)
+    np.testing.assert_allclose(edge.effective_angle.map["values"], angles[0, 0])
+
+    with pytest.raises(ValueError, match="navigation shape"):
+        m.set_microscope_parameters(collection_angle=np.ones(4))
+    with pytest.raises(ValueError, match="scalar"):
+        m.set_microscope_parameters(beam_energy=np.ones((2, 3)))
+
+
+@pytest.mark.parametrize("convolved", [False, True])
+def test_fit_analytical_gradients(convolved):
+    s = EELSSpectrum(np.ones(300))
+    s.set_microscope_parameters(100, 10, 10)
+    s.axes_manager[-1].offset = 250.2
+    s.axes_manager[-1].scale = 0.5
+    s.add_elements(("C",))
+    low_loss = None
+    if convolved:
+        low_loss = EELSSpectrum(np.exp(-0.5 * (np.arange(-20, 21) / 2) ** 2))
+        low_loss.axes_manager[-1].offset = -10
+        low_loss.axes_manager[-1].scale = 0.5
+    m_ref = s.create_model(GOS="hydrogenic", auto_background=False, low_loss=low_loss)
+    edge = m_ref.components.C_K
+    edge.intensity.value = 1e5
+    edge.onset_energy.value = 285.33
+    edge.fine_structure_active = True
+    rng = np.random.default_rng(0)
+    coeff = rng.random(edge.fine_structure_coeff._number_of_elements) * 1e3
+    edge.fine_structure_coeff.value = tuple(coeff)
+    m_ref.assign_current_values_to_all()
+    s.data = m_ref.as_signal().data
+
+    m = s.create_model(GOS="hydrogenic", auto_background=False, low_loss=low_loss)
+    edge = m.components.C_K
+    edge.onset_energy.value = 285.33
+    m.enable_fine_structure()
+
+    # The gradients of all the parameters, including the fine structure
+    # coefficients of the convolved edge, match finite differences
+    edge.onset_energy.free = True
+    edge.fine_structure_coeff.value = tuple(coeff * 0.9)
+    m._set_p0()
+    p0 = np.array(m.p0, dtype=float)
+    jacobian = m._jacobian(p0, None)
+    expected = []
+    for i in range(p0.size):
+        step = 1e-6 * max(abs(p0[i]), 1)
+        p1, p2 = p0.copy(), p0.copy()
+        p1[i] += step
+        p2[i] -= step
+        expected.append(
+            (m._model_function(p1) - m._model_function(p2))[m._channel_switches]
+            / (2 * step)
+        )
+    scale = np.abs(expected).max(axis=1, keepdims=True)
+    np.testing.assert_allclose(jacobian / scale, expected / scale, atol=1e-6)
+
+    edge.onset_energy.free = False
+    edge.onset_energy.value = 285.33
+    m.fit(grad="analytical")
+    np.testing.assert_allclose(edge.intensity.value, 1e5, rtol=1e-5)
+    np.testing.assert_allclose(edge.fine_structure_coeff.value, coeff, rtol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "fine_structure, spline, width",
+    [(False, False, 0), (True, True, 0), (True, False, 20)],
+)
+def test_edge_support(fine_structure, spline, width):
+    s = EELSSpectrum(np.ones(400))
+    s.set_microscope_parameters(100, 10, 10)
+    s.axes_manager[-1].offset = 150
+    s.axes_manager[-1].scale = 0.5
+    s.add_elements(("B", "C"))
+    m = s.create_model(GOS="hydrogenic")
+    m.set_signal_range(170, 340)
+    m.remove_signal_range(200, 210)
+    C_K = m.components.C_K
+    C_K.onset_energy.free = True
+    if fine_structure:
+        C_K.fine_structure_spline_active = spline
+        C_K.fine_structure_width = 20
+        C_K.fine_structure_active = True
+        C_K.fine_structure_coeff.value = tuple(
+            np.arange(C_K.fine_structure_coeff._number_of_elements) + 1.0
+        )
+    for edge in m.edges:
+        edge.intensity.value = 1e4
+
+    # The edges are zero outside of their support, which starts at the end
+    # of the fine structure region if it is not modelled by the spline
+    start, end = C_K._get_support()
+    assert start == C_K.onset_energy.value + width
+    assert end == np.inf
+    values = C_K.function(m.axis.axis)
+    assert np.all(values[m.axis.axis < start] == 0)
+    assert np.all(values[m.axis.axis > start + 1] != 0)
+
+    # The edges are only evaluated on the fitted channels of their support
+    axis = m.axis.axis[m._channel_switches]
+    with mock.patch.object(C_K, "function", wraps=C_K.function) as function:
+        data = m._get_current_data()
+    E = function.call_args.args[0]
+    np.testing.assert_array_equal(E, axis[axis >= start])
+    expected = sum(component.function(m.axis.axis) for component in m)
+    expected = expected * m.axis.scale
+    np.testing.assert_allclose(data, expected[m._channel_switches], rtol=1e-12)
+    np.testing.assert_allclose(
+        m._get_current_data(ignore_channel_switches=True), expected, rtol=1e-12
+    )
+    # A new array is returned at every call
+    assert m._get_current_data() is not data
+
+    m._set_p0()
+    p0 = np.array(m.p0, dtype=float)
+    np.testing.assert_allclose(
+        m._jacobian(p0, None), Model1D._jacobian(m, p0, None), rtol=1e-12
+    )
+
+
+def test_low_loss_fft():
+    rng = np.random.default_rng(0)
+    s = EELSSpectrum(np.ones((3, 4, 200)))
+    s.set_microscope_parameters(100, 10, 10)
+    s.axes_manager[-1].offset = 250
+    s.add_elements(("C",))
+    low_loss = EELSSpectrum(rng.random((3, 4, 30)))
+    low_loss.axes_manager[-1].offset = -10
+    m = s.create_model(GOS="hydrogenic", low_loss=low_loss)
+    # Two chunks of two pixels at most are kept in memory
+    pixel_size = 16 * (m._low_loss_fft.nfft // 2 + 1)
+    m._low_loss_fft = LowLossFFT(
+        low_loss,
+        len(m._convolution_axis),
+        max_size=4 * pixel_size,
+        chunk_size=2 * pixel_size,
+    )
+    m.components.C_K.intensity.value = 1e6
+    for indices in [(0, 0), (3, 2), (1, 1), (0, 0), (2, 1)]:
+        m.axes_manager.indices = indices
+        sum_convolved = m.components.C_K.function(m._convolution_axis)
+        expected = np.convolve(
+            low_loss.data[indices[::-1]], sum_convolved, mode="valid"
+        ) + m.components.PowerLaw.function(m.axis.axis)
+        np.testing.assert_allclose(
+            m._get_current_data(), expected, rtol=1e-10, atol=1e-10 * expected.max()
+        )
+        assert len(m._low_loss_fft._chunks) <= 2
+
+    # The FFTs are recalculated when the data of the low-loss spectrum changes
+    m.axes_manager.indices = (1, 2)
+    expected = m._get_current_data()
+    low_loss.data[:] *= 3
+    low_loss.events.data_changed.trigger(obj=low_loss)
+    np.testing.assert_allclose(
+        m._get_current_data(),
+        3 * expected - 2 * m.components.PowerLaw.function(m.axis.axis),
+        atol=1e-10 * expected.max(),
+    )
+    low_loss.data = low_loss.data / 3
+    np.testing.assert_allclose(
+        m._get_current_data(), expected, atol=1e-10 * expected.max()
+    )
+
+    # The FFTs are recalculated when the low-loss spectrum is set again
+    old_low_loss, low_loss = low_loss, low_loss.deepcopy()
+    m.low_loss = low_loss
+    assert m._low_loss_fft.signal is low_loss
+    assert m._clear_low_loss_fft not in old_low_loss.events.data_changed.connected
+    m.low_loss = None
+    assert m._low_loss_fft is None
+    assert m._clear_low_loss_fft not in low_loss.events.data_changed.connected
+
+
+@pytest.mark.parametrize("case", ["non_uniform", "signal_range", "convolved"])
+def test_current_data_and_jacobian_match_model1d(case):
+    # EELSModel overrides the private _get_current_data and _jacobian methods
+    # of Model1D, which must give the same results
+    rng = np.random.default_rng(0)
+    if case == "non_uniform":
+        axis = {"axis": np.geomspace(150, 600, 300), "is_binned": True}
+    else:
+        axis = {"offset": 150, "scale": 1.5, "size": 300, "is_binned": True}
+    s = EELSSpectrum(rng.random(300), axes=[axis])
+    s.set_microscope_parameters(100, 10, 10)
+    low_loss = None
+    if case == "convolved":
+        low_loss = EELSSpectrum(rng.random(30))
+        low_loss.axes_manager[-1].offset = -10
+        low_loss.axes_manager[-1].scale = 1.5
+    m = s.create_model(auto_background=False, auto_add_edges=False, low_loss=low_loss)
+    m.extend(
+        [
+            hs.model.components1D.PowerLaw(A=1e5, r=3),
+            hs.model.components1D.Gaussian(A=10, centre=300, sigma=20),
+        ]
+    )
+    if case != "non_uniform":
+        m.append(EELSCLEdge("C_K", GOS="hydrogenic"))
+        m.components.C_K.intensity.value = 1e4
+        m.components.C_K.onset_energy.free = True
+        m.set_signal_range(200, 500)
+        m.remove_signal_range(300, 320)
+    if case == "convolved":
+        m.components.Gaussian.convolved = False
+
+    # The convolution by FFT has rounding errors
+    rtol = 1e-7 if case == "convolved" else 1e-10
+    np.testing.assert_allclose(
+        m._get_current_data(), Model1D._get_current_data(m), rtol=rtol
+    )
+    m._set_p0()
+    p0 = np.array(m.p0, dtype=float)
+    expected = Model1D._jacobian(m, p0, None)
+    np.testing.assert_allclose(
+        m._jacobian(p0, None), expected, rtol=rtol, atol=rtol * np.abs(expected).max()
+    )
+
+
+class TestMultifitTiles:
+    def setup_method(self, method):
+        rng = np.random.default_rng(0)
+        s = EELSSpectrum(np.ones((2, 3, 120)))
+        s.set_microscope_parameters(100, 10, 10)
+        s.axes_manager[-1].offset = 250
+        s.axes_manager[-1].scale = 2
+        s.add_elements(("C",))
+        low_loss = EELSSpectrum(rng.random((2, 3, 21)))
+        low_loss.axes_manager[-1].offset = -10
+        m = s.create_model(GOS="hydrogenic", low_loss=low_loss)
+        m.components.PowerLaw.A.value = 1e11
+        m.components.PowerLaw.r.value = 3
+        m.assign_current_values_to_all()
+        m.components.C_K.intensity.map["values"] = rng.uniform(0.8, 1.2, (2, 3))
+        m.components.PowerLaw.A.map["values"] = rng.uniform(0.5e11, 2e11, (2, 3))
+        s.data = rng.poisson(m.as_signal().data).astype(float)
+        self.s = s
+        self.low_loss = low_loss
+
+    def create_model(self, lazy=False):
+        s, low_loss = self.s, self.low_loss
+        if lazy:
+            s, low_loss = s.as_lazy(), low_loss.as_lazy()
+            s.data = s.data.rechunk((1, 2, -1))
+        m = s.create_model(GOS="hydrogenic", low_loss=low_loss)
+        m.components.PowerLaw.A.value = 1e11
+        m.components.PowerLaw.r.value = 3
+        return m
+
+    @pytest.mark.parametrize("iterpath", ["flyback", "serpentine"])
+    def test_single_tile(self, iterpath):
+        m_ref = self.create_model()
+        m_ref.multifit(iterpath=iterpath)
+        m = self.create_model()
+        m.multifit(num_workers=2, tile_shape=(3, 2), iterpath=iterpath)
+        for c, c_ref in zip(m, m_ref):
+            for p, p_ref in zip(c.parameters, c_ref.parameters):
+                np.testing.assert_array_equal(p.map["is_set"], p_ref.map["is_set"])
+                np.testing.assert_allclose(
+                    p.map["values"], p_ref.map["values"], rtol=1e-10
+                )
+        np.testing.assert_allclose(m.chisq.data, m_ref.chisq.data, rtol=1e-10)
+        np.testing.assert_array_equal(m.dof.data, m_ref.dof.data)
+        # The current values are updated
+        intensity = m.components.C_K.intensity
+        assert intensity.value == intensity.map["values"][m.axes_manager.indices[::-1]]
+
+    def test_tiles_mask(self):
+        m_ref = self.create_model()
+        m_ref.multifit()
+        m = self.create_model()
+        mask = np.zeros((2, 3), dtype=bool)
+        mask[1, 2] = True
+        maps = [p.map.copy() for c in m for p in c.parameters]
+        m.multifit(num_workers=2, tile_shape=(2, 1), mask=mask)
+        parameters = [
+            (p, p_ref)
+            for c, c_ref in zip(m, m_ref)
+            for p, p_ref in zip(c.parameters, c_ref.parameters)
+        ]
+        for (p, p_ref), map_ in zip(parameters, maps):
+            # The starting values of the tiles differ from the serial fit
+            np.testing.assert_allclose(
+                p.map["values"][~mask], p_ref.map["values"][~mask], rtol=1e-4
+            )
+            for field in ("values", "is_set"):
+                np.testing.assert_array_equal(p.map[field][1, 2], map_[field][1, 2])
+        np.testing.assert_array_equal(m.components.C_K.intensity.map["is_set"], ~mask)
+        assert np.isnan(m.chisq.data[1, 2])
+
+    def test_errors(self):
+        m = self.create_model()
+        with pytest.raises(ValueError, match="tile shape"):
+            m.multifit(num_workers=2, tile_shape=(2,))
+        with pytest.raises(ValueError, match="iterpaths"):
+            m.multifit(num_workers=2, iterpath=[(0, 0), (1, 0)])
+        with pytest.raises(ValueError, match="autosave"):
+            m.multifit(num_workers=2, autosave=True)
+        with pytest.raises(ValueError, match="lazy"):
+            m.multifit(store="maps.hdf5")
+
+    @pytest.mark.parametrize("num_workers", [None, 2])
+    def test_lazy_chunks(self, num_workers, tmp_path):
+        h5py = pytest.importorskip("h5py")
+        m_ref = self.create_model()
+        m_ref.multifit()
+        m = self.create_model(lazy=True)
+        mask = np.zeros((2, 3), dtype=bool)
+        # A whole chunk is masked
+        mask[0, 2] = True
+        store = tmp_path / "maps.hdf5"
+        m.multifit(mask=mask, num_workers=num_workers, store=store)
+        assert m.signal._lazy
+        with h5py.File(store) as f:
+            for c, c_ref in zip(m, m_ref):
+                for p, p_ref in zip(c.parameters, c_ref.parameters):
+                    np.testing.assert_allclose(
+                        p.map["values"][~mask], p_ref.map["values"][~mask], rtol=1e-4
+                    )
+                    for field in ("values", "std", "is_set"):
+                        np.testing.assert_array_equal(
+                            f[f"{c.name}/{p.name}/{field}"], p.map[field]
+                        )
+            intensity = m.components.C_K.intensity
+            np.testing.assert_array_equal(intensity.map["is_set"], ~mask)
+            np.testing.assert_array_equal(f["chisq"], m.chisq.data)
+            np.testing.assert_array_equal(f["dof"], m.dof.data)
+            assert f["chisq"].chunks == (1, 2)
+
+    def test_lazy_chunks_worker_pool(self):
+        m_ref = self.create_model()
+        m_ref.multifit()
+        m = self.create_model(lazy=True)
+        with mock.patch(
+            "concurrent.futures.ProcessPoolExecutor",
+            wraps=concurrent.futures.ProcessPoolExecutor,
+        ) as executor:
+            m.multifit(num_workers=2)
+        # The chunks are fitted by the same worker processes
+        assert executor.call_count == 1
+        for c, c_ref in zip(m, m_ref):
+            for p, p_ref in zip(c.parameters, c_ref.parameters):
+                np.testing.assert_allclose(
+                    p.map["values"], p_ref.map["values"], rtol=1e-4
+                )
+
+    def test_worker_cross_sections(self, monkeypatch):
+        m = self.create_model()
+        dictionary = m.as_dictionary()
+        dictionary["low_loss"] = _signal_to_dictionary(m.low_loss)
+        job = {
+            "signal": _signal_to_dictionary(m.signal),
+            "model": dictionary,
+            "GOS": m.GOS,
+            "gos_file_path": m.gos_file_path,
+        }
+        payload = pickle.dumps(job)
+        for name in ("_job_id", "_model", "_initial_values"):
+            monkeypatch.setattr(parallel_fit_module, name, None)
+        parallel_fit_module._fit_tile("first", payload, [(0, 0)], {})
+        with mock.patch.object(
+            HydrogenicGOS, "integrateq", side_effect=AssertionError
+        ) as integrateq:
+            # The next job, e.g. the next chunk, reuses the cross sections
+            parallel_fit_module._fit_tile("second", payload, [(1, 0)], {})
+        integrateq.assert_not_called()
+        assert parallel_fit_module._model.components.C_K.intensity.map["is_set"][0, 1]
+
+    @pytest.mark.parametrize("num_workers", [None, 2])
+    def test_warm_start_neighbours(self, num_workers):
+        m_ref = self.create_model()
+        m_ref.multifit()
+        m = self.create_model()
+        mask = np.zeros((2, 3), dtype=bool)
+        mask[0, 1] = True
+        m.multifit(mask=mask, warm_start="neighbours", num_workers=num_workers)
+        for c, c_ref in zip(m, m_ref):
+            for p, p_ref in zip(c.parameters, c_ref.parameters):
+                np.testing.assert_allclose(
+                    p.map["values"][~mask], p_ref.map["values"][~mask], rtol=1e-4
+                )
+        intensity = m.components.C_K.intensity
+        np.testing.assert_array_equal(intensity.map["is_set"], ~mask)
+        assert np.isnan(m.chisq.data[0, 1])
+
+    def test_warm_start_requeue(self):
+        m_ref = self.create_model()
+        m_ref.multifit()
+        m = self.create_model()
+        # All the pixels with fitted neighbours are fitted twice
+        m.multifit(warm_start="neighbours", max_deviation=0, max_requeue=1)
+        for c, c_ref in zip(m, m_ref):
+            for p, p_ref in zip(c.parameters, c_ref.parameters):
+                np.testing.assert_allclose(
+                    p.map["values"], p_ref.map["values"], rtol=1e-4
+                )
+        assert m.components.C_K.intensity.map["is_set"].all()
+        assert np.all(m.chisq.data <= m_ref.chisq.data * (1 + 1e-6))
+
+    def test_iterpath_hilbert(self):
+        m_ref = self.create_model()
+        m_ref.multifit(iterpath=get_pixel_order((3, 2), "hilbert"))
+        m = self.create_model()
+        m.multifit(iterpath="hilbert")
+        np.testing.assert_array_equal(m.chisq.data, m_ref.chisq.data)
+
+    def test_warm_start_errors(self):
+        m = self.create_model()
+        with pytest.raises(ValueError, match="warm_start"):
+            m.multifit(warm_start="previous")
+        with pytest.raises(ValueError, match="autosave"):
+            m.multifit(warm_start="neighbours", autosave=True)
+
+    def test_multifit_keyword_only(self):
+        m = self.create_model()
+        with pytest.raises(TypeError):
+            m.multifit(None, True)
+        with pytest.raises(TypeError):
+            m.smart_multifit(None, True)
+        with pytest.raises(TypeError):
+            m.fit_background(None, True, True)
+
+    @pytest.mark.parametrize(
+        "warm_start, checkpoint_every",
+        [(None, 2), ("neighbours", 1), ("neighbours", 4)],
+    )
+    def test_checkpoint(self, warm_start, checkpoint_every, tmp_path):
+        m_ref = self.create_model()
+        m_ref.multifit(warm_start=warm_start)
+        checkpoint = tmp_path / "checkpoint.pkl"
+        m = self.create_model()
+        m.multifit(
+            warm_start=warm_start,
+            checkpoint=checkpoint,
+            checkpoint_every=checkpoint_every,
+        )
+        for c, c_ref in zip(m, m_ref):
+            for p, p_ref in zip(c.parameters, c_ref.parameters):
+                np.testing.assert_allclose(
+                    p.map["values"], p_ref.map["values"], rtol=1e-4
+                )
+        np.testing.assert_allclose(m.chisq.data, m_ref.chisq.data, rtol=1e-4)
+        with open(checkpoint, "rb") as f:
+            saved = pickle.load(f)
+        assert saved["done"].all()
+        # The checkpoint is the dictionary of the model
+        m_loaded = self.s.create_model(GOS="hydrogenic", dictionary=saved["model"])
+        np.testing.assert_array_equal(
+            m_loaded.components.C_K.intensity.map, m.components.C_K.intensity.map
+        )
+
+    def test_checkpoint_neighbours(self, tmp_path):
+        checkpoint = tmp_path / "checkpoint.pkl"
+        m = self.create_model()
+        save_checkpoint = checkpoint_module.save_checkpoint
+        neighbour_median = neighbour_fit_module._neighbour_median
+        fitted = []
+
+        def record(parameters, done, index):
+            fitted.append(done.sum())
+            return neighbour_median(parameters, done, index)
+
+        def interrupt(model, filename, done):
+            save_checkpoint(model, filename, done)
+            if done.sum() >= 4:
+                raise KeyboardInterrupt
+
+        with mock.patch.object(neighbour_fit_module, "_neighbour_median", record):
+            with mock.patch.object(checkpoint_module, "save_checkpoint", interrupt):
+                with pytest.raises(KeyboardInterrupt):
+                    m.multifit(
+                        warm_start="neighbours",
+                        checkpoint=checkpoint,
+                        checkpoint_every=1,
+                        max_requeue=0,
+                    )
+            # The pixels fitted in the previous blocks are used as neighbours
+            assert fitted == [0, 1, 2, 3]
+            fitted.clear()
+            m = self.create_model()
+            m.multifit(
+                warm_start="neighbours",
+                checkpoint=checkpoint,
+                checkpoint_every=1,
+                max_requeue=0,
+                resume=True,
+            )
+        # and so are the pixels fitted before resuming
+        assert fitted == [4, 5]
+        with open(checkpoint, "rb") as f:
+            assert pickle.load(f)["done"].all()
+
+    def test_resume(self, tmp_path):
+        m_ref = self.create_model()
+        m_ref.multifit()
+        checkpoint = tmp_path / "checkpoint.pkl"
+        m = self.create_model()
+        save_checkpoint = checkpoint_module.save_checkpoint
+
+        def interrupt(model, filename, done):
+            save_checkpoint(model, filename, done)
+            if done.sum() >= 4:
+                raise KeyboardInterrupt
+
+        with mock.patch.object(checkpoint_module, "save_checkpoint", interrupt):
+            with pytest.raises(KeyboardInterrupt):
+                m.multifit(checkpoint=checkpoint, checkpoint_every=2)
+
+        m = self.create_model()
+        with mock.patch.object(EELSModel, "fit", autospec=True) as fit:
+            fit.side_effect = Model1D.fit
+            m.multifit(checkpoint=checkpoint, checkpoint_every=2, resume=True)
+        # Only the last two pixels are fitted
+        assert fit.call_count == 2
+        for c, c_ref in zip(m, m_ref):
+            for p, p_ref in zip(c.parameters, c_ref.parameters):
+                np.testing.assert_allclose(
+                    p.map["values"], p_ref.map["values"], rtol=1e-4
+                )
+
+        m = self.create_model()
+        m.remove("C_K")
+        with pytest.raises(ValueError, match="does not match"):
+            m.multifit(checkpoint=checkpoint, resume=True)
+        with pytest.raises(ValueError, match="checkpoint"):
+            m.multifit(checkpoint=checkpoint, num_workers=2)
+
+    def test_profile(self):
+        m = self.create_model()
+        mask = np.zeros((2, 3), dtype=bool)
+        mask[1, 0] = True
+        m.multifit(mask=mask, profile=True, grad="analytical")
+        profile = m.fit_profile
+        for name in ("time", "nfev", "njev", "status", "red_chisq"):
+            assert profile[name].data.shape == (2, 3)
+            assert np.isnan(profile[name].data[mask]).all()
+        assert np.all(profile["time"].data[~mask] > 0)
+        assert np.all(profile["nfev"].data[~mask] >= 1)
+        assert np.all(profile["njev"].data[~mask] >= 1)
+        np.testing.assert_allclose(
+            profile["red_chisq"].data[~mask], m.red_chisq.data[~mask]
+        )
+        assert set(profile["component_time"]) == {"PowerLaw", "C_K"}
+        assert np.all(profile["component_time"]["C_K"].data[~mask] > 0)
+        assert set(profile["gos_time"]) == {"C_K"}
+        # The methods of the model and of the components are restored
+        assert "fit" not in vars(m)
+        assert "_set_cross_section" not in vars(m.components.C_K)
+
+    def test_profile_smart_multifit(self):
+        m = self.create_model()
+        m.smart_multifit(profile=True)
+        assert np.all(m.fit_profile["time"].data > 0)
+        assert np.all(m.fit_profile["nfev"].data >= 2)
+        with pytest.raises(ValueError, match="profile"):
+            m.multifit(profile=True, num_workers=2)
+
+    def test_lazy_zarr_group(self):
+        zarr = pytest.importorskip("zarr")
+        m = self.create_model(lazy=True)
+        group = zarr.group()
+        m.multifit(store=group)
+        np.testing.assert_array_equal(
+            group["C_K/intensity/values"][:],
+            m.components.C_K.intensity.map["values"],
+        )
+
+
+def test_shared_memory_pickler():
+    large, small, result = np.arange(1e5), np.arange(3.0), np.zeros(2)
+    buffer = io.BytesIO()
+    pickler = SharedMemoryPickler(buffer, writeable=[result])
+    try:
+        pickler.dump({"large": large, "small": small, "result": result})
+        assert len(pickler.blocks) == 2
+        loaded = pickle.loads(buffer.getvalue())
+        np.testing.assert_array_equal(loaded["large"], large)
+        assert not loaded["large"].flags.writeable
+        assert loaded["small"].flags.writeable
+        loaded["result"][:] = 1
+        assert not result.any()
+        pickler.copy_back()
+        np.testing.assert_array_equal(result, 1)
+    finally:
+        pickler.close()
+
+
+def test_get_tiles():
+    tiles = get_tiles((3, 2), (2, 2), iterpath="serpentine")
+    assert tiles == [[(0, 0), (1, 0), (1, 1), (0, 1)], [(2, 0), (2, 1)]]
+    mask = np.zeros((2, 3), dtype=bool)
+    mask[:, 2] = True
+    assert get_tiles((3, 2), (2, 1), mask=mask) == [[(0, 0), (1, 0)], [(0, 1), (1, 1)]]
+
+
+def test_get_pixel_order():
+    order = get_pixel_order((4, 4), "hilbert")
+    assert sorted(order) == [(i, j) for i in range(4) for j in range(4)]
+    steps = np.abs(np.diff(order, axis=0)).sum(axis=1)
+    np.testing.assert_array_equal(steps, 1)
+    order = get_pixel_order((3, 5), "hilbert")
+    assert sorted(order) == [(i, j) for i in range(3) for j in range(5)]
+    assert get_pixel_order((3,), "hilbert") == [(0,), (1,), (2,)]
+    assert get_pixel_order((2, 2)) == [(0, 0), (1, 0), (0, 1), (1, 1)]
+    assert get_pixel_order((2, 2), "serpentine") == [(0, 0), (1, 0), (1, 1), (0, 1)]
+    # The same order as the iteration of the navigation space by hyperspy
+    assert get_pixel_order((2, 2, 2), "serpentine") == [
+        (0, 0, 0),
+        (1, 0, 0),
+        (1, 1, 0),
+        (0, 1, 0),
+        (0, 1, 1),
+        (1, 1, 1),
+        (1, 0, 1),
+        (0, 0, 1),
+    ]
+    with pytest.raises(ValueError, match="iterpath"):
+        get_pixel_order((2, 2), "spiral")
+
+
 @lazifyTestClass
 class TestEELSModelFitting:
     def setup_method(self, method):
@@ -462,6 +1193,54 @@ class TestEELSModelFitting:
         assert fine_structure_coeff == m.components.B_K.fine_structure_coeff.value
 
 
+class TestSmartMultifit:
+    def setup_method(self, method):
+        rng = np.random.default_rng(0)
+        s = EELSSpectrum(np.ones((2, 3, 200)))
+        s.set_microscope_parameters(100, 10, 10)
+        s.axes_manager[-1].offset = 150
+        s.add_elements(("B", "C"))
+        self.s = s
+        m = self.create_model()
+        m.assign_current_values_to_all()
+        m.components.Offset.offset.map["values"] = rng.uniform(1, 2, (2, 3))
+        for edge in (m.components.B_K, m.components.C_K):
+            edge.intensity.map["values"] = rng.uniform(5e3, 1e4, (2, 3))
+        s.data = m.as_signal().data
+        self.intensity = m.components.B_K.intensity.map["values"].copy()
+
+    def create_model(self):
+        m = self.s.create_model(GOS="hydrogenic", auto_background=False)
+        m.append(hs.model.components1D.Offset())
+        return m
+
+    def test_smart_multifit(self):
+        m_ref = self.create_model()
+        m_ref.multifit(kind="smart")
+        m = self.create_model()
+        channel_switches = m._channel_switches.copy()
+        with mock.patch.object(
+            EELSModel,
+            "set_signal_range",
+            autospec=True,
+            side_effect=EELSModel.set_signal_range,
+        ) as set_signal_range:
+            m.smart_multifit()
+        # The signal range is set once per stage
+        assert set_signal_range.call_count == 3
+        np.testing.assert_array_equal(m._channel_switches, channel_switches)
+        assert m.components.B_K.active and m.components.C_K.active
+        np.testing.assert_allclose(
+            m.components.B_K.intensity.map["values"], self.intensity, rtol=1e-3
+        )
+        for c, c_ref in zip(m, m_ref):
+            for p, p_ref in zip(c.parameters, c_ref.parameters):
+                np.testing.assert_array_equal(p.map["is_set"], p_ref.map["is_set"])
+                np.testing.assert_allclose(
+                    p.map["values"], p_ref.map["values"], rtol=1e-5
+                )
+
+
 @lazifyTestClass
 class TestFitBackground:
     def setup_method(self, method):
@@ -519,6 +1298,145 @@ class TestFitBackground2D:
         residual = self.s - self.m.as_signal()
         assert pytest.approx(residual.data) == 0
 
+    def test_closed_form(self):
+        m = self.m
+        m.fit_background(only_current=False, closed_form=True)
+        pl = m.components.PowerLaw
+        np.testing.assert_allclose(pl.r.map["values"], [3, 1.5])
+        np.testing.assert_allclose(pl.A.map["values"], 10e5)
+        assert pl.r.map["is_set"].all()
+        assert pl.r.value == 3
+
+    def test_closed_form_masks(self):
+        m = self.m
+        pl = m.components.PowerLaw
+        r = pl.r.map["values"].copy()
+        m.axes_manager.indices = (1,)
+        # The channels with non-finite data are not fitted
+        self.s.data[1, 10] = np.nan
+        m.fit_background(closed_form=True)
+        np.testing.assert_allclose(pl.r.map["values"], [r[0], 1.5])
+        m.fit_background(only_current=False, closed_form=True, mask=np.array([0, 1]))
+        np.testing.assert_allclose(pl.r.map["values"], [3, 1.5])
+
+    def test_closed_form_errors(self):
+        m = self.m
+        m.components.PowerLaw.r.free = False
+        with pytest.raises(ValueError, match="free"):
+            m.fit_background(closed_form=True)
+        m.components.PowerLaw.r.free = True
+        m.append(hs.model.components1D.Gaussian())
+        with pytest.raises(ValueError, match="Gaussian"):
+            m.fit_background(closed_form=True)
+        assert m._channel_switches.all()
+
+
+def test_closed_form_double_power_law():
+    dpl = DoublePowerLaw(A=1e6, r=3, shift=20, ratio=0.5)
+    x = np.arange(150, 400, 0.5)
+    data = np.stack([dpl.function(x), 2 * dpl.function(x)])
+    s = EELSSpectrum(data)
+    s.set_microscope_parameters(100, 10, 10)
+    s.axes_manager[-1].offset = 150
+    s.axes_manager[-1].scale = 0.5
+    s.axes_manager[-1].is_binned = True
+    s.estimate_poissonian_noise_variance()
+    m = s.create_model(auto_background=False)
+    dpl = DoublePowerLaw(shift=20, ratio=0.5)
+    m.append(dpl)
+    for parameter in (dpl.origin, dpl.shift, dpl.ratio, dpl.left_cutoff):
+        parameter.free = False
+    m.convolved = False
+    m.fit_background(only_current=False, closed_form=True)
+    # The binned data is the power law times the scale of the axis
+    np.testing.assert_allclose(dpl.A.map["values"], [2e6, 4e6], rtol=1e-4)
+    np.testing.assert_allclose(dpl.r.map["values"], 3, rtol=1e-5)
+    assert np.all(dpl.r.map["std"] > 0)
+
+
+@lazifyTestClass
+class TestQuantificationMaps:
+    def setup_method(self, method):
+        s = EELSSpectrum(np.ones((2, 3, 600)))
+        s.set_microscope_parameters(100, 10, 10)
+        s.axes_manager[-1].offset = 250
+        s.add_elements(("C", "Ti"))
+        self.s = s
+        rng = np.random.default_rng(0)
+        self.values = rng.random((2, 2, 3)) + 0.5
+        self.std = rng.random((2, 2, 3)) * 0.1
+
+    def create_model(self):
+        m = self.s.create_model(GOS="hydrogenic")
+        for edge, values, std in zip(m.edges, self.values, self.std):
+            edge.intensity.map["values"] = values
+            edge.intensity.map["std"] = std
+            edge.intensity.map["is_set"] = True
+        m.components.Ti_L3.intensity.map["is_set"][1, 2] = False
+        return m
+
+    def test_get_quantification_maps(self):
+        m = self.create_model()
+        areal_density, composition = m.get_quantification_maps()
+        assert [s.metadata.Sample.elements for s in composition] == [["C"], ["Ti"]]
+        assert composition[1].metadata.General.title == "atomic percent of Ti"
+        for s in areal_density + composition:
+            assert s._lazy == self.s._lazy
+            if s._lazy:
+                s.compute()
+                s.metadata.Signal.Noise_properties.variance.compute()
+        assert areal_density[0].data.shape == (2, 3)
+
+        C, Ti = self.values
+        C_variance, Ti_variance = self.std**2
+        total = C + Ti
+        expected = [C / total * 100, Ti / total * 100]
+        expected_variance = (Ti**2 * C_variance + C**2 * Ti_variance) / total**4 * 1e4
+        # The pixel where Ti is not fitted is NaN
+        for array in expected + [Ti, expected_variance]:
+            array[1, 2] = np.nan
+        np.testing.assert_allclose(areal_density[0].data, C)
+        np.testing.assert_allclose(areal_density[1].data, Ti)
+        np.testing.assert_allclose(
+            areal_density[0].metadata.Signal.Noise_properties.variance.data,
+            C_variance,
+        )
+        for signal, fraction in zip(composition, expected):
+            np.testing.assert_allclose(signal.data, fraction)
+            np.testing.assert_allclose(
+                signal.metadata.Signal.Noise_properties.variance.data,
+                expected_variance,
+            )
+
+    def test_twinned_edges(self):
+        m = self.create_model()
+        edge = EELSCLEdge("C_K", GOS="hydrogenic")
+        edge.name = "C_K_2"
+        m.append(edge)
+        edge.intensity.twin = m.components.C_K.intensity
+        edge.intensity.map["values"] = 10
+
+        # The twinned edge is replaced by the edge it is twinned to
+        areal_density, _ = m.get_quantification_maps(edges=["C_K_2", "Ti_L3"])
+        np.testing.assert_allclose(areal_density[0].data, self.values[0])
+        assert len(areal_density) == 2
+        areal_density, _ = m.get_quantification_maps()
+        assert len(areal_density) == 2
+
+        edge.intensity.twin = None
+        with pytest.raises(ValueError, match="Both the C_K and C_K_2 edges"):
+            m.get_quantification_maps()
+        with pytest.raises(ValueError, match="no edges"):
+            m.get_quantification_maps(edges=[])
+
+    def test_unknown_std(self):
+        m = self.create_model()
+        m.components.Ti_L3.intensity.map["std"] = np.nan
+        areal_density, composition = m.get_quantification_maps()
+        assert "variance" in areal_density[0].metadata.Signal.Noise_properties
+        assert "Noise_properties" not in areal_density[1].metadata.Signal
+        assert "Noise_properties" not in composition[0].metadata.Signal
+
 
 @lazifyTestClass
 class TestEELSFineStructure:
@@ -288,3 +288,78 @@ def test_multiple_linear_parameters_convolution(nav_dim):
         np.testing.assert_allclose(l2.A.map["values"].mean(), l_ref2.A.value)
         np.testing.assert_allclose(l2.centre.map["values"].mean(), l_ref2.centre.value)
         np.testing.assert_allclose(l2.gamma.map["values"].mean(), l_ref2.gamma.value)
+
+
+class TestLinearMultifit:
+    def setup_method(self, method):
+        rng = np.random.default_rng(0)
+        s = EELSSpectrum(np.ones((2, 3, 600)))
+        s.set_microscope_parameters(100, 10, 10)
+        s.axes_manager[-1].offset = 250
+        s.axes_manager[-1].scale = 0.5
+        s.add_elements(("C", "N"))
+        m = s.create_model(GOS="hydrogenic")
+        m.assign_current_values_to_all()
+        background = m.components.PowerLaw
+        # The exponent of the background varies from pixel to pixel
+        background.r.map["values"] = rng.uniform(2.5, 3.5, (2, 3))
+        background.A.map["values"] = rng.uniform(1, 2, (2, 3)) * 1e9
+        for edge in m.edges:
+            edge.intensity.map["values"] = rng.uniform(1, 2, (2, 3)) * 1e4
+        m.set_parameters_not_free(only_nonlinear=True)
+        self.s, self.m = s, m
+        self.parameters = [background.A] + [edge.intensity for edge in m.edges]
+
+    def _simulate(self):
+        self.m.fetch_stored_values()
+        self.s.data[:] = self.m.as_signal().data
+        expected = [p.map["values"].copy() for p in self.parameters]
+        for p in self.parameters:
+            p.map["values"] = 0.0
+        return expected
+
+    @pytest.mark.parametrize("optimizer", ("lstsq", "nnls"))
+    def test_linear_multifit(self, optimizer):
+        expected = self._simulate()
+        self.m.linear_multifit(optimizer=optimizer, calculate_errors=True)
+        for p, values in zip(self.parameters, expected):
+            np.testing.assert_allclose(p.map["values"], values, rtol=1e-6)
+            assert np.all(np.isfinite(p.map["std"]))
+        np.testing.assert_allclose(self.m.as_signal().data, self.s.data, rtol=1e-6)
+
+    def test_linear_multifit_convolved(self):
+        ll = EELSSpectrum(np.zeros((2, 3, 40)))
+        ll.axes_manager[-1].scale = 0.5
+        ll.axes_manager[-1].offset = -10
+        ll.data[..., 20] = np.arange(1, 7).reshape(2, 3)
+        ll.data[..., 22] = 1
+        self.m.low_loss = ll
+        expected = self._simulate()
+        self.m.linear_multifit()
+        for p, values in zip(self.parameters, expected):
+            np.testing.assert_allclose(p.map["values"], values, rtol=1e-6)
+
+    def test_linear_multifit_twin_and_range(self):
+        C_K, N_K = self.m.edges
+        N_K.intensity.twin_function_expr = "2 * x"
+        N_K.intensity.twin = C_K.intensity
+        N_K.intensity.map["values"] = 2 * C_K.intensity.map["values"]
+        expected = self._simulate()
+        self.m.set_signal_range(300, 500)
+        mask = np.zeros((2, 3), dtype=bool)
+        mask[0, 0] = True
+        self.m.linear_multifit(mask=mask)
+        np.testing.assert_allclose(
+            C_K.intensity.map["values"][~mask], expected[1][~mask], rtol=1e-6
+        )
+        np.testing.assert_allclose(
+            N_K.intensity.map["values"][~mask], 2 * expected[1][~mask], rtol=1e-6
+        )
+        assert C_K.intensity.map["values"][0, 0] == 0
+
+    def test_linear_multifit_errors(self):
+        self.m.components.C_K.onset_energy.free = True
+        with pytest.raises(RuntimeError, match="Not all free parameters are linear"):
+            self.m.linear_multifit()
+        with pytest.raises(ValueError, match="not supported"):
+            self.m.linear_multifit(optimizer="ridge")
@@ -327,6 +327,66 @@ class TestFourierRatioDeconvolution:
         s.fourier_ratio_deconvolution(s_ll, extrapolate_lowloss=extrapolate_lowloss)
 
 
+def _richardson_lucy_reference(signal, kernel, iterations):
+    # Direct convolutions of the original implementation
+    size = signal.size
+    imax = kernel.argmax()
+    result = signal.copy()
+    mimax = size - 1 - imax
+    for _ in range(iterations):
+        first = np.convolve(kernel, result)[imax : imax + size]
+        result *= np.convolve(kernel[::-1], signal / first)[mimax : mimax + size]
+    return result
+
+
+@lazifyTestClass
+class TestRichardsonLucyDeconvolution:
+    def setup_method(self, method):
+        rng = np.random.default_rng(0)
+        x = np.arange(100)
+        self.signal = exspy.signals.EELSSpectrum(
+            rng.poisson(50, (3, 4, 100)).astype(float) + 1
+        )
+        self.psf = exspy.signals.EELSSpectrum(np.exp(-(((x - 20) / 3) ** 2)) + 1e-3)
+        self.psf_map = exspy.signals.EELSSpectrum(
+            np.exp(-(((x - rng.integers(10, 90, (3, 4, 1))) / 3) ** 2)) + 1e-3
+        )
+
+    @pytest.mark.parametrize("navigation", [False, True])
+    def test_deconvolution(self, navigation):
+        s = self.signal
+        psf = self.psf_map if navigation else self.psf
+        deconvolved = s.richardson_lucy_deconvolution(psf, iterations=10)
+        assert deconvolved._lazy == s._lazy
+        if s._lazy:
+            deconvolved.compute()
+            s.compute()
+            psf.compute()
+        kernels = np.broadcast_to(psf.data, s.data.shape).reshape(-1, 100)
+        expected = [
+            _richardson_lucy_reference(signal, kernel, 10)
+            for signal, kernel in zip(s.data.reshape(-1, 100), kernels)
+        ]
+        np.testing.assert_allclose(
+            deconvolved.data, np.reshape(expected, s.data.shape), rtol=1e-10
+        )
+        assert deconvolved.metadata.General.title.endswith(
+            "after Richardson-Lucy deconvolution 10 iterations"
+        )
+
+    def test_float32(self):
+        s = self.signal
+        s.change_dtype("float32")
+        self.psf.change_dtype("float32")
+        assert s.richardson_lucy_deconvolution(self.psf).data.dtype == np.float32
+
+    def test_shape_errors(self):
+        with pytest.raises(ValueError, match="signal axis of the psf"):
+            self.signal.richardson_lucy_deconvolution(self.psf.isig[:50])
+        with pytest.raises(ValueError, match="navigation shape of the psf"):
+            self.signal.richardson_lucy_deconvolution(self.psf_map.inav[:2])
+
+
 @lazifyTestClass
 class TestRebin:
     def setup_method(self, method):
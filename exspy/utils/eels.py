@@ -18,6 +18,7 @@
 
 
 from exspy._misc.eels.effective_angle import effective_angle
+from exspy._misc.eels.gos_store import convert_gos_to_store
 from exspy._misc.eels.electron_inelastic_mean_free_path import (
     iMFP_angular_correction,
     iMFP_Iakoubovskii,
@@ -30,6 +31,7 @@ from exspy._misc.eels.tools import (
 
 
 __all__ = [
+    "convert_gos_to_store",
     "effective_angle",
     "get_edges_near_energy",
     "get_info_from_edges",